@@ -39,6 +39,7 @@ SOURCE_FILES = [
     "kin_extruder.c",
     "kin_shaper.c",
     "kin_idex.c",
+    "stepgen.c",
 ]
 DEST_LIB = "c_helper.so"
 OTHER_FILES = [
@@ -66,6 +67,8 @@ defs_stepcompress = """
         , uint32_t invert_sdir);
     void stepcompress_free(struct stepcompress *sc);
     int stepcompress_reset(struct stepcompress *sc, uint64_t last_step_clock);
+    int stepcompress_queue_steps(struct stepcompress *sc, int sdir
+        , uint64_t *clocks, int count);
     int stepcompress_set_last_position(struct stepcompress *sc
         , uint64_t clock, int64_t last_position);
     int64_t stepcompress_find_past_position(struct stepcompress *sc
@@ -103,12 +106,22 @@ defs_itersolve = """
     double itersolve_get_commanded_pos(struct stepper_kinematics *sk);
 """
 
+defs_stepgen = """
+    struct stepgen_thread *stepgen_thread_alloc(void);
+    void stepgen_thread_free(struct stepgen_thread *st);
+    int stepgen_thread_queue(struct stepgen_thread *st
+        , struct stepper_kinematics *sk);
+    void stepgen_thread_start(struct stepgen_thread *st, double flush_time);
+    int32_t stepgen_thread_wait(struct stepgen_thread *st);
+"""
+
 defs_trapq = """
     struct pull_move {
         double print_time, move_t;
         double start_v, accel;
         double start_x, start_y, start_z;
         double x_r, y_r, z_r;
+        double c3, c4;
     };
 
     struct trapq *trapq_alloc(void);
@@ -118,12 +131,19 @@ defs_trapq = """
         , double start_pos_x, double start_pos_y, double start_pos_z
         , double axes_r_x, double axes_r_y, double axes_r_z
         , double start_v, double cruise_v, double accel);
+    void trapq_append_scurve(struct trapq *tq, double print_time
+        , double accel_t, double cruise_t, double decel_t
+        , double start_pos_x, double start_pos_y, double start_pos_z
+        , double axes_r_x, double axes_r_y, double axes_r_z
+        , double start_v, double cruise_v, double accel);
     void trapq_finalize_moves(struct trapq *tq, double print_time
         , double clear_history_time);
     void trapq_set_position(struct trapq *tq, double print_time
         , double pos_x, double pos_y, double pos_z);
     int trapq_extract_old(struct trapq *tq, struct pull_move *p, int max
         , double start_time, double end_time);
+    int trapq_get_positions(struct trapq *tq, double *times, int count
+        , double *out);
 """
 
 defs_kin_cartesian = """
@@ -177,6 +197,15 @@ defs_kin_shaper = """
     int input_shaper_set_sk(struct stepper_kinematics *sk
         , struct stepper_kinematics *orig_sk);
     struct stepper_kinematics * input_shaper_alloc(void);
+    int input_shaper_set_shaped_trapq(struct stepper_kinematics *sk
+        , struct shaped_trapq *sq);
+    struct shaped_trapq *shaped_trapq_alloc(struct trapq *tq);
+    void shaped_trapq_free(struct shaped_trapq *sq);
+    void shaped_trapq_reset(struct shaped_trapq *sq);
+    int shaped_trapq_set_shaper_params(struct shaped_trapq *sq, char axis
+        , int n, double a[], double t[]);
+    int shaped_trapq_get_position(struct shaped_trapq *sq, double print_time
+        , double res[6]);
 """
 
 defs_kin_idex = """
@@ -246,6 +275,7 @@ defs_all = [
     defs_std,
     defs_stepcompress,
     defs_itersolve,
+    defs_stepgen,
     defs_trapq,
     defs_trdispatch,
     defs_kin_cartesian,
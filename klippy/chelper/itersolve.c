@@ -4,7 +4,7 @@
 //
 // This file may be distributed under the terms of the GNU GPLv3 license.
 
-#include <math.h> // fabs
+#include <math.h> // fabs, sqrt
 #include <stddef.h> // offsetof
 #include <string.h> // memset
 #include "compiler.h" // __visible
@@ -25,7 +25,7 @@ struct timepos {
 #define SEEK_TIME_RESET 0.000100
 
 // Generate step times for a portion of a move
-static int32_t
+int32_t
 itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
                           , double abs_start, double abs_end)
 {
@@ -128,6 +128,124 @@ itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
 }
 
 
+/****************************************************************
+ * Analytic solver for linear kinematics
+ ****************************************************************/
+
+// Find the time (in the range low_time to high_time) that a move
+// reaches the given distance.  The distance must be monotonic in the
+// range, increasing if 'inc' is set and decreasing otherwise.
+static inline double
+solve_move_time(struct move *m, double dist, int inc
+                , double low_time, double high_time)
+{
+    double v = m->start_v, ha = m->half_accel, t;
+    if (!ha) {
+        t = dist / v;
+    } else {
+        // Solve ha*t^2 + v*t - dist = 0 avoiding cancellation errors
+        double disc = v*v + 4. * ha * dist;
+        double q = disc > 0. ? sqrt(disc) : 0.;
+        if (inc)
+            t = v >= 0. ? 2. * dist / (v + q) : (q - v) / (2. * ha);
+        else
+            t = v <= 0. ? 2. * dist / (v - q) : (-v - q) / (2. * ha);
+    }
+    if (!(t >= low_time)) // or NaN
+        return low_time;
+    if (t > high_time)
+        return high_time;
+    return t;
+}
+
+// Generate steps for a portion of a move where the stepper position
+// changes monotonically
+static int32_t
+linear_gen_steps_piece(struct stepper_kinematics *sk, struct move *m
+                       , double base, double ratio
+                       , double start, double end, int inc)
+{
+    double half_step = .5 * sk->step_dist;
+    double end_pos = base + ratio * move_get_distance(m, end);
+    int sdir = (ratio > 0.) == inc;
+    double step = sdir ? half_step + half_step : -half_step - half_step;
+    double commanded_pos = sk->commanded_pos;
+    double target = commanded_pos + .5 * step;
+    double last_time = start;
+    if (sdir ? end_pos >= commanded_pos : end_pos <= commanded_pos)
+        // Stepper reaches the last step position - don't roll it back
+        if (sdir == stepcompress_get_step_dir(sk->sc))
+            stepcompress_commit(sk->sc);
+    while (sdir ? end_pos >= target : end_pos <= target) {
+        double dist = (target - base) / ratio;
+        double step_time = solve_move_time(m, dist, inc, last_time, end);
+        int ret = stepcompress_append(sk->sc, sdir, m->print_time, step_time);
+        if (ret)
+            return ret;
+        last_time = step_time;
+        target += step;
+    }
+    sk->commanded_pos = target - .5 * step;
+    return 0;
+}
+
+// Generate step times for a portion of a move using a closed form
+// (the stepper position must be dot(lc, coord) during the move)
+int32_t
+itersolve_gen_steps_linear(struct stepper_kinematics *sk, struct move *m
+                           , struct coord *lc
+                           , double abs_start, double abs_end)
+{
+    if (m->c3 || m->c4)
+        // S-curve moves are not quadratic - use the iterative solver
+        return itersolve_gen_steps_range(sk, m, abs_start, abs_end);
+    double start = abs_start - m->print_time, end = abs_end - m->print_time;
+    if (start < 0.)
+        start = 0.;
+    if (end > m->move_t)
+        end = m->move_t;
+    double ratio = (lc->x * m->axes_r.x + lc->y * m->axes_r.y
+                    + lc->z * m->axes_r.z);
+    if (ratio && end > start) {
+        double base = (lc->x * m->start_pos.x + lc->y * m->start_pos.y
+                       + lc->z * m->start_pos.z);
+        // Split the range at any change in direction
+        double v = m->start_v, ha = m->half_accel, turn_time = end;
+        if (ha)
+            turn_time = -v / (2. * ha);
+        int ret;
+        if (turn_time > start && turn_time < end) {
+            ret = linear_gen_steps_piece(sk, m, base, ratio, start, turn_time
+                                         , v > 0.);
+            if (ret)
+                return ret;
+            ret = linear_gen_steps_piece(sk, m, base, ratio, turn_time, end
+                                         , v <= 0.);
+        } else {
+            ret = linear_gen_steps_piece(sk, m, base, ratio, start, end
+                                         , v + ha * (start + end) >= 0.);
+        }
+        if (ret)
+            return ret;
+    }
+    if (sk->post_cb)
+        sk->post_cb(sk);
+    return 0;
+}
+
+static inline int32_t
+gen_steps_range(struct stepper_kinematics *sk, struct move *m
+                , double abs_start, double abs_end)
+{
+    if (sk->gen_steps_cb)
+        return sk->gen_steps_cb(sk, m, abs_start, abs_end);
+    if (sk->is_linear)
+        return itersolve_gen_steps_linear(sk, m, &sk->linear_coeff
+                                          , abs_start, abs_end);
+    return itersolve_gen_steps_range(sk, m, abs_start, abs_end);
+}
+
+
 /****************************************************************
  * Interface functions
  ****************************************************************/
@@ -170,16 +288,15 @@ itersolve_generate_steps(struct stepper_kinematics *sk, double flush_time)
                 while (--skip_count && pm->print_time > abs_start)
                     pm = list_prev_entry(pm, node);
                 do {
-                    int32_t ret = itersolve_gen_steps_range(sk, pm, abs_start
-                                                            , flush_time);
+                    int32_t ret = gen_steps_range(sk, pm, abs_start
+                                                  , flush_time);
                     if (ret)
                         return ret;
                     pm = list_next_entry(pm, node);
                 } while (pm != m);
             }
             // Generate steps for this move
-            int32_t ret = itersolve_gen_steps_range(sk, m, last_flush_time
-                                                    , flush_time);
+            int32_t ret = gen_steps_range(sk, m, last_flush_time, flush_time);
             if (ret)
                 return ret;
             if (move_end >= flush_time) {
@@ -195,8 +312,7 @@ itersolve_generate_steps(struct stepper_kinematics *sk, double flush_time)
                 double abs_end = force_steps_time;
                 if (abs_end > flush_time)
                     abs_end = flush_time;
-                int32_t ret = itersolve_gen_steps_range(sk, m, last_flush_time
-                                                        , abs_end);
+                int32_t ret = gen_steps_range(sk, m, last_flush_time, abs_end);
                 if (ret)
                     return ret;
                 skip_count = 1;
@@ -278,3 +394,14 @@ itersolve_get_commanded_pos(struct stepper_kinematics *sk)
 {
     return sk->commanded_pos;
 }
+
+// Enable the analytic step solver for a linear stepper position
+void
+itersolve_set_linear(struct stepper_kinematics *sk
+                     , double cx, double cy, double cz)
+{
+    sk->is_linear = 1;
+    sk->linear_coeff.x = cx;
+    sk->linear_coeff.y = cy;
+    sk->linear_coeff.z = cz;
+}
@@ -2,16 +2,19 @@
 #define ITERSOLVE_H
 
 #include <stdint.h> // int32_t
+#include "trapq.h" // struct coord
 
 enum {
     AF_X = 1 << 0, AF_Y = 1 << 1, AF_Z = 1 << 2,
 };
 
 struct stepper_kinematics;
-struct move;
 typedef double (*sk_calc_callback)(struct stepper_kinematics *sk, struct move *m
                                    , double move_time);
 typedef void (*sk_post_callback)(struct stepper_kinematics *sk);
+typedef int32_t (*sk_gen_steps_callback)(struct stepper_kinematics *sk
+                                         , struct move *m
+                                         , double abs_start, double abs_end);
 struct stepper_kinematics {
     double step_dist, commanded_pos;
     struct stepcompress *sc;
@@ -23,8 +26,25 @@ struct stepper_kinematics {
 
     sk_calc_callback calc_position_cb;
     sk_post_callback post_cb;
+
+    // Kinematics where the stepper position is a linear combination
+    // of the cartesian axes may set is_linear to enable the analytic
+    // step time solver (position = dot(linear_coeff, coord))
+    int is_linear;
+    struct coord linear_coeff;
+    // Optional override of the step generation for a range of a move
+    sk_gen_steps_callback gen_steps_cb;
+    // Set if step generation updates state shared with other steppers
+    // using the same trapq (see stepgen.c)
+    int tq_shared_state;
 };
 
+int32_t itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
+                                  , double abs_start, double abs_end);
+int32_t itersolve_gen_steps_linear(struct stepper_kinematics *sk
+                                   , struct move *m, struct coord *lc
+                                   , double abs_start, double abs_end);
+
 int32_t itersolve_generate_steps(struct stepper_kinematics *sk
                                  , double flush_time);
 double itersolve_check_active(struct stepper_kinematics *sk, double flush_time);
@@ -37,5 +57,7 @@ double itersolve_calc_position_from_coord(struct stepper_kinematics *sk
 void itersolve_set_position(struct stepper_kinematics *sk
                             , double x, double y, double z);
 double itersolve_get_commanded_pos(struct stepper_kinematics *sk);
+void itersolve_set_linear(struct stepper_kinematics *sk
+                          , double cx, double cy, double cz);
 
 #endif // itersolve.h
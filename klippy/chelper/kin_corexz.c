@@ -31,10 +31,13 @@ corexz_stepper_alloc(char type)
 {
     struct stepper_kinematics *sk = malloc(sizeof(*sk));
     memset(sk, 0, sizeof(*sk));
-    if (type == '+')
+    if (type == '+') {
         sk->calc_position_cb = corexz_stepper_plus_calc_position;
-    else if (type == '-')
+        itersolve_set_linear(sk, 1., 0., 1.);
+    } else if (type == '-') {
         sk->calc_position_cb = corexz_stepper_minus_calc_position;
+        itersolve_set_linear(sk, 1., 0., -1.);
+    }
     sk->active_flags = AF_X | AF_Z;
     return sk;
 }
@@ -26,30 +26,47 @@
 //         / ((smooth_time/2)**2))
 
 // Calculate the definitive integral of the motion formula:
-//   position(t) = base + t * (start_v + t * half_accel)
+//   position(t) = c[0] + t * (c[1] + t * (c[2] + t * (c[3] + t * c[4])))
 static double
-extruder_integrate(double base, double start_v, double half_accel
-                   , double start, double end)
+extruder_integrate(const double *c, double start, double end)
 {
-    double half_v = .5 * start_v, sixth_a = (1. / 3.) * half_accel;
-    double si = start * (base + start * (half_v + start * sixth_a));
-    double ei = end * (base + end * (half_v + end * sixth_a));
+    double i1 = .5 * c[1], i2 = (1. / 3.) * c[2], i3 = .25 * c[3];
+    double i4 = .2 * c[4];
+    double si = start * (c[0] + start * (i1 + start * (i2 + start * (
+                                             i3 + start * i4))));
+    double ei = end * (c[0] + end * (i1 + end * (i2 + end * (i3 + end * i4))));
     return ei - si;
 }
 
 // Calculate the definitive integral of time weighted position:
-//   weighted_position(t) = t * (base + t * (start_v + t * half_accel))
+//   weighted_position(t) = t * position(t)
 static double
-extruder_integrate_time(double base, double start_v, double half_accel
-                        , double start, double end)
+extruder_integrate_time(const double *c, double start, double end)
 {
-    double half_b = .5 * base, third_v = (1. / 3.) * start_v;
-    double eighth_a = .25 * half_accel;
-    double si = start * start * (half_b + start * (third_v + start * eighth_a));
-    double ei = end * end * (half_b + end * (third_v + end * eighth_a));
+    double i0 = .5 * c[0], i1 = (1. / 3.) * c[1], i2 = .25 * c[2];
+    double i3 = .2 * c[3], i4 = (1. / 6.) * c[4];
+    double si = start * start * (i0 + start * (i1 + start * (i2 + start * (
+                                                   i3 + start * i4))));
+    double ei = end * end * (i0 + end * (i1 + end * (i2 + end * (
+                                             i3 + end * i4))));
     return ei - si;
 }
 
+// Fill the coefficients of the position and velocity of a move
+static void
+move_get_poly(struct move *m, double base, double *pos, double *vel)
+{
+    pos[0] = base;
+    pos[1] = vel[0] = m->start_v;
+    pos[2] = m->half_accel;
+    vel[1] = 2. * m->half_accel;
+    pos[3] = m->c3;
+    vel[2] = 3. * m->c3;
+    pos[4] = m->c4;
+    vel[3] = 4. * m->c4;
+    vel[4] = 0.;
+}
+
 // Calculate the definitive integral of extruder for a given move
 static double
 pa_move_integrate(struct move *m, double pressure_advance
@@ -72,20 +89,22 @@ pa_move_integrate(struct move *m, double pressure_advance
         if (!can_pressure_advance)
             pressure_advance = 0.;
     }
-    // Calculate base position and velocity with pressure advance
-    base += pressure_advance * m->start_v;
-    double start_v = m->start_v + pressure_advance * 2. * m->half_accel;
+    // Calculate position with pressure advance
+    double c[5], vel[5];
+    move_get_poly(m, base, c, vel);
+    int i;
+    for (i = 0; i < 5; i++)
+        c[i] += pressure_advance * vel[i];
     // Calculate definitive integral
-    double ha = m->half_accel;
-    double iext = extruder_integrate(base, start_v, ha, start, end);
-    double wgt_ext = extruder_integrate_time(base, start_v, ha, start, end);
+    double iext = extruder_integrate(c, start, end);
+    double wgt_ext = extruder_integrate_time(c, start, end);
     return wgt_ext - time_offset * iext;
 }
 
-// Calculate the definitive integral of the extruder over a range of moves
+// Calculate the definitive integral of the extruder by walking each move
 static double
-pa_range_integrate(struct move *m, double move_time
-                   , double pressure_advance, double hst)
+pa_range_walk_integrate(struct move *m, double move_time
+                        , double pressure_advance, double hst)
 {
     // Calculate integral for the current move
     double res = 0., start = move_time - hst, end = move_time + hst;
@@ -111,6 +130,136 @@ pa_range_integrate(struct move *m, double move_time
     return res;
 }
 
+// Windows spanning moves use cumulative integrals of the extruder
+// position (i0) and time weighted position (i1).  Integrals are
+// relative to an anchor (time and position) that is periodically
+// advanced to limit the loss of precision in the differences.
+#define ANCHOR_TIME 2.0
+
+enum { MI_POS, MI_PA, MI_TRAPQ_PA };
+
+// Return the pressure advance weights of a move (see pa_move_integrate)
+static void
+pa_move_weights(struct move *m, double *w)
+{
+    w[MI_POS] = 1.;
+    w[MI_PA] = w[MI_TRAPQ_PA] = 0.;
+    if (m->axes_r.z != 0.)
+        w[MI_TRAPQ_PA] = m->axes_r.y;
+    else if (m->axes_r.y != 0.)
+        w[MI_PA] = 1.;
+}
+
+// Calculate the cumulative integrals at a time within a move
+static void
+pa_integral_at(struct move *m, double move_time, double *i0, double *i1)
+{
+    struct move_integral *mi = &m->integral;
+    double off = m->print_time - mi->anchor_time;
+    double base = m->start_pos.x - mi->anchor_pos;
+    double pos[5], vel[5];
+    move_get_poly(m, base, pos, vel);
+    double p0 = extruder_integrate(pos, 0., move_time);
+    double p1 = extruder_integrate_time(pos, 0., move_time);
+    double v0 = extruder_integrate(vel, 0., move_time);
+    double v1 = extruder_integrate_time(vel, 0., move_time);
+    double w[3];
+    pa_move_weights(m, w);
+    int i;
+    for (i = 0; i < 3; i++) {
+        double d0 = i == MI_POS ? p0 : w[i] * v0;
+        double d1 = i == MI_POS ? p1 : w[i] * v1;
+        i0[i] = mi->i0[i] + d0;
+        i1[i] = mi->i1[i] + d1 + off * d0;
+    }
+}
+
+// Make sure the cumulative integrals of a move are available
+static void
+pa_integral_fill(struct trapq *tq, struct move *m)
+{
+    if (likely(m->integral.valid))
+        return;
+    struct move *head_sentinel = list_first_entry(&tq->moves, struct move,node);
+    struct move *first = m;
+    for (;;) {
+        struct move *prev = list_prev_entry(first, node);
+        if (prev == head_sentinel || prev->integral.valid)
+            break;
+        first = prev;
+    }
+    for (;;) {
+        struct move *prev = list_prev_entry(first, node);
+        struct move_integral *mi = &first->integral;
+        if (prev == head_sentinel || (first->print_time
+                                      - prev->integral.anchor_time
+                                      >= ANCHOR_TIME)) {
+            // Start a new anchor at this move
+            memset(mi, 0, sizeof(*mi));
+            mi->anchor_time = first->print_time;
+            mi->anchor_pos = first->start_pos.x;
+        } else {
+            mi->anchor_time = prev->integral.anchor_time;
+            mi->anchor_pos = prev->integral.anchor_pos;
+            pa_integral_at(prev, prev->move_t, mi->i0, mi->i1);
+        }
+        mi->valid = 1;
+        if (first == m)
+            break;
+        first = list_next_entry(first, node);
+    }
+}
+
+// Return the combined cumulative integrals at a time within a move
+static void
+pa_integral_get(struct move *m, double move_time, double pressure_advance
+                , double *g0, double *g1)
+{
+    double i0[3], i1[3];
+    pa_integral_at(m, move_time, i0, i1);
+    *g0 = i0[MI_POS] + pressure_advance * i0[MI_PA] + i0[MI_TRAPQ_PA];
+    *g1 = i1[MI_POS] + pressure_advance * i1[MI_PA] + i1[MI_TRAPQ_PA];
+}
+
+// Calculate the definitive integral of the extruder over a range of moves
+static double
+pa_range_integrate(struct trapq *tq, struct move *m, double move_time
+                   , double pressure_advance, double hst)
+{
+    double start = move_time - hst, end = move_time + hst;
+    if (likely(start >= 0. && end <= m->move_t)) {
+        // Window is entirely within the current move
+        double res = pa_move_integrate(m, pressure_advance, 0., start
+                                       , move_time, start);
+        res -= pa_move_integrate(m, pressure_advance, 0., move_time, end, end);
+        return res;
+    }
+    // Find the moves at the start and end of the window
+    struct move *sm = m, *em = m;
+    while (start < 0.) {
+        sm = list_prev_entry(sm, node);
+        start += sm->move_t;
+    }
+    while (end > em->move_t) {
+        end -= em->move_t;
+        em = list_next_entry(em, node);
+    }
+    pa_integral_fill(tq, em);
+    double anchor_time = em->integral.anchor_time;
+    if (unlikely(sm->integral.anchor_time != anchor_time))
+        // Window crosses an anchor change
+        return pa_range_walk_integrate(m, move_time, pressure_advance, hst);
+    // Combine the cumulative integrals at the window start, middle and end
+    double s0, s1, m0, m1, e0, e1;
+    pa_integral_get(sm, start, pressure_advance, &s0, &s1);
+    pa_integral_get(m, move_time, pressure_advance, &m0, &m1);
+    pa_integral_get(em, end, pressure_advance, &e0, &e1);
+    double mid = m->print_time + move_time - anchor_time;
+    double res = (2. * m1 - s1 - e1 - (mid - hst) * (m0 - s0)
+                  + (mid + hst) * (e0 - m0));
+    return res + (em->integral.anchor_pos - m->start_pos.x) * hst * hst;
+}
+
 struct extruder_stepper {
     struct stepper_kinematics sk;
     double pressure_advance, half_smooth_time, inv_half_smooth_time2;
@@ -126,7 +275,8 @@ extruder_calc_position(struct stepper_kinematics *sk, struct move *m
         // Pressure advance not enabled
         return m->start_pos.x + move_get_distance(m, move_time);
     // Apply pressure advance and average over smooth_time
-    double area = pa_range_integrate(m, move_time, es->pressure_advance, hst);
+    double area = pa_range_integrate(sk->tq, m, move_time
+                                     , es->pressure_advance, hst);
     return m->start_pos.x + area * es->inv_half_smooth_time2;
 }
 
@@ -151,5 +301,7 @@ extruder_stepper_alloc(void)
     memset(es, 0, sizeof(*es));
     es->sk.calc_position_cb = extruder_calc_position;
     es->sk.active_flags = AF_X;
+    // Pressure advance integrals are cached in the trapq moves
+    es->sk.tq_shared_state = 1;
     return &es->sk;
 }
@@ -7,10 +7,12 @@
 
 #include <math.h> // sqrt, exp
 #include <stddef.h> // offsetof
+#include <stdint.h> // int64_t
 #include <stdlib.h> // malloc
 #include <string.h> // memset
 #include "compiler.h" // __visible
 #include "itersolve.h" // struct stepper_kinematics
+#include "list.h" // list_next_entry
 #include "trapq.h" // struct move
 
 
@@ -103,6 +105,274 @@ calc_position(struct move *m, int axis, double move_time
 }
 
 
+/****************************************************************
+ * Pre-shaped motion queue
+ ****************************************************************/
+
+// The shaped motion is the convolution of the piecewise polynomial
+// trapq motion with the shaper pulses, so it is also piecewise
+// polynomial (quadratic, or quartic with S-curve acceleration).  The
+// shaped_trapq stores those pieces as steps are generated for them, so
+// that shaped positions can be read without walking the trapq for
+// every shaper pulse.
+
+struct shaped_move {
+    double print_time, move_t;
+    // Position is c0 + c1*t + c2*t^2 + c3*t^3 + c4*t^4 (with t
+    // relative to print_time)
+    struct coord c0, c1, c2, c3, c4;
+};
+
+struct shaped_trapq {
+    struct trapq *tq;
+    struct shaper_pulses sp[3];
+    struct shaped_move *moves;
+    int count, size;
+    int64_t first_seq;
+    double end_time, flush_time, min_t, max_t;
+};
+
+#define SHAPED_HISTORY_TIME 30.
+
+// Discard all pieces (the trapq moves they came from may be changed)
+void __visible
+shaped_trapq_reset(struct shaped_trapq *sq)
+{
+    sq->first_seq += sq->count;
+    sq->count = 0;
+    sq->end_time = 0.;
+    // Note the range of pulse times over all axes
+    sq->min_t = sq->max_t = 0.;
+    int axis, i;
+    for (axis = 0; axis < 3; axis++) {
+        struct shaper_pulses *sp = &sq->sp[axis];
+        for (i = 0; i < sp->num_pulses; i++) {
+            double t = sp->pulses[i].t;
+            sq->min_t = t < sq->min_t ? t : sq->min_t;
+            sq->max_t = t > sq->max_t ? t : sq->max_t;
+        }
+    }
+}
+
+struct shaped_trapq * __visible
+shaped_trapq_alloc(struct trapq *tq)
+{
+    struct shaped_trapq *sq = malloc(sizeof(*sq));
+    memset(sq, 0, sizeof(*sq));
+    sq->tq = tq;
+    int axis;
+    for (axis = 0; axis < 3; axis++) {
+        sq->sp[axis].num_pulses = 1;
+        sq->sp[axis].pulses[0].a = 1.;
+    }
+    shaped_trapq_reset(sq);
+    return sq;
+}
+
+void __visible
+shaped_trapq_free(struct shaped_trapq *sq)
+{
+    free(sq->moves);
+    free(sq);
+}
+
+int __visible
+shaped_trapq_set_shaper_params(struct shaped_trapq *sq, char axis
+                               , int n, double a[], double t[])
+{
+    if (axis != 'x' && axis != 'y')
+        return -1;
+    struct shaper_pulses *sp = &sq->sp[axis - 'x'];
+    int status = init_shaper(n, a, t, sp);
+    if (!sp->num_pulses) {
+        // No shaping - use the trapq motion as is
+        sp->num_pulses = 1;
+        sp->pulses[0].t = 0.;
+        sp->pulses[0].a = 1.;
+    }
+    shaped_trapq_reset(sq);
+    return status;
+}
+
+// Drop old pieces and make room for new ones
+static int
+shaped_trapq_reserve(struct shaped_trapq *sq)
+{
+    if (sq->count && sq->moves[0].print_time + sq->moves[0].move_t
+                     < sq->end_time - SHAPED_HISTORY_TIME) {
+        int expire = 1;
+        while (expire < sq->count
+               && (sq->moves[expire].print_time + sq->moves[expire].move_t
+                   < sq->end_time - SHAPED_HISTORY_TIME))
+            expire++;
+        if (expire >= sq->count / 2) {
+            sq->count -= expire;
+            sq->first_seq += expire;
+            memmove(sq->moves, &sq->moves[expire]
+                    , sq->count * sizeof(sq->moves[0]));
+        }
+    }
+    if (sq->count < sq->size)
+        return 0;
+    int size = sq->size ? 2 * sq->size : 1024;
+    struct shaped_move *moves = realloc(sq->moves, size * sizeof(*moves));
+    if (!moves)
+        return -1;
+    sq->moves = moves;
+    sq->size = size;
+    return 0;
+}
+
+// Materialize the shaped motion up to the last step generation flush
+// time, starting from 'start_time' if the stored pieces end before that
+static void
+shaped_trapq_extend(struct shaped_trapq *sq, double start_time)
+{
+    struct trapq *tq = sq->tq;
+    trapq_check_sentinels(tq);
+    struct move *head = list_first_entry(&tq->moves, struct move, node);
+    struct move *tail = list_last_entry(&tq->moves, struct move, node);
+    struct move *first = list_next_entry(head, node);
+    if (first == tail)
+        return;
+    double horizon = tail->print_time - sq->max_t;
+    if (horizon > sq->flush_time)
+        horizon = sq->flush_time;
+    double s = sq->end_time;
+    if (s + sq->min_t < first->print_time) {
+        // The source moves are no longer available - start a new range
+        s = start_time;
+        if (s + sq->min_t < first->print_time)
+            return;
+    }
+    // Locate the source move for each pulse
+    struct move *src[3][ARRAY_SIZE(sq->sp[0].pulses)];
+    int axis, i;
+    for (axis = 0; axis < 3; axis++)
+        for (i = 0; i < sq->sp[axis].num_pulses; i++)
+            src[axis][i] = first;
+    double e = s;
+    while (s < horizon) {
+        // Advance to the source moves active after time 'e'
+        for (axis = 0; axis < 3; axis++) {
+            struct shaper_pulses *sp = &sq->sp[axis];
+            for (i = 0; i < sp->num_pulses; i++) {
+                struct move *m = src[axis][i];
+                double t = sp->pulses[i].t;
+                while (m != tail && m->print_time + m->move_t - t <= e)
+                    m = list_next_entry(m, node);
+                src[axis][i] = m;
+            }
+        }
+        // Find the end of this piece
+        e = horizon;
+        for (axis = 0; axis < 3; axis++) {
+            struct shaper_pulses *sp = &sq->sp[axis];
+            for (i = 0; i < sp->num_pulses; i++) {
+                struct move *m = src[axis][i];
+                double end = m->print_time + m->move_t - sp->pulses[i].t;
+                e = end < e ? end : e;
+            }
+        }
+        if (e > s) {
+            if (shaped_trapq_reserve(sq))
+                return;
+            struct shaped_move *sm = &sq->moves[sq->count];
+            memset(sm, 0, sizeof(*sm));
+            sm->print_time = s;
+            sm->move_t = e - s;
+            for (axis = 0; axis < 3; axis++) {
+                struct shaper_pulses *sp = &sq->sp[axis];
+                for (i = 0; i < sp->num_pulses; i++) {
+                    struct move *m = src[axis][i];
+                    double a = sp->pulses[i].a;
+                    double u = s + sp->pulses[i].t - m->print_time;
+                    double r = a * m->axes_r.axis[axis];
+                    double ha = m->half_accel, c3 = m->c3, c4 = m->c4;
+                    // Expand the move polynomial around time u
+                    sm->c0.axis[axis] += (a * m->start_pos.axis[axis]
+                                          + r * move_get_distance(m, u));
+                    sm->c1.axis[axis] += r * move_get_velocity(m, u);
+                    sm->c2.axis[axis] += r * (ha + (3. * c3 + 6. * c4 * u) * u);
+                    sm->c3.axis[axis] += r * (c3 + 4. * c4 * u);
+                    sm->c4.axis[axis] += r * c4;
+                }
+            }
+            sq->count++;
+            sq->end_time = e;
+        }
+        s = e;
+    }
+}
+
+// Find the shaped piece covering the given time (starting the search
+// from the piece at 'seq').  Returns NULL if it is not available.
+static struct shaped_move *
+shaped_trapq_find(struct shaped_trapq *sq, int64_t *seq, double time)
+{
+    int idx = *seq - sq->first_seq;
+    if (idx < 0 || idx >= sq->count)
+        idx = sq->count - 1;
+    if (idx < 0 || time > sq->end_time) {
+        shaped_trapq_extend(sq, time);
+        if (!sq->count || time > sq->end_time)
+            return NULL;
+        idx = sq->count - 1;
+    }
+    struct shaped_move *moves = sq->moves;
+    if (time < moves[idx].print_time) {
+        // Search backwards
+        if (time < moves[0].print_time)
+            return NULL;
+        while (time < moves[idx].print_time)
+            idx--;
+    } else {
+        while (idx < sq->count - 1 && time >= moves[idx + 1].print_time)
+            idx++;
+    }
+    struct shaped_move *sm = &moves[idx];
+    if (time > sm->print_time + sm->move_t)
+        // Time is in a gap between ranges
+        return NULL;
+    *seq = sq->first_seq + idx;
+    return sm;
+}
+
+static inline struct coord
+shaped_move_get_coord(struct shaped_move *sm, double move_time)
+{
+    double t = move_time;
+    struct coord c;
+    int axis;
+    for (axis = 0; axis < 3; axis++)
+        c.axis[axis] = sm->c0.axis[axis] + (
+            sm->c1.axis[axis] + (sm->c2.axis[axis] + (
+                sm->c3.axis[axis] + sm->c4.axis[axis] * t) * t) * t) * t;
+    return c;
+}
+
+// Report the shaped position and velocity at the given time
+int __visible
+shaped_trapq_get_position(struct shaped_trapq *sq, double print_time
+                          , double res[6])
+{
+    int64_t seq = sq->first_seq + sq->count - 1;
+    struct shaped_move *sm = shaped_trapq_find(sq, &seq, print_time);
+    if (!sm)
+        return -1;
+    double t = print_time - sm->print_time;
+    struct coord pos = shaped_move_get_coord(sm, t);
+    int axis;
+    for (axis = 0; axis < 3; axis++) {
+        res[axis] = pos.axis[axis];
+        res[axis + 3] = sm->c1.axis[axis] + (
+            2. * sm->c2.axis[axis] + (3. * sm->c3.axis[axis]
+                                      + 4. * sm->c4.axis[axis] * t) * t) * t;
+    }
+    return 0;
+}
+
+
 /****************************************************************
  * Kinematics-related shaper code
  ****************************************************************/
@@ -114,6 +384,8 @@ struct input_shaper {
     struct stepper_kinematics *orig_sk;
     struct move m;
     struct shaper_pulses sx, sy;
+    struct shaped_trapq *sq;
+    int64_t sq_seq;
 };
 
 // Optimized calc_position when only x axis is needed
@@ -156,6 +428,91 @@ shaper_xy_calc_position(struct stepper_kinematics *sk, struct move *m
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
 
+// calc_position using the pre-shaped motion queue
+static double
+shaper_sq_calc_position(struct stepper_kinematics *sk, struct move *m
+                        , double move_time)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    struct shaped_move *sm = shaped_trapq_find(is->sq, &is->sq_seq
+                                               , m->print_time + move_time);
+    if (!sm)
+        return shaper_xy_calc_position(sk, m, move_time);
+    is->m.start_pos = shaped_move_get_coord(
+        sm, m->print_time + move_time - sm->print_time);
+    return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
+}
+
+// Note that steps up to 'flush_time' are being generated
+static inline void
+shaper_sq_note_flush(struct input_shaper *is, double flush_time)
+{
+    if (flush_time > is->sq->flush_time)
+        is->sq->flush_time = flush_time;
+}
+
+// Generate steps using shaper_sq_calc_position
+static int32_t
+shaper_sq_gen_steps_range(struct stepper_kinematics *sk, struct move *m
+                          , double abs_start, double abs_end)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    shaper_sq_note_flush(is, abs_end);
+    return itersolve_gen_steps_range(sk, m, abs_start, abs_end);
+}
+
+// Generate steps directly from the pre-shaped motion queue for
+// kinematics with a linear stepper position
+static int32_t
+shaper_sq_gen_steps(struct stepper_kinematics *sk, struct move *m
+                    , double abs_start, double abs_end)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    shaper_sq_note_flush(is, abs_end);
+    double start = m->print_time, end = m->print_time + m->move_t;
+    if (abs_start > start)
+        start = abs_start;
+    if (abs_end < end)
+        end = abs_end;
+    struct coord *lc = &is->orig_sk->linear_coeff;
+    struct coord unit = { .x = 1. };
+    while (start < end) {
+        struct shaped_move *sm = shaped_trapq_find(is->sq, &is->sq_seq
+                                                   , start);
+        if (!sm)
+            // Shaped motion not available - use the iterative solver
+            return itersolve_gen_steps_range(sk, m, start, end);
+        double sm_end = sm->print_time + sm->move_t;
+        if (sm_end <= start)
+            // Start is exactly on the end of the available pieces
+            return itersolve_gen_steps_range(sk, m, start, end);
+        // Express the stepper position as a single axis move
+        struct move pm;
+        memset(&pm, 0, sizeof(pm));
+        pm.print_time = sm->print_time;
+        pm.move_t = sm->move_t;
+        pm.start_pos.x = (lc->x * sm->c0.x + lc->y * sm->c0.y
+                          + lc->z * sm->c0.z);
+        pm.start_v = lc->x * sm->c1.x + lc->y * sm->c1.y + lc->z * sm->c1.z;
+        pm.half_accel = (lc->x * sm->c2.x + lc->y * sm->c2.y
+                         + lc->z * sm->c2.z);
+        pm.c3 = lc->x * sm->c3.x + lc->y * sm->c3.y + lc->z * sm->c3.z;
+        pm.c4 = lc->x * sm->c4.x + lc->y * sm->c4.y + lc->z * sm->c4.z;
+        pm.axes_r.x = 1.;
+        double pm_end = sm_end < end ? sm_end : end;
+        int32_t ret;
+        if (pm.c3 || pm.c4)
+            // S-curve pieces use the iterative solver
+            ret = itersolve_gen_steps_range(sk, m, start, pm_end);
+        else
+            ret = itersolve_gen_steps_linear(sk, &pm, &unit, start, pm_end);
+        if (ret)
+            return ret;
+        start = sm_end;
+    }
+    return 0;
+}
+
 // A callback that forwards post_cb call to the original kinematics
 static void
 shaper_commanded_pos_post_fixup(struct stepper_kinematics *sk)
@@ -166,24 +523,35 @@ shaper_commanded_pos_post_fixup(struct stepper_kinematics *sk)
     sk->commanded_pos = is->orig_sk->commanded_pos;
 }
 
+static sk_calc_callback
+shaper_get_calc_callback(struct input_shaper *is
+                         , struct stepper_kinematics *orig_sk)
+{
+    if (is->sq)
+        return shaper_sq_calc_position;
+    if (orig_sk->active_flags == AF_X)
+        return shaper_x_calc_position;
+    else if (orig_sk->active_flags == AF_Y)
+        return shaper_y_calc_position;
+    else if (orig_sk->active_flags & (AF_X | AF_Y))
+        return shaper_xy_calc_position;
+    return NULL;
+}
+
 int __visible
 input_shaper_set_sk(struct stepper_kinematics *sk
                     , struct stepper_kinematics *orig_sk)
 {
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
-    if (orig_sk->active_flags == AF_X)
-        is->sk.calc_position_cb = shaper_x_calc_position;
-    else if (orig_sk->active_flags == AF_Y)
-        is->sk.calc_position_cb = shaper_y_calc_position;
-    else if (orig_sk->active_flags & (AF_X | AF_Y))
-        is->sk.calc_position_cb = shaper_xy_calc_position;
-    else
+    if (!(orig_sk->active_flags & (AF_X | AF_Y)))
         return -1;
+    is->sk.calc_position_cb = shaper_get_calc_callback(is, orig_sk);
     is->sk.active_flags = orig_sk->active_flags;
     is->orig_sk = orig_sk;
     is->sk.commanded_pos = orig_sk->commanded_pos;
     is->sk.last_flush_time = orig_sk->last_flush_time;
     is->sk.last_move_time = orig_sk->last_move_time;
+    is->sk.tq_shared_state = orig_sk->tq_shared_state;
     if (orig_sk->post_cb) {
         is->sk.post_cb = shaper_commanded_pos_post_fixup;
     }
@@ -206,6 +574,30 @@ shaper_note_generation_time(struct input_shaper *is)
     }
     is->sk.gen_steps_pre_active = pre_active;
     is->sk.gen_steps_post_active = post_active;
+    // Unshaped linear kinematics can use the analytic step solver
+    is->sk.is_linear = is->orig_sk->is_linear && !pre_active && !post_active;
+    is->sk.linear_coeff = is->orig_sk->linear_coeff;
+}
+
+// Read the shaped motion from a pre-shaped motion queue (if not NULL)
+int __visible
+input_shaper_set_shaped_trapq(struct stepper_kinematics *sk
+                              , struct shaped_trapq *sq)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    if (!is->orig_sk)
+        return -1;
+    is->sq = sq;
+    is->sq_seq = 0;
+    // The pre-shaped motion queue is filled in during step generation
+    is->sk.tq_shared_state = sq || is->orig_sk->tq_shared_state;
+    is->sk.calc_position_cb = shaper_get_calc_callback(is, is->orig_sk);
+    is->sk.gen_steps_cb = NULL;
+    if (sq && is->orig_sk->is_linear && !is->orig_sk->post_cb)
+        is->sk.gen_steps_cb = shaper_sq_gen_steps;
+    else if (sq)
+        is->sk.gen_steps_cb = shaper_sq_gen_steps_range;
+    return 0;
 }
 
 int __visible
@@ -105,34 +105,59 @@ minmax_point(struct stepcompress *sc, uint32_t *pos)
 static struct step_move
 compress_bisect_add(struct stepcompress *sc)
 {
-    uint32_t *qlast = sc->queue_next;
-    if (qlast > sc->queue_pos + 65535)
-        qlast = sc->queue_pos + 65535;
-    struct points point = minmax_point(sc, sc->queue_pos);
+    uint32_t *qfirst = sc->queue_pos, *qlast = sc->queue_next;
+    if (qlast > qfirst + 65535)
+        qlast = qfirst + 65535;
+    uint32_t lsc = sc->last_step_clock, max_error = sc->max_error;
+    struct points point = minmax_point(sc, qfirst);
     int32_t outer_mininterval = point.minp, outer_maxinterval = point.maxp;
     int32_t add = 0, minadd = -0x8000, maxadd = 0x7fff;
     int32_t bestinterval = 0, bestcount = 1, bestadd = 1, bestreach = INT32_MIN;
     int32_t zerointerval = 0, zerocount = 0;
 
     for (;;) {
-        // Find longest valid sequence with the given 'add'
+        // Find longest valid sequence with the given 'add'.  The
+        // interval bounds and their products with the step count are
+        // updated incrementally - a bound usually only moves by one,
+        // which avoids a division.
         struct points nextpoint;
         int32_t nextmininterval = outer_mininterval;
         int32_t nextmaxinterval = outer_maxinterval, interval = nextmaxinterval;
-        int32_t nextcount = 1;
+        int32_t minreach = nextmininterval, maxreach = nextmaxinterval;
+        int32_t nextcount = 1, addoffset = 0, addstep = 0;
+        uint32_t *pos = qfirst, prevpoint = *pos - lsc;
         for (;;) {
             nextcount++;
-            if (&sc->queue_pos[nextcount-1] >= qlast) {
+            pos++;
+            if (pos >= qlast) {
                 int32_t count = nextcount - 1;
                 return (struct step_move){ interval, count, add };
             }
-            nextpoint = minmax_point(sc, sc->queue_pos + nextcount - 1);
-            int32_t nextaddfactor = nextcount*(nextcount-1)/2;
-            int32_t c = add*nextaddfactor;
-            if (nextmininterval*nextcount < nextpoint.minp - c)
-                nextmininterval = idiv_up(nextpoint.minp - c, nextcount);
-            if (nextmaxinterval*nextcount > nextpoint.maxp - c)
-                nextmaxinterval = idiv_down(nextpoint.maxp - c, nextcount);
+            uint32_t p = *pos - lsc, point_error = (p - prevpoint) / 2;
+            if (point_error > max_error)
+                point_error = max_error;
+            prevpoint = p;
+            nextpoint = (struct points){ p - point_error, p };
+            addstep += add;
+            addoffset += addstep;
+            minreach += nextmininterval;
+            maxreach += nextmaxinterval;
+            int32_t mindiff = nextpoint.minp - addoffset - minreach;
+            if (unlikely(mindiff > nextcount)) {
+                nextmininterval = idiv_up(minreach + mindiff, nextcount);
+                minreach = nextmininterval * nextcount;
+            } else if (mindiff > 0) {
+                nextmininterval++;
+                minreach += nextcount;
+            }
+            int32_t maxdiff = maxreach - (nextpoint.maxp - addoffset);
+            if (unlikely(maxdiff > nextcount)) {
+                nextmaxinterval = idiv_down(maxreach - maxdiff, nextcount);
+                maxreach = nextmaxinterval * nextcount;
+            } else if (maxdiff > 0) {
+                nextmaxinterval--;
+                maxreach -= nextcount;
+            }
             if (nextmininterval > nextmaxinterval)
                 break;
             interval = nextmaxinterval;
@@ -201,18 +226,10 @@ compress_bisect_add(struct stepcompress *sc)
  * Step compress checking
  ****************************************************************/
 
-// Verify that a given 'step_move' matches the actual step times
-static int
-check_line(struct stepcompress *sc, struct step_move move)
+// Report a 'step_move' that does not match the actual step times
+static int noinline
+check_line_error(struct stepcompress *sc, struct step_move move)
 {
-    if (!CHECK_LINES)
-        return 0;
-    if (!move.count || (!move.interval && !move.add && move.count > 1)
-        || move.interval >= 0x80000000) {
-        errorf("stepcompress o=%d i=%d c=%d a=%d: Invalid sequence"
-               , sc->oid, move.interval, move.count, move.add);
-        return ERROR_RET;
-    }
     uint32_t interval = move.interval, p = 0;
     uint16_t i;
     for (i=0; i<move.count; i++) {
@@ -233,6 +250,37 @@ check_line(struct stepcompress *sc, struct step_move move)
         }
         interval += move.add;
     }
+    return ERROR_RET;
+}
+
+// Verify that a given 'step_move' matches the actual step times
+static int
+check_line(struct stepcompress *sc, struct step_move move)
+{
+    if (!CHECK_LINES)
+        return 0;
+    if (!move.count || (!move.interval && !move.add && move.count > 1)
+        || move.interval >= 0x80000000) {
+        errorf("stepcompress o=%d i=%d c=%d a=%d: Invalid sequence"
+               , sc->oid, move.interval, move.count, move.add);
+        return ERROR_RET;
+    }
+    // Same bounds as minmax_point(), checked without branches - the
+    // error is located and reported by check_line_error()
+    uint32_t *pos = sc->queue_pos, lsc = sc->last_step_clock;
+    uint32_t max_error = sc->max_error, prevpoint = 0;
+    uint32_t interval = move.interval, add = move.add, p = 0, bad = 0;
+    int i;
+    for (i=0; i<move.count; i++) {
+        uint32_t point = pos[i] - lsc, point_error = (point - prevpoint) / 2;
+        point_error = point_error > max_error ? max_error : point_error;
+        prevpoint = point;
+        p += interval;
+        bad |= (p < point - point_error) | (p > point) | (interval >> 31);
+        interval += add;
+    }
+    if (unlikely(bad))
+        return check_line_error(sc, move);
     return 0;
 }
 
@@ -538,6 +586,24 @@ stepcompress_commit(struct stepcompress *sc)
     return 0;
 }
 
+// Add a series of step clocks (used by the step compression benchmark)
+int __visible
+stepcompress_queue_steps(struct stepcompress *sc, int sdir
+                         , uint64_t *clocks, int count)
+{
+    int i;
+    for (i=0; i<count; i++) {
+        if (sc->next_step_clock) {
+            int ret = queue_append(sc);
+            if (ret)
+                return ret;
+        }
+        sc->next_step_clock = clocks[i];
+        sc->next_step_dir = sdir;
+    }
+    return 0;
+}
+
 // Flush pending steps
 static int
 stepcompress_flush(struct stepcompress *sc, uint64_t move_clock)
@@ -0,0 +1,165 @@
+// Background thread step generation
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+
+// Steppers on different mcus have independent step compression
+// queues, so once the content of the trapq is final their step
+// generation can run in parallel.  A 'stepgen_thread' runs the
+// itersolve step generation of a list of steppers (normally all the
+// steppers of one mcu) on a dedicated thread.  The host queues the
+// steppers, starts all threads, and then waits for all of them to
+// complete before modifying the trapq again.
+
+#include <pthread.h> // pthread_mutex_lock
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include "compiler.h" // __visible
+#include "itersolve.h" // itersolve_generate_steps
+#include "pyhelper.h" // report_errno
+#include "trapq.h" // trapq_check_sentinels
+
+enum { SG_IDLE, SG_RUN, SG_EXIT };
+
+struct stepgen_thread {
+    pthread_t tid;
+    pthread_mutex_t lock; // protects variables below
+    pthread_cond_t cond;
+    int state;
+    double flush_time;
+    int32_t result;
+    struct stepper_kinematics **sk_list;
+    int sk_count, sk_alloc;
+};
+
+// Generate the steps of all queued steppers
+static int32_t
+generate_steps(struct stepgen_thread *st)
+{
+    int i;
+    for (i = 0; i < st->sk_count; i++) {
+        struct stepper_kinematics *sk = st->sk_list[i];
+        if (sk->tq_shared_state)
+            pthread_mutex_lock(&sk->tq->lock);
+        int32_t ret = itersolve_generate_steps(sk, st->flush_time);
+        if (sk->tq_shared_state)
+            pthread_mutex_unlock(&sk->tq->lock);
+        if (ret)
+            return ret;
+    }
+    return 0;
+}
+
+// Main background thread loop
+static void *
+background_thread(void *data)
+{
+    struct stepgen_thread *st = data;
+    pthread_mutex_lock(&st->lock);
+    for (;;) {
+        if (st->state == SG_IDLE) {
+            pthread_cond_wait(&st->cond, &st->lock);
+            continue;
+        }
+        if (st->state == SG_EXIT)
+            break;
+        // The host does not access the queued steppers until complete
+        pthread_mutex_unlock(&st->lock);
+        int32_t ret = generate_steps(st);
+        pthread_mutex_lock(&st->lock);
+        st->result = ret;
+        st->sk_count = 0;
+        st->state = SG_IDLE;
+        pthread_cond_signal(&st->cond);
+    }
+    pthread_mutex_unlock(&st->lock);
+    return NULL;
+}
+
+// Create a new 'stepgen_thread' object
+struct stepgen_thread * __visible
+stepgen_thread_alloc(void)
+{
+    struct stepgen_thread *st = malloc(sizeof(*st));
+    memset(st, 0, sizeof(*st));
+    int ret = pthread_mutex_init(&st->lock, NULL);
+    if (ret)
+        goto fail;
+    ret = pthread_cond_init(&st->cond, NULL);
+    if (ret)
+        goto fail;
+    ret = pthread_create(&st->tid, NULL, background_thread, st);
+    if (ret)
+        goto fail;
+    return st;
+
+fail:
+    report_errno("stepgen_thread_alloc", ret);
+    free(st);
+    return NULL;
+}
+
+// Stop the background thread and free its resources
+void __visible
+stepgen_thread_free(struct stepgen_thread *st)
+{
+    if (!st)
+        return;
+    pthread_mutex_lock(&st->lock);
+    while (st->state == SG_RUN)
+        pthread_cond_wait(&st->cond, &st->lock);
+    st->state = SG_EXIT;
+    pthread_cond_signal(&st->cond);
+    pthread_mutex_unlock(&st->lock);
+    int ret = pthread_join(st->tid, NULL);
+    if (ret)
+        report_errno("pthread_join", ret);
+    free(st->sk_list);
+    free(st);
+}
+
+// Add a stepper to the list of steppers to generate steps for
+int __visible
+stepgen_thread_queue(struct stepgen_thread *st, struct stepper_kinematics *sk)
+{
+    if (st->sk_count >= st->sk_alloc) {
+        int new_alloc = st->sk_alloc ? st->sk_alloc * 2 : 8;
+        struct stepper_kinematics **sk_list = realloc(
+            st->sk_list, new_alloc * sizeof(*sk_list));
+        if (!sk_list)
+            return -1;
+        st->sk_list = sk_list;
+        st->sk_alloc = new_alloc;
+    }
+    // Update the trapq sentinels here so the threads only read them
+    if (sk->tq)
+        trapq_check_sentinels(sk->tq);
+    st->sk_list[st->sk_count++] = sk;
+    return 0;
+}
+
+// Start generating steps for the queued steppers
+void __visible
+stepgen_thread_start(struct stepgen_thread *st, double flush_time)
+{
+    if (!st->sk_count)
+        return;
+    pthread_mutex_lock(&st->lock);
+    st->flush_time = flush_time;
+    st->result = 0;
+    st->state = SG_RUN;
+    pthread_cond_signal(&st->cond);
+    pthread_mutex_unlock(&st->lock);
+}
+
+// Wait for step generation to complete and return its result
+int32_t __visible
+stepgen_thread_wait(struct stepgen_thread *st)
+{
+    pthread_mutex_lock(&st->lock);
+    while (st->state == SG_RUN)
+        pthread_cond_wait(&st->cond, &st->lock);
+    int32_t ret = st->result;
+    st->result = 0;
+    pthread_mutex_unlock(&st->lock);
+    return ret;
+}
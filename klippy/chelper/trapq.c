@@ -4,7 +4,7 @@
 //
 // This file may be distributed under the terms of the GNU GPLv3 license.
 
-#include <math.h> // sqrt
+#include <math.h> // NAN
 #include <stddef.h> // offsetof
 #include <stdlib.h> // malloc
 #include <string.h> // memset
@@ -24,7 +24,17 @@ move_alloc(void)
 inline double
 move_get_distance(struct move *m, double move_time)
 {
-    return (m->start_v + m->half_accel * move_time) * move_time;
+    return (m->start_v + (m->half_accel + (m->c3 + m->c4 * move_time)
+                          * move_time) * move_time) * move_time;
+}
+
+// Return the velocity given a time in a move
+inline double
+move_get_velocity(struct move *m, double move_time)
+{
+    return m->start_v + (2. * m->half_accel + (3. * m->c3 + 4. * m->c4
+                                               * move_time) * move_time
+                         ) * move_time;
 }
 
 // Return the XYZ coordinates given a time in a move
@@ -40,6 +50,63 @@ move_get_coord(struct move *m, double move_time)
 
 #define NEVER_TIME 9999999999999999.9
 
+// Return the history move at position 'pos' (0 is the oldest move)
+static inline struct move *
+hist_index_get(struct trapq *tq, int pos)
+{
+    return tq->hist_index[(tq->hist_first + pos) & (tq->hist_size - 1)];
+}
+
+// Note a move added to the head (newest end) of the history list
+static void
+hist_index_push(struct trapq *tq, struct move *m)
+{
+    if (tq->hist_count >= tq->hist_size) {
+        int new_size = tq->hist_size ? tq->hist_size * 2 : 256;
+        struct move **new_index = malloc(sizeof(*new_index) * new_size);
+        int i;
+        for (i=0; i<tq->hist_count; i++)
+            new_index[i] = hist_index_get(tq, i);
+        free(tq->hist_index);
+        tq->hist_index = new_index;
+        tq->hist_size = new_size;
+        tq->hist_first = 0;
+    }
+    int pos = (tq->hist_first + tq->hist_count) & (tq->hist_size - 1);
+    tq->hist_index[pos] = m;
+    tq->hist_count++;
+}
+
+// Note the removal of the newest move in the history list
+static inline void
+hist_index_pop_newest(struct trapq *tq)
+{
+    tq->hist_count--;
+}
+
+// Note the removal of the oldest move in the history list
+static inline void
+hist_index_pop_oldest(struct trapq *tq)
+{
+    tq->hist_first = (tq->hist_first + 1) & (tq->hist_size - 1);
+    tq->hist_count--;
+}
+
+// Find the newest history move starting before 'end_time' (or -1)
+static int
+hist_index_find(struct trapq *tq, double end_time)
+{
+    int low = 0, high = tq->hist_count;
+    while (low < high) {
+        int mid = (low + high) / 2;
+        if (hist_index_get(tq, mid)->print_time < end_time)
+            low = mid + 1;
+        else
+            high = mid;
+    }
+    return low - 1;
+}
+
 // Allocate a new 'trapq' object
 struct trapq * __visible
 trapq_alloc(void)
@@ -48,6 +115,7 @@ trapq_alloc(void)
     memset(tq, 0, sizeof(*tq));
     list_init(&tq->moves);
     list_init(&tq->history);
+    pthread_mutex_init(&tq->lock, NULL);
     struct move *head_sentinel = move_alloc(), *tail_sentinel = move_alloc();
     tail_sentinel->print_time = tail_sentinel->move_t = NEVER_TIME;
     list_add_head(&head_sentinel->node, &tq->moves);
@@ -69,6 +137,8 @@ trapq_free(struct trapq *tq)
         list_del(&m->node);
         free(m);
     }
+    free(tq->hist_index);
+    pthread_mutex_destroy(&tq->lock);
     free(tq);
 }
 
@@ -115,22 +185,38 @@ trapq_add_move(struct trapq *tq, struct move *m)
     tail_sentinel->print_time = 0.;
 }
 
-// Fill and add a move to the trapezoid velocity queue
-void __visible
-trapq_append(struct trapq *tq, double print_time
-             , double accel_t, double cruise_t, double decel_t
-             , double start_pos_x, double start_pos_y, double start_pos_z
-             , double axes_r_x, double axes_r_y, double axes_r_z
-             , double start_v, double cruise_v, double accel)
+// Fill the velocity terms of an acceleration (or deceleration) move
+static void
+move_set_accel(struct move *m, double start_v, double accel, int scurve)
+{
+    m->start_v = start_v;
+    if (!scurve) {
+        m->half_accel = .5 * accel;
+        return;
+    }
+    // S-curve acceleration follows a "smoothstep" velocity profile:
+    //   velocity(t) = start_v + accel * move_t * (3*u^2 - 2*u^3)
+    // with u = t / move_t.  The distance and duration of the move match
+    // those of a constant acceleration move, while the acceleration
+    // ramps from zero to a peak of 1.5 * accel and back to zero.
+    double inv_t = 1. / m->move_t;
+    m->c3 = accel * inv_t;
+    m->c4 = -.5 * accel * inv_t * inv_t;
+}
+
+// Fill and add a move with the given acceleration profile
+static void
+trapq_append_profile(struct trapq *tq, double print_time
+                     , double accel_t, double cruise_t, double decel_t
+                     , struct coord start_pos, struct coord axes_r
+                     , double start_v, double cruise_v, double accel
+                     , int scurve)
 {
-    struct coord start_pos = { .x=start_pos_x, .y=start_pos_y, .z=start_pos_z };
-    struct coord axes_r = { .x=axes_r_x, .y=axes_r_y, .z=axes_r_z };
     if (accel_t) {
         struct move *m = move_alloc();
         m->print_time = print_time;
         m->move_t = accel_t;
-        m->start_v = start_v;
-        m->half_accel = .5 * accel;
+        move_set_accel(m, start_v, accel, scurve);
         m->start_pos = start_pos;
         m->axes_r = axes_r;
         trapq_add_move(tq, m);
@@ -155,14 +241,42 @@ trapq_append(struct trapq *tq, double print_time
         struct move *m = move_alloc();
         m->print_time = print_time;
         m->move_t = decel_t;
-        m->start_v = cruise_v;
-        m->half_accel = -.5 * accel;
+        move_set_accel(m, cruise_v, -accel, scurve);
         m->start_pos = start_pos;
         m->axes_r = axes_r;
         trapq_add_move(tq, m);
     }
 }
 
+// Fill and add a move to the trapezoid velocity queue
+void __visible
+trapq_append(struct trapq *tq, double print_time
+             , double accel_t, double cruise_t, double decel_t
+             , double start_pos_x, double start_pos_y, double start_pos_z
+             , double axes_r_x, double axes_r_y, double axes_r_z
+             , double start_v, double cruise_v, double accel)
+{
+    struct coord start_pos = { .x=start_pos_x, .y=start_pos_y, .z=start_pos_z };
+    struct coord axes_r = { .x=axes_r_x, .y=axes_r_y, .z=axes_r_z };
+    trapq_append_profile(tq, print_time, accel_t, cruise_t, decel_t
+                         , start_pos, axes_r, start_v, cruise_v, accel, 0);
+}
+
+// Fill and add a move using S-curve acceleration and deceleration
+void __visible
+trapq_append_scurve(struct trapq *tq, double print_time
+                    , double accel_t, double cruise_t, double decel_t
+                    , double start_pos_x, double start_pos_y
+                    , double start_pos_z, double axes_r_x, double axes_r_y
+                    , double axes_r_z, double start_v, double cruise_v
+                    , double accel)
+{
+    struct coord start_pos = { .x=start_pos_x, .y=start_pos_y, .z=start_pos_z };
+    struct coord axes_r = { .x=axes_r_x, .y=axes_r_y, .z=axes_r_z };
+    trapq_append_profile(tq, print_time, accel_t, cruise_t, decel_t
+                         , start_pos, axes_r, start_v, cruise_v, accel, 1);
+}
+
 // Expire any moves older than `print_time` from the trapezoid velocity queue
 void __visible
 trapq_finalize_moves(struct trapq *tq, double print_time
@@ -180,9 +294,10 @@ trapq_finalize_moves(struct trapq *tq, double print_time
         if (m->print_time + m->move_t > print_time)
             break;
         list_del(&m->node);
-        if (m->start_v || m->half_accel)
+        if (m->start_v || m->half_accel || m->c3) {
             list_add_head(&m->node, &tq->history);
-        else
+            hist_index_push(tq, m);
+        } else
             free(m);
     }
     // Free old moves from history list
@@ -195,6 +310,7 @@ trapq_finalize_moves(struct trapq *tq, double print_time
             break;
         list_del(&m->node);
         free(m);
+        hist_index_pop_oldest(tq);
     }
 }
 
@@ -216,6 +332,7 @@ trapq_set_position(struct trapq *tq, double print_time
         }
         list_del(&m->node);
         free(m);
+        hist_index_pop_newest(tq);
     }
 
     // Add a marker to the trapq history
@@ -225,6 +342,7 @@ trapq_set_position(struct trapq *tq, double print_time
     m->start_pos.y = pos_y;
     m->start_pos.z = pos_z;
     list_add_head(&m->node, &tq->history);
+    hist_index_push(tq, m);
 }
 
 // Return history of movement queue
@@ -232,17 +350,17 @@ int __visible
 trapq_extract_old(struct trapq *tq, struct pull_move *p, int max
                   , double start_time, double end_time)
 {
-    int res = 0;
-    struct move *m;
-    list_for_each_entry(m, &tq->history, node) {
-        if (start_time >= m->print_time + m->move_t || res >= max)
+    int res = 0, pos = hist_index_find(tq, end_time);
+    for (; pos >= 0 && res < max; pos--) {
+        struct move *m = hist_index_get(tq, pos);
+        if (start_time >= m->print_time + m->move_t)
             break;
-        if (end_time <= m->print_time)
-            continue;
         p->print_time = m->print_time;
         p->move_t = m->move_t;
         p->start_v = m->start_v;
         p->accel = 2. * m->half_accel;
+        p->c3 = m->c3;
+        p->c4 = m->c4;
         p->start_x = m->start_pos.x;
         p->start_y = m->start_pos.y;
         p->start_z = m->start_pos.z;
@@ -254,3 +372,29 @@ trapq_extract_old(struct trapq *tq, struct pull_move *p, int max
     }
     return res;
 }
+
+// Fill 'out' with the x, y, z position and velocity of the history at
+// each of the given times (NAN if there is no history at that time)
+int __visible
+trapq_get_positions(struct trapq *tq, double *times, int count, double *out)
+{
+    int res = 0, i;
+    for (i=0; i<count; i++, out+=4) {
+        int pos = hist_index_find(tq, times[i]);
+        if (pos < 0) {
+            out[0] = out[1] = out[2] = out[3] = NAN;
+            continue;
+        }
+        struct move *m = hist_index_get(tq, pos);
+        double move_time = times[i] - m->print_time;
+        if (move_time > m->move_t)
+            move_time = m->move_t;
+        struct coord c = move_get_coord(m, move_time);
+        out[0] = c.x;
+        out[1] = c.y;
+        out[2] = c.z;
+        out[3] = move_get_velocity(m, move_time);
+        res++;
+    }
+    return res;
+}
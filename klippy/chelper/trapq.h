@@ -1,6 +1,7 @@
 #ifndef TRAPQ_H
 #define TRAPQ_H
 
+#include <pthread.h> // pthread_mutex_t
 #include "list.h" // list_node
 
 struct coord {
@@ -12,16 +13,31 @@ struct coord {
     };
 };
 
+// Cumulative integrals of a move's position (see kin_extruder.c)
+struct move_integral {
+    double anchor_time, anchor_pos;
+    double i0[3], i1[3];
+    int valid;
+};
+
 struct move {
     double print_time, move_t;
     double start_v, half_accel;
+    // Higher order terms of S-curve acceleration moves (see trapq.c)
+    double c3, c4;
     struct coord start_pos, axes_r;
+    struct move_integral integral;
 
     struct list_node node;
 };
 
 struct trapq {
     struct list_head moves, history;
+    // Serializes step generation that updates shared state (stepgen.c)
+    pthread_mutex_t lock;
+    // Ring buffer index of the history list (oldest move first)
+    struct move **hist_index;
+    int hist_size, hist_first, hist_count;
 };
 
 struct pull_move {
@@ -29,10 +45,12 @@ struct pull_move {
     double start_v, accel;
     double start_x, start_y, start_z;
     double x_r, y_r, z_r;
+    double c3, c4;
 };
 
 struct move *move_alloc(void);
 double move_get_distance(struct move *m, double move_time);
+double move_get_velocity(struct move *m, double move_time);
 struct coord move_get_coord(struct move *m, double move_time);
 struct trapq *trapq_alloc(void);
 void trapq_free(struct trapq *tq);
@@ -43,11 +61,19 @@ void trapq_append(struct trapq *tq, double print_time
                   , double start_pos_x, double start_pos_y, double start_pos_z
                   , double axes_r_x, double axes_r_y, double axes_r_z
                   , double start_v, double cruise_v, double accel);
+void trapq_append_scurve(struct trapq *tq, double print_time
+                         , double accel_t, double cruise_t, double decel_t
+                         , double start_pos_x, double start_pos_y
+                         , double start_pos_z, double axes_r_x
+                         , double axes_r_y, double axes_r_z
+                         , double start_v, double cruise_v, double accel);
 void trapq_finalize_moves(struct trapq *tq, double print_time
                           , double clear_history_time);
 void trapq_set_position(struct trapq *tq, double print_time
                         , double pos_x, double pos_y, double pos_z);
 int trapq_extract_old(struct trapq *tq, struct pull_move *p, int max
                       , double start_time, double end_time);
+int trapq_get_positions(struct trapq *tq, double *times, int count
+                        , double *out);
 
 #endif // trapq.h
@@ -0,0 +1,79 @@
+# Adaptive report time of host polled temperature sensors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+from . import heaters
+
+LIMIT_MARGIN = 5.0
+
+
+class AdaptiveReportTime:
+    def __init__(self, config, sensor, poll_client, report_time):
+        self.printer = config.get_printer()
+        self.sensor = sensor
+        self.poll_client = poll_client
+        self.report_time = self.current_report_time = report_time
+        self.max_report_time = config.getfloat(
+            "max_report_time", None, minval=report_time
+        )
+        self.stable_delta = config.getfloat(
+            "report_stable_delta", 0.1, above=0.0
+        )
+        self.ref_temp = None
+        self.heaters = None
+
+    def _lookup_heaters(self):
+        if self.heaters is None:
+            pheaters = self.printer.lookup_object("heaters")
+            self.heaters = [
+                heater
+                for heater in pheaters.heaters.values()
+                if heater.sensor is self.sensor
+            ]
+            if self.heaters:
+                # Heaters consider readings older than QUELL_STALE_TIME
+                # as invalid, keep a margin for the measurement delays
+                self.max_report_time = max(
+                    self.report_time,
+                    min(self.max_report_time, 0.5 * heaters.QUELL_STALE_TIME),
+                )
+        return self.heaters
+
+    def _heater_active(self, eventtime):
+        for heater in self._lookup_heaters():
+            if heater.get_temp(eventtime)[1] > 0.0:
+                return True
+        return False
+
+    def next_report_time(self, eventtime, temp, min_temp, max_temp):
+        # Report at the configured rate while the temperature changes,
+        # near its limits or while a heater using the sensor is active,
+        # and back off exponentially while it is stable.
+        if self.max_report_time is None:
+            return self.report_time
+        self._lookup_heaters()
+        if (
+            self.ref_temp is None
+            or abs(temp - self.ref_temp) > self.stable_delta
+            or temp < min_temp + LIMIT_MARGIN
+            or temp > max_temp - LIMIT_MARGIN
+            or self._heater_active(eventtime)
+        ):
+            self.ref_temp = temp
+            self.current_report_time = self.report_time
+        else:
+            self.current_report_time = min(
+                2.0 * self.current_report_time, self.max_report_time
+            )
+        return self.current_report_time
+
+    def note_target(self, target):
+        # A heater using the sensor got a target, restore the configured
+        # rate without waiting for the next (backed off) reading
+        if not target or self.current_report_time <= self.report_time:
+            return
+        self.current_report_time = self.report_time
+        reactor = self.printer.get_reactor()
+        self.poll_client.reschedule(reactor.monotonic())
+
+    def get_report_time(self):
+        return self.current_report_time
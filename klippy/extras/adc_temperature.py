@@ -3,6 +3,7 @@
 # Copyright (C) 2016-2018  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
+import array
 import bisect
 import logging
 
@@ -21,7 +22,7 @@ RANGE_CHECK_COUNT = 4
 # Interface between ADC and heater temperature callbacks
 class PrinterADCtoTemperature:
     def __init__(self, config, adc_convert):
-        self.adc_convert = adc_convert
+        self.adc_convert = ADCLookupTable(adc_convert)
         ppins = config.get_printer().lookup_object("pins")
         self.mcu_adc = ppins.setup_pin("adc", config.get("sensor_pin"))
         self.mcu_adc.setup_adc_callback(REPORT_TIME, self.adc_callback)
@@ -55,6 +56,75 @@ class PrinterADCtoTemperature:
         )
 
 
+######################################################################
+# ADC lookup table
+######################################################################
+
+TABLE_SIZE = 4096
+
+
+# Dense ADC indexed table of the temperatures of a converter
+class ADCLookupTable:
+    def __init__(self, adc_convert, size=TABLE_SIZE):
+        self.adc_convert = adc_convert
+        self.size = size
+        temps = [adc_convert.calc_temp(i / float(size)) for i in range(size)]
+        temps.append(adc_convert.calc_temp(1.0))
+        self.temps = array.array("d", temps)
+        # Only use the monotonic range around the middle of the table
+        # (the analytic forms may have poles at the extreme adc values)
+        mid = size // 2
+        sign = 1.0 if temps[mid + 1] > temps[mid] else -1.0
+        lo = mid
+        while lo > 0 and (temps[lo] - temps[lo - 1]) * sign > 0.0:
+            lo -= 1
+        hi = mid + 1
+        while hi < size and (temps[hi + 1] - temps[hi]) * sign > 0.0:
+            hi += 1
+        self.lo, self.hi = lo, hi
+        self.min_temp = self.max_temp = 0.0
+        if temps[hi] != temps[lo]:
+            self._setup_reverse(temps[lo : hi + 1], lo, sign < 0.0)
+
+    def _setup_reverse(self, temps, offset, reverse):
+        # Build a temperature indexed table of adc values
+        if reverse:
+            temps = temps[::-1]
+        count = len(temps) - 1
+        min_temp, max_temp = temps[0], temps[-1]
+        temp_step = (max_temp - min_temp) / self.size
+        adcs = []
+        pos = 0
+        for i in range(self.size + 1):
+            temp = min(min_temp + i * temp_step, max_temp)
+            while pos < count - 1 and temps[pos + 1] < temp:
+                pos += 1
+            t0, t1 = temps[pos], temps[pos + 1]
+            adc_pos = pos + (temp - t0) / (t1 - t0)
+            if reverse:
+                adc_pos = count - adc_pos
+            adcs.append((offset + adc_pos) / self.size)
+        self.adcs = array.array("d", adcs)
+        self.min_temp, self.max_temp = min_temp, max_temp
+        self.inv_temp_step = 1.0 / temp_step
+
+    def calc_temp(self, adc):
+        pos = adc * self.size
+        if pos < self.lo or pos >= self.hi:
+            return self.adc_convert.calc_temp(adc)
+        i = int(pos)
+        t0 = self.temps[i]
+        return t0 + (self.temps[i + 1] - t0) * (pos - i)
+
+    def calc_adc(self, temp):
+        if temp < self.min_temp or temp >= self.max_temp:
+            return self.adc_convert.calc_adc(temp)
+        pos = (temp - self.min_temp) * self.inv_temp_step
+        i = int(pos)
+        a0 = self.adcs[i]
+        return a0 + (self.adcs[i + 1] - a0) * (pos - i)
+
+
 ######################################################################
 # Linear interpolation
 ######################################################################
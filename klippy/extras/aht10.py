@@ -5,7 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 
-from . import bus
+from . import adaptive_report, bus
 from .danger_options import get_danger_options
 
 ######################################################################
@@ -37,7 +37,14 @@ class AHT10:
         self.mcu = self.i2c.get_mcu()
         self.report_time = config.getint("aht10_report_time", 30, minval=5)
         self.temp = self.min_temp = self.max_temp = self.humidity = 0.0
-        self.sample_timer = self.reactor.register_timer(self._sample_aht10)
+        self.poll_client = bus.lookup_i2c_poller(self.mcu).register_client(
+            self.i2c, self._sample_aht10
+        )
+        self.adaptive_report = adaptive_report.AdaptiveReportTime(
+            config, self, self.poll_client, self.report_time
+        )
+        # Wait 110ms after the measure command, 75ms minimum
+        self.poll_client.set_steps([(AHT10_COMMANDS["MEASURE"], 0.110, [], 6)])
         self.printer.add_object("aht10 " + self.name, self)
         self.printer.register_event_handler(
             "klippy:connect", self.handle_connect
@@ -48,10 +55,11 @@ class AHT10:
         )
         self.is_calibrated = False
         self.init_sent = False
+        self.busy_cycles = 0
 
     def handle_connect(self):
         self._init_aht10()
-        self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        self.poll_client.start(self.reactor.NOW)
 
     def setup_minmax(self, min_temp, max_temp):
         self.min_temp = min_temp
@@ -60,62 +68,40 @@ class AHT10:
     def setup_callback(self, cb):
         self._callback = cb
 
+    def note_target(self, target):
+        self.adaptive_report.note_target(target)
+
     def get_report_time_delta(self):
         return self.report_time
 
-    def _make_measurement(self):
-        if not self.init_sent:
+    def _make_measurement(self, responses):
+        # Returns True on a valid measurement, False to retry and None
+        # on error
+        if responses is None:
+            logging.warning("aht10: error reading data")
+            return None
+        data = responses[0]
+        if len(data) < 6:
+            logging.warning(
+                "aht10: received bytes less than"
+                + " expected 6 [%d]" % len(data)
+            )
             return False
 
-        data = None
-
-        is_busy = True
-        cycles = 0
-
-        try:
-            while is_busy:
-                # Check if we're constantly busy. If so, send soft-reset
-                # and issue warning.
-                if is_busy and cycles > AHT10_MAX_BUSY_CYCLES:
-                    logging.warning(
-                        "aht10: device reported busy after "
-                        + "%d cycles, resetting device" % AHT10_MAX_BUSY_CYCLES
-                    )
-                    self._reset_device()
-                    data = None
-                    break
-
-                cycles += 1
-                # Write command for updating temperature+status bit
-                self.i2c.i2c_write(AHT10_COMMANDS["MEASURE"])
-                # Wait 110ms after first read, 75ms minimum
-                self.reactor.pause(self.reactor.monotonic() + 0.110)
-
-                # Read data
-                read = self.i2c.i2c_read([], 6)
-                if read is None:
-                    logging.warning(
-                        "aht10: received data from" + " i2c_read is None"
-                    )
-                    continue
-                data = bytearray(read["response"])
-                if len(data) < 6:
-                    logging.warning(
-                        "aht10: received bytes less than"
-                        + " expected 6 [%d]" % len(data)
-                    )
-                    continue
-
-                self.is_calibrated = True if (data[0] & 0b00000100) else False
-                is_busy = True if (data[0] & 0b01000000) else False
-
-            if is_busy:
-                return False
-        except Exception as e:
-            logging.exception(
-                "aht10: exception encountered" + " reading data: %s" % str(e)
-            )
+        self.is_calibrated = True if (data[0] & 0b00000100) else False
+        if data[0] & 0b01000000:
+            # Check if we're constantly busy. If so, send soft-reset
+            # and issue warning.
+            self.busy_cycles += 1
+            if self.busy_cycles > AHT10_MAX_BUSY_CYCLES:
+                logging.warning(
+                    "aht10: device reported busy after "
+                    + "%d cycles, resetting device" % AHT10_MAX_BUSY_CYCLES
+                )
+                self._reset_device()
+                return None
             return False
+        self.busy_cycles = 0
 
         temp = ((data[3] & 0x0F) << 16) | (data[4] << 8) | data[5]
         self.temp = ((temp * 200) / 1048576) - 50
@@ -145,17 +131,15 @@ class AHT10:
         # Wait 100ms after init
         self.reactor.pause(self.reactor.monotonic() + 0.10)
         self.init_sent = True
+        self.busy_cycles = 0
 
-        if self._make_measurement():
-            logging.info(
-                "aht10: successfully initialized, initial temp: "
-                + "%.3f, humidity: %.3f" % (self.temp, self.humidity)
-            )
-
-    def _sample_aht10(self, eventtime):
-        if not self._make_measurement():
+    def _sample_aht10(self, eventtime, responses):
+        result = self._make_measurement(responses)
+        if result is None:
             self.temp = self.humidity = 0.0
             return self.reactor.NEVER
+        if not result:
+            return self.reactor.monotonic()
 
         if (
             self.temp < self.min_temp
@@ -170,12 +154,15 @@ class AHT10:
         measured_time = self.reactor.monotonic()
         print_time = self.i2c.get_mcu().estimated_print_time(measured_time)
         self._callback(print_time, self.temp)
-        return measured_time + self.report_time
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
     def get_status(self, eventtime):
         return {
             "temperature": round(self.temp, 2),
             "humidity": self.humidity,
+            "report_time": self.adaptive_report.get_report_time(),
         }
 
 
@@ -5,7 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 
-from . import bus
+from . import adaptive_report, bus
 from .danger_options import get_danger_options
 
 REPORT_TIME = 0.8
@@ -119,6 +119,8 @@ NB_CONV_0 = 0
 EAS_NEW_DATA = 1 << 7
 GAS_DONE = 1 << 6
 MEASURE_DONE = 1 << 5
+# EAS_STATUS_0 through GAS_R_LSB
+BME680_DATA_LEN = 15
 RESET_CHIP_VALUE = 0xB6
 
 BME_CHIPS = {
@@ -189,9 +191,16 @@ class BME280:
         self.temp = self.pressure = self.humidity = self.gas = self.t_fine = 0.0
         self.min_temp = self.max_temp = self.range_switching_error = 0.0
         self.max_sample_time = None
-        self.dig = self.sample_timer = None
+        self.dig = self.sample_handler = None
         self.chip_type = "BMP280"
         self.chip_registers = BME280_REGS
+        self.run_gas = False
+        self.poll_client = bus.lookup_i2c_poller(self.mcu).register_client(
+            self.i2c, self._sample
+        )
+        self.adaptive_report = adaptive_report.AdaptiveReportTime(
+            config, self, self.poll_client, REPORT_TIME
+        )
         self.printer.add_object("bme280 " + self.name, self)
         if self.printer.get_start_args().get("debugoutput") is not None:
             return
@@ -206,7 +215,7 @@ class BME280:
 
     def handle_connect(self):
         self._init_bmxx80()
-        self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        self.poll_client.start(self.reactor.NOW)
 
     def setup_minmax(self, min_temp, max_temp):
         self.min_temp = min_temp
@@ -215,6 +224,9 @@ class BME280:
     def setup_callback(self, cb):
         self._callback = cb
 
+    def note_target(self, target):
+        self.adaptive_report.note_target(target)
+
     def get_report_time_delta(self):
         return REPORT_TIME
 
@@ -353,10 +365,10 @@ class BME280:
                 + ((2.3 * self.os_pres) + 0.575)
                 + ((2.3 * self.os_hum) + 0.575)
             ) / 1000
-            self.sample_timer = self.reactor.register_timer(self._sample_bme680)
+            self.sample_handler = self._sample_bme680
             self.chip_registers = BME680_REGS
         elif self.chip_type == "BMP180":
-            self.sample_timer = self.reactor.register_timer(self._sample_bmp180)
+            self.sample_handler = self._sample_bmp180
             self.chip_registers = BMP180_REGS
         elif self.chip_type == "BMP388":
             self.chip_registers = BMP388_REGS
@@ -374,7 +386,7 @@ class BME280:
             self.write_register("ORD", [BMP388_REG_VAL_ODR_50_HZ])
             self.write_register("INT_CTRL", [BMP388_REG_VAL_DRDY_EN])
 
-            self.sample_timer = self.reactor.register_timer(self._sample_bmp388)
+            self.sample_handler = self._sample_bmp388
         elif self.chip_type == "BME280":
             self.max_sample_time = (
                 1.25
@@ -382,13 +394,13 @@ class BME280:
                 + ((2.3 * self.os_pres) + 0.575)
                 + ((2.3 * self.os_hum) + 0.575)
             ) / 1000
-            self.sample_timer = self.reactor.register_timer(self._sample_bme280)
+            self.sample_handler = self._sample_bme280
             self.chip_registers = BME280_REGS
         else:
             self.max_sample_time = (
                 1.25 + (2.3 * self.os_temp) + ((2.3 * self.os_pres) + 0.575)
             ) / 1000
-            self.sample_timer = self.reactor.register_timer(self._sample_bme280)
+            self.sample_handler = self._sample_bme280
             self.chip_registers = BME280_REGS
 
         # Read out and calculate the trimming parameters
@@ -464,20 +476,55 @@ class BME280:
             # Set initial heater current to reach Gas heater target on start
             self.write_register("IDAC_HEAT_0", 96)
 
-    def _sample_bme280(self, eventtime):
+        self._setup_poll_steps()
+
+    def _setup_poll_steps(self):
+        regs = self.chip_registers
+        if self.chip_type == "BME680":
+            # Check VOC once a while
+            self.run_gas = self.reactor.monotonic() - self.last_gas_time > 3
+            max_sample_time = self.max_sample_time
+            if self.run_gas:
+                gas_config = RUN_GAS | NB_CONV_0
+                self.write_register("CTRL_GAS_1", [gas_config])
+                max_sample_time += self.gas_heat_duration / 1000
+            # Enter forced mode and read status, data and gas registers
+            meas = self.os_temp << 5 | self.os_pres << 2 | MODE
+            steps = [
+                (
+                    [regs["CTRL_MEAS"], meas],
+                    max_sample_time,
+                    [regs["EAS_STATUS_0"]],
+                    BME680_DATA_LEN,
+                )
+            ]
+        elif self.chip_type == "BMP180":
+            meas_temp = regs["CRV_TEMP"]
+            meas_pres = regs["CRV_PRES"] | (self.os_pres << 6)
+            steps = [
+                ([regs["CTRL_MEAS"], meas_temp], 0.01, [regs["REG_MSB"]], 2),
+                ([regs["CTRL_MEAS"], meas_pres], 0.01, [regs["REG_MSB"]], 3),
+            ]
+        elif self.chip_type == "BMP388":
+            # Burst read of status, pressure and temperature registers
+            steps = [(None, 0.0, [regs["STATUS"]], 7)]
+        elif self.chip_type == "BME280":
+            steps = [(None, 0.0, [regs["PRESSURE_MSB"]], 8)]
+        else:
+            steps = [(None, 0.0, [regs["PRESSURE_MSB"]], 6)]
+        self.poll_client.set_steps(steps)
+
+    def _sample(self, eventtime, responses):
+        return self.sample_handler(eventtime, responses)
+
+    def _sample_bme280(self, eventtime, responses):
         # In normal mode data shadowing is performed
         # So reading can be done while measurements are in process
-        try:
-            if self.chip_type == "BME280":
-                data = self.read_register("PRESSURE_MSB", 8)
-            elif self.chip_type == "BMP280":
-                data = self.read_register("PRESSURE_MSB", 6)
-            else:
-                return self.reactor.NEVER
-        except Exception:
-            logging.exception("BME280: Error reading data")
+        if responses is None:
+            logging.error("BME280: Error reading data")
             self.temp = self.pressure = self.humidity = 0.0
             return self.reactor.NEVER
+        data = responses[0]
 
         temp_raw = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
         self.temp = self._compensate_temp(temp_raw)
@@ -495,12 +542,18 @@ class BME280:
             )
         measured_time = self.reactor.monotonic()
         self._callback(self.mcu.estimated_print_time(measured_time), self.temp)
-        return measured_time + REPORT_TIME
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
-    def _sample_bmp388(self, eventtime):
-        status = self.read_register("STATUS", 1)
+    def _sample_bmp388(self, eventtime, responses):
+        if responses is None:
+            logging.error("BMP388: Error reading data")
+            self.temp = self.pressure = 0.0
+            return self.reactor.NEVER
+        status = responses[0]
         if status[0] & 0b100000:
-            self.temp = self._sample_bmp388_temp()
+            self.temp = self._sample_bmp388_temp(status[4:7])
             if self.temp < self.min_temp or self.temp > self.max_temp:
                 self.printer.invoke_shutdown(
                     "BME280 temperature %0.1f outside range of %0.1f:%.01f"
@@ -508,17 +561,17 @@ class BME280:
                 )
 
         if status[0] & 0b010000:
-            self.pressure = self._sample_bmp388_press() / 100.0
+            self.pressure = self._sample_bmp388_press(status[1:4]) / 100.0
 
         measured_time = self.reactor.monotonic()
         self._callback(self.mcu.estimated_print_time(measured_time), self.temp)
-        return measured_time + REPORT_TIME
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
-    def _sample_bmp388_temp(self):
-        xlsb = self.read_register("TEMP_XLSB", 1)
-        lsb = self.read_register("TEMP_LSB", 1)
-        msb = self.read_register("TEMP_MSB", 1)
-        adc_T = (msb[0] << 16) + (lsb[0] << 8) + (xlsb[0])
+    def _sample_bmp388_temp(self, data):
+        xlsb, lsb, msb = data
+        adc_T = (msb << 16) + (lsb << 8) + xlsb
 
         partial_data1 = adc_T - self.dig["T1"]
         partial_data2 = self.dig["T2"] * partial_data1
@@ -534,11 +587,9 @@ class BME280:
 
         return self.t_fine
 
-    def _sample_bmp388_press(self):
-        xlsb = self.read_register("PRESS_XLSB", 1)
-        lsb = self.read_register("PRESS_LSB", 1)
-        msb = self.read_register("PRESS_MSB", 1)
-        adc_P = (msb[0] << 16) + (lsb[0] << 8) + (xlsb[0])
+    def _sample_bmp388_press(self, data):
+        xlsb, lsb, msb = data
+        adc_P = (msb << 16) + (lsb << 8) + xlsb
 
         partial_data1 = self.dig["P6"] * self.t_fine
         partial_data2 = self.dig["P7"] * (self.t_fine * self.t_fine)
@@ -570,7 +621,7 @@ class BME280:
 
         return comp_press
 
-    def _sample_bme680(self, eventtime):
+    def _sample_bme680(self, eventtime, responses):
         def data_ready(stat, run_gas):
             new_data = stat & EAS_NEW_DATA
             gas_done = not (stat & GAS_DONE)
@@ -579,38 +630,28 @@ class BME280:
                 gas_done = True
             return new_data and gas_done and meas_done
 
-        run_gas = False
-        # Check VOC once a while
-        if self.reactor.monotonic() - self.last_gas_time > 3:
-            gas_config = RUN_GAS | NB_CONV_0
-            self.write_register("CTRL_GAS_1", [gas_config])
-            run_gas = True
-
-        # Enter forced mode
-        meas = self.os_temp << 5 | self.os_pres << 2 | MODE
-        self.write_register("CTRL_MEAS", meas)
-        max_sample_time = self.max_sample_time
-        if run_gas:
-            max_sample_time += self.gas_heat_duration / 1000
-        self.reactor.pause(self.reactor.monotonic() + max_sample_time)
+        if responses is None:
+            logging.error("BME680: Error reading data")
+            self.temp = self.pressure = self.humidity = self.gas = 0.0
+            return self.reactor.NEVER
+        run_gas = self.run_gas
+        data = responses[0]
         try:
             # wait until results are ready
-            status = self.read_register("EAS_STATUS_0", 1)[0]
-            while not data_ready(status, run_gas):
+            while not data_ready(data[0], run_gas):
                 self.reactor.pause(
                     self.reactor.monotonic() + self.max_sample_time
                 )
-                status = self.read_register("EAS_STATUS_0", 1)[0]
-
-            data = self.read_register("PRESSURE_MSB", 8)
-            gas_data = [0, 0]
-            if run_gas:
-                gas_data = self.read_register("GAS_R_MSB", 2)
+                data = self.read_register("EAS_STATUS_0", BME680_DATA_LEN)
         except Exception:
             logging.exception("BME680: Error reading data")
             self.temp = self.pressure = self.humidity = self.gas = 0.0
             return self.reactor.NEVER
 
+        gas_data = [0, 0]
+        if run_gas:
+            gas_data = data[13:15]
+        data = data[2:10]
         temp_raw = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
         if temp_raw != 0x80000:
             self.temp = self._compensate_temp(temp_raw)
@@ -640,36 +681,24 @@ class BME280:
                 "BME680 temperature %0.1f outside range of %0.1f:%.01f"
                 % (self.temp, self.min_temp, self.max_temp)
             )
+        self._setup_poll_steps()
         measured_time = self.reactor.monotonic()
         self._callback(self.mcu.estimated_print_time(measured_time), self.temp)
-        return measured_time + REPORT_TIME
-
-    def _sample_bmp180(self, eventtime):
-        meas = self.chip_registers["CRV_TEMP"]
-        self.write_register("CTRL_MEAS", meas)
-
-        try:
-            self.reactor.pause(self.reactor.monotonic() + 0.01)
-            data = self.read_register("REG_MSB", 2)
-            temp_raw = (data[0] << 8) | data[1]
-        except Exception:
-            logging.exception("BMP180: Error reading temperature")
-            self.temp = self.pressure = 0.0
-            return self.reactor.NEVER
-
-        meas = self.chip_registers["CRV_PRES"] | (self.os_pres << 6)
-        self.write_register("CTRL_MEAS", meas)
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
-        try:
-            self.reactor.pause(self.reactor.monotonic() + 0.01)
-            data = self.read_register("REG_MSB", 3)
-            pressure_raw = ((data[0] << 16) | (data[1] << 8) | data[2]) >> (
-                8 - self.os_pres
-            )
-        except Exception:
-            logging.exception("BMP180: Error reading pressure")
+    def _sample_bmp180(self, eventtime, responses):
+        if responses is None:
+            logging.error("BMP180: Error reading data")
             self.temp = self.pressure = 0.0
             return self.reactor.NEVER
+        data = responses[0]
+        temp_raw = (data[0] << 8) | data[1]
+        data = responses[1]
+        pressure_raw = ((data[0] << 16) | (data[1] << 8) | data[2]) >> (
+            8 - self.os_pres
+        )
 
         self.temp = self._compensate_temp_bmp180(temp_raw)
         self.pressure = self._compensate_pressure_bmp180(pressure_raw) / 100.0
@@ -680,7 +709,9 @@ class BME280:
             )
         measured_time = self.reactor.monotonic()
         self._callback(self.mcu.estimated_print_time(measured_time), self.temp)
-        return measured_time + REPORT_TIME
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
     def _compensate_temp(self, raw_temp):
         dig = self.dig
@@ -877,7 +908,11 @@ class BME280:
         self.i2c.i2c_write(data)
 
     def get_status(self, eventtime):
-        data = {"temperature": round(self.temp, 2), "pressure": self.pressure}
+        data = {
+            "temperature": round(self.temp, 2),
+            "pressure": self.pressure,
+            "report_time": self.adaptive_report.get_report_time(),
+        }
         if self.chip_type in ("BME280", "BME680"):
             data["humidity"] = self.humidity
         if self.chip_type == "BME680":
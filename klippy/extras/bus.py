@@ -3,6 +3,8 @@
 # Copyright (C) 2018,2019  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
+import logging
+
 from klippy import mcu
 
 
@@ -302,6 +304,9 @@ class MCU_I2C:
     def i2c_read(self, write, read_len, retry=True):
         return self.i2c_read_cmd.send([self.oid, write, read_len], retry)
 
+    def add_i2c_read(self, batch, write, read_len):
+        batch.add_query(self.i2c_read_cmd, [self.oid, write, read_len])
+
 
 def MCU_I2C_from_config(config, default_addr=None, default_speed=100000):
     # Load bus parameters
@@ -331,6 +336,150 @@ def MCU_I2C_from_config(config, default_addr=None, default_speed=100000):
     return MCU_I2C(i2c_mcu, bus, addr, speed, sw_pins)
 
 
+######################################################################
+# I2C sensor polling
+######################################################################
+
+# Clients due within this time of each other are polled together
+POLL_BATCH_TIME = 0.100
+# Resend missing reads for up to 5 seconds like a single i2c_read query
+POLL_RETRIES = int(mcu.QueryBatch.TIMEOUT_TIME / mcu.QueryBatch.RETRY_TIME)
+
+
+# Periodic read of a device registered with an I2CPoller
+class I2CPollClient:
+    def __init__(self, poller, i2c, callback, retries):
+        self.poller = poller
+        self.i2c = i2c
+        self.callback = callback
+        self.retries = retries
+        self.steps = []
+        self.next_time = poller.reactor.NEVER
+
+    def set_steps(self, steps):
+        # Each step is a (write, delay, read_reg, read_len) tuple.  The
+        # write (if not None) is sent first and read_len bytes are read
+        # from read_reg after delay seconds.
+        self.steps = steps
+
+    def start(self, waketime):
+        self.poller.schedule(self, waketime)
+
+    def stop(self):
+        self.poller.schedule(self, self.poller.reactor.NEVER)
+
+    def reschedule(self, waketime):
+        # Move an already scheduled poll earlier
+        if waketime < self.next_time < self.poller.reactor.NEVER:
+            self.poller.schedule(self, waketime)
+
+
+# Poll the i2c devices of an mcu with one batch of queries per step
+class I2CPoller:
+    def __init__(self, mcu):
+        self.mcu = mcu
+        self.reactor = mcu.get_printer().get_reactor()
+        self.clients = []
+        self.poll_timer = self.reactor.register_timer(self._poll_event)
+
+    def register_client(self, i2c, callback, retries=POLL_RETRIES):
+        # A read without a response is resent up to 'retries' times
+        # before None is passed to the callback of this client
+        client = I2CPollClient(self, i2c, callback, retries)
+        self.clients.append(client)
+        return client
+
+    def schedule(self, client, waketime):
+        client.next_time = waketime
+        next_time = min([c.next_time for c in self.clients])
+        self.reactor.update_timer(self.poll_timer, next_time)
+
+    def _read_step(self, steps):
+        responses = [None] * len(steps)
+        pending = list(range(len(steps)))
+        attempt = 0
+        while pending:
+            batch = self.mcu.create_query_batch()
+            for i in pending:
+                client, (write, step_delay, reg, read_len) = steps[i]
+                client.i2c.add_i2c_read(batch, reg, read_len)
+            for i, params in zip(pending, batch.send(retry=False)):
+                if params is not None:
+                    responses[i] = bytearray(params["response"])
+            # Only resend the reads that failed
+            attempt += 1
+            pending = [
+                i
+                for i in pending
+                if responses[i] is None and steps[i][0].retries >= attempt
+            ]
+        return responses
+
+    def _run_step(self, steps):
+        delay = 0.0
+        for client, (write, step_delay, reg, read_len) in steps:
+            if write is not None:
+                client.i2c.i2c_write_noack(write)
+            delay = max(delay, step_delay)
+        if delay:
+            self.reactor.pause(self.reactor.monotonic() + delay)
+        return self._read_step(steps)
+
+    def _poll_event(self, eventtime):
+        batch_time = eventtime + POLL_BATCH_TIME
+        clients = [
+            c for c in self.clients if c.steps and c.next_time <= batch_time
+        ]
+        client_steps = [(c, list(c.steps)) for c in clients]
+        step_count = max([len(steps) for c, steps in client_steps] + [0])
+        responses = {c: [] for c in clients}
+        for c in clients:
+            c.next_time = self.reactor.NEVER
+        for i in range(step_count):
+            # Clients with a failed read do not run their later steps
+            steps = [
+                (c, s[i])
+                for c, s in client_steps
+                if i < len(s) and responses[c] is not None
+            ]
+            try:
+                step_responses = self._run_step(steps)
+            except Exception:
+                logging.exception("i2c: Error polling devices")
+                step_responses = [None] * len(steps)
+            for (c, step), data in zip(steps, step_responses):
+                if data is None:
+                    responses[c] = None
+                else:
+                    responses[c].append(data)
+        for c in clients:
+            try:
+                c.next_time = c.callback(eventtime, responses[c])
+            except Exception:
+                # Stop polling this device only
+                logging.exception("i2c: Error in device poll callback")
+                c.next_time = self.reactor.NEVER
+        return min([c.next_time for c in self.clients])
+
+
+class PrinterI2CPollers:
+    def __init__(self):
+        self.mcu_to_poller = {}
+
+
+def lookup_i2c_poller(mcu):
+    printer = mcu.get_printer()
+    ppollers = printer.lookup_object("i2c_poll", None)
+    if ppollers is None:
+        ppollers = PrinterI2CPollers()
+        printer.add_object("i2c_poll", ppollers)
+    poller = ppollers.mcu_to_poller.get(mcu)
+    if poller is None:
+        poller = I2CPoller(mcu)
+        ppollers.mcu_to_poller[mcu] = poller
+    return poller
+
+
 ######################################################################
 # Bus synchronized digital outputs
 ######################################################################
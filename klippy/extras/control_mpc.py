@@ -1,8 +1,12 @@
 import logging
 import math
 
+from klippy import mathutil
+
 AMBIENT_TEMP = 25.0
 PIN_MIN_TIME = 0.100
+DT_TOLERANCE = 0.0001
+PREDICTION_SMOOTH_TIME = 30.0
 
 FILAMENT_TEMP_SRC_AMBIENT = "ambient"
 FILAMENT_TEMP_SRC_FIXED = "fixed"
@@ -28,6 +32,8 @@ class ControlMPC:
         self.last_loss_filament = 0.0
         self.last_time = 0.0
         self.last_temp_time = 0.0
+        self.last_prediction_error = 0.0
+        self.prediction_error_sq = 0.0
 
         self.printer = heater.printer
         self.toolhead = None
@@ -103,7 +109,7 @@ class ControlMPC:
                     )
                 self.filament_temp_src = (FILAMENT_TEMP_SRC_FIXED, value)
 
-        self._update_filament_const()
+        self._update_model_const()
 
     cmd_MPC_CALIBRATE_help = "Run MPC calibration"
 
@@ -132,10 +138,10 @@ class ControlMPC:
         ]
         self.const_maximum_retract = self.profile["maximum_retract"]
         self.filament_temp_src = self.profile["filament_temp_src"]
-        self._update_filament_const()
         self.ambient_sensor = self.profile["ambient_temp_sensor"]
         self.cooling_fan = self.profile["cooling_fan"]
         self.const_fan_ambient_transfer = self.profile["fan_ambient_transfer"]
+        self._update_model_const()
 
     def is_valid(self):
         return (
@@ -164,6 +170,48 @@ class ControlMPC:
             * self.const_filament_heat_capacity  # J/g/K
         )
 
+    def _update_model_const(self):
+        self._update_filament_const()
+        if self.const_block_heat_capacity is not None:
+            self.heating_gain = (
+                self.const_block_heat_capacity / self.const_target_reach_time
+            )
+        # Invalidate the cached per interval coefficients
+        self.coeff_dt = None
+        self.fan_speed = None
+        self.fan_ambient_transfer = self.const_ambient_transfer
+
+    def _update_step_coefficients(self, dt):
+        # Discrete time coefficients of the model for a sample interval
+        self.coeff_dt = dt
+        self.coeff_block = dt / self.const_block_heat_capacity
+        self.coeff_sensor = self.const_sensor_responsiveness * dt
+        self.coeff_smoothing = 1.0 - (1.0 - self.const_smoothing) ** dt
+        self.coeff_steady_state = self.const_steady_state_rate * dt
+        self.coeff_min_ambient = self.const_min_ambient_change * dt
+        self.coeff_prediction = min(1.0, dt / PREDICTION_SMOOTH_TIME)
+
+    def _get_ambient_transfer(self, read_time):
+        # Modulate ambient transfer coefficient with fan speed
+        if not self.cooling_fan or len(self.const_fan_ambient_transfer) <= 1:
+            return self.const_ambient_transfer
+        fan_speed = max(
+            0.0, min(1.0, self.cooling_fan.get_status(read_time)["speed"])
+        )
+        if fan_speed == self.fan_speed:
+            return self.fan_ambient_transfer
+        fan_break = fan_speed * (len(self.const_fan_ambient_transfer) - 1)
+        below = self.const_fan_ambient_transfer[math.floor(fan_break)]
+        above = self.const_fan_ambient_transfer[math.ceil(fan_break)]
+        if below != above:
+            frac = fan_break % 1.0
+            ambient_transfer = below * (1 - frac) + frac * above
+        else:
+            ambient_transfer = below
+        self.fan_speed = fan_speed
+        self.fan_ambient_transfer = ambient_transfer
+        return ambient_transfer
+
     # Control interface
 
     def temperature_update(self, read_time, temp, target_temp):
@@ -174,6 +222,8 @@ class ControlMPC:
         dt = read_time - self.last_temp_time
         if self.last_temp_time == 0.0 or dt < 0.0 or dt > 1.0:
             dt = 0.1
+        if self.coeff_dt is None or abs(dt - self.coeff_dt) > DT_TOLERANCE:
+            self._update_step_coefficients(dt)
 
         # Extruder position
         extrude_speed_prev = 0.0
@@ -197,20 +247,7 @@ class ControlMPC:
                     pos_move = max(-self.const_maximum_retract, pos_next - pos)
                     extrude_speed_next = pos_move / dt
 
-        # Modulate ambient transfer coefficient with fan speed
-        ambient_transfer = self.const_ambient_transfer
-        if self.cooling_fan and len(self.const_fan_ambient_transfer) > 1:
-            fan_speed = max(
-                0.0, min(1.0, self.cooling_fan.get_status(read_time)["speed"])
-            )
-            fan_break = fan_speed * (len(self.const_fan_ambient_transfer) - 1)
-            below = self.const_fan_ambient_transfer[math.floor(fan_break)]
-            above = self.const_fan_ambient_transfer[math.ceil(fan_break)]
-            if below != above:
-                frac = fan_break % 1.0
-                ambient_transfer = below * (1 - frac) + frac * above
-            else:
-                ambient_transfer = below
+        ambient_transfer = self._get_ambient_transfer(read_time)
 
         # Simulate
 
@@ -227,28 +264,26 @@ class ControlMPC:
 
         # Expected block dT since last period
         expected_block_dT = (
-            (
-                expected_heating
-                - expected_ambient_transfer
-                - expected_filament_transfer
-            )
-            * dt
-            / self.const_block_heat_capacity
-        )
+            expected_heating
+            - expected_ambient_transfer
+            - expected_filament_transfer
+        ) * self.coeff_block
         self.state_block_temp += expected_block_dT
 
         # Expected sensor dT since last period
         expected_sensor_dT = (
-            (self.state_block_temp - self.state_sensor_temp)
-            * self.const_sensor_responsiveness
-            * dt
-        )
+            self.state_block_temp - self.state_sensor_temp
+        ) * self.coeff_sensor
         self.state_sensor_temp += expected_sensor_dT
 
         # Correct
 
-        smoothing = 1 - (1 - self.const_smoothing) ** dt
-        adjustment_dT = (temp - self.state_sensor_temp) * smoothing
+        prediction_error = temp - self.state_sensor_temp
+        self.last_prediction_error = prediction_error
+        self.prediction_error_sq += (
+            prediction_error * prediction_error - self.prediction_error_sq
+        ) * self.coeff_prediction
+        adjustment_dT = prediction_error * self.coeff_smoothing
         self.state_block_temp += adjustment_dT
         self.state_sensor_temp += adjustment_dT
 
@@ -259,15 +294,11 @@ class ControlMPC:
                 self.want_ambient_refresh = False
         if (self.last_power > 0 and self.last_power < 1.0) or abs(
             expected_block_dT + adjustment_dT
-        ) < self.const_steady_state_rate * dt:
+        ) < self.coeff_steady_state:
             if adjustment_dT > 0.0:
-                ambient_delta = max(
-                    adjustment_dT, self.const_min_ambient_change * dt
-                )
+                ambient_delta = max(adjustment_dT, self.coeff_min_ambient)
             else:
-                ambient_delta = min(
-                    adjustment_dT, -self.const_min_ambient_change * dt
-                )
+                ambient_delta = min(adjustment_dT, -self.coeff_min_ambient)
             self.state_ambient_temp += ambient_delta
 
         # Output
@@ -275,10 +306,8 @@ class ControlMPC:
         # Amount of power needed to reach the target temperature in the desired time
 
         heating_power = (
-            (target_temp - self.state_block_temp)
-            * self.const_block_heat_capacity
-            / self.const_target_reach_time
-        )
+            target_temp - self.state_block_temp
+        ) * self.heating_gain
         # Losses (+ = lost from block, - = gained to block)
         block_ambient_delta = self.state_block_temp - self.state_ambient_temp
         loss_ambient = block_ambient_delta * ambient_transfer
@@ -359,6 +388,8 @@ class ControlMPC:
             "temp_sensor": self.state_sensor_temp,
             "temp_ambient": self.state_ambient_temp,
             "power": self.last_power,
+            "prediction_error": self.last_prediction_error,
+            "prediction_error_rms": math.sqrt(self.prediction_error_sq),
             "loss_ambient": self.last_loss_ambient,
             "loss_filament": self.last_loss_filament,
             "filament_temp": self.filament_temp_src,
@@ -374,6 +405,9 @@ class MpcCalibrate:
         self.orig_control = orig_control
 
     def run(self, gcmd):
+        method = gcmd.get("METHOD", "standard").lower()
+        if method not in ("standard", "fit"):
+            raise gcmd.error("Unknown MPC calibration method '%s'" % (method,))
         use_analytic = gcmd.get("USE_DELTA", None) is not None
         ambient_max_measure_time = gcmd.get_float(
             "AMBIENT_MAX_MEASURE_TIME", 20.0, above=0.0
@@ -389,11 +423,24 @@ class MpcCalibrate:
         threshold_temp = gcmd.get_float(
             "THRESHOLD", max(50.0, min(100, target_temp - 100.0))
         )
+        fit_time = gcmd.get_float("FIT_TIME", 40.0, minval=10.0)
 
         control = TuningControl(self.heater)
         old_control = self.heater.set_control(control)
         try:
             ambient_temp = self.await_ambient(gcmd, control, threshold_temp)
+            if method == "fit":
+                res = self.run_fit(
+                    gcmd,
+                    control,
+                    target_temp,
+                    threshold_temp,
+                    ambient_temp,
+                    fan_breakpoints,
+                    fit_time,
+                )
+                self.save_results(gcmd, res)
+                return
             samples = self.heatup_test(gcmd, target_temp, control)
             first_res = self.process_first_pass(
                 samples,
@@ -442,45 +489,177 @@ class MpcCalibrate:
                 if use_analytic
                 else first_res["sensor_responsiveness"]
             )
-            ambient_transfer = second_res["ambient_transfer"]
-            fan_ambient_transfer = ", ".join(
-                [f"{p:.6g}" for p in second_res["fan_ambient_transfer"]]
+            self.save_results(
+                gcmd,
+                {
+                    "block_heat_capacity": block_heat_capacity,
+                    "sensor_responsiveness": sensor_responsiveness,
+                    "ambient_transfer": second_res["ambient_transfer"],
+                    "fan_ambient_transfer": second_res["fan_ambient_transfer"],
+                },
             )
 
-            cfgname = self.heater.get_name()
-            gcmd.respond_info(
-                f"Finished MPC calibration of heater '{cfgname}'\n"
-                "Measured:\n "
-                f"  block_heat_capacity={block_heat_capacity:#.6g} [J/K]\n"
-                f"  sensor_responsiveness={sensor_responsiveness:#.6g} [K/s/K]\n"
-                f"  ambient_transfer={ambient_transfer:#.6g} [W/K]\n"
-                f"  fan_ambient_transfer={fan_ambient_transfer} [W/K]\n"
-            )
+        except self.printer.command_error as e:
+            raise gcmd.error("%s failed: %s" % (gcmd.get_command(), e))
+        finally:
+            self.heater.set_control(old_control)
+            self.heater.alter_target(0.0)
+
+    def save_results(self, gcmd, res):
+        block_heat_capacity = res["block_heat_capacity"]
+        sensor_responsiveness = res["sensor_responsiveness"]
+        ambient_transfer = res["ambient_transfer"]
+        fan_ambient_transfer = ", ".join(
+            [f"{p:.6g}" for p in res["fan_ambient_transfer"]]
+        )
 
-            configfile = self.heater.printer.lookup_object("configfile")
-            configfile.set(cfgname, "control", "mpc")
-            configfile.set(
-                cfgname, "block_heat_capacity", f"{block_heat_capacity:#.6g}"
+        cfgname = self.heater.get_name()
+        msg = (
+            f"Finished MPC calibration of heater '{cfgname}'\n"
+            "Measured:\n "
+            f"  block_heat_capacity={block_heat_capacity:#.6g} [J/K]\n"
+            f"  sensor_responsiveness={sensor_responsiveness:#.6g} [K/s/K]\n"
+            f"  ambient_transfer={ambient_transfer:#.6g} [W/K]\n"
+            f"  fan_ambient_transfer={fan_ambient_transfer} [W/K]\n"
+        )
+        if "rms_error" in res:
+            fan_ci = ", ".join(
+                [f"{p:.2g}" for p in res["fan_ambient_transfer_ci"]]
             )
-            configfile.set(
-                cfgname,
-                "sensor_responsiveness",
-                f"{sensor_responsiveness:#.6g}",
+            msg += (
+                "95% confidence intervals:\n"
+                f"  block_heat_capacity=+/-{res['block_heat_capacity_ci']:.2g}\n"
+                f"  sensor_responsiveness=+/-{res['sensor_responsiveness_ci']:.2g}\n"
+                f"  ambient_transfer=+/-{res['ambient_transfer_ci']:.2g}\n"
+                f"  fan_ambient_transfer=+/-{fan_ci}\n"
+                f"Model rms error: {res['rms_error']:.3f} [K]\n"
             )
-            configfile.set(
-                cfgname, "ambient_transfer", f"{ambient_transfer:#.6g}"
+        gcmd.respond_info(msg)
+
+        configfile = self.heater.printer.lookup_object("configfile")
+        configfile.set(cfgname, "control", "mpc")
+        configfile.set(
+            cfgname, "block_heat_capacity", f"{block_heat_capacity:#.6g}"
+        )
+        configfile.set(
+            cfgname,
+            "sensor_responsiveness",
+            f"{sensor_responsiveness:#.6g}",
+        )
+        configfile.set(cfgname, "ambient_transfer", f"{ambient_transfer:#.6g}")
+        configfile.set(
+            cfgname,
+            "fan_ambient_transfer",
+            fan_ambient_transfer,
+        )
+
+    def run_fit(
+        self,
+        gcmd,
+        control,
+        target_temp,
+        threshold_temp,
+        ambient_temp,
+        fan_breakpoints,
+        fit_time,
+    ):
+        try:
+            from . import mpc_fit
+        except ImportError:
+            raise self.printer.command_error(
+                "Failed to import `numpy` module, required for METHOD=FIT"
             )
-            configfile.set(
-                cfgname,
-                "fan_ambient_transfer",
-                fan_ambient_transfer,
+        fan = self.orig_control.cooling_fan
+        if fan is None:
+            fan_breakpoints = 1
+        heater_power = self.orig_control.const_heater_power
+        samples, segments = self.excitation_test(
+            gcmd, target_temp, fan_breakpoints, fit_time, control
+        )
+        # Initial guess from the heatup and the average relay power
+        first_res = self.process_first_pass(
+            samples[: segments[0]],
+            self.orig_control.heater_max_power,
+            ambient_temp,
+            threshold_temp,
+            False,
+        )
+        transfers = []
+        for start, end in zip(segments, segments[1:] + [len(samples)]):
+            part = samples[start:end]
+            power = sum([s[2] for s in part]) / len(part) * heater_power
+            temp = sum([s[1] for s in part]) / len(part)
+            transfers.append(max(power / (temp - ambient_temp), 0.001))
+        initial = {
+            "block_heat_capacity": max(first_res["block_heat_capacity"], 1.0),
+            "sensor_responsiveness": first_res["sensor_responsiveness"],
+            "fan_ambient_transfer": transfers,
+        }
+        if initial["sensor_responsiveness"] <= 0.0:
+            initial["sensor_responsiveness"] = 0.1
+        gcmd.respond_info("Fitting model to %d samples" % (len(samples),))
+        try:
+            res = mathutil.background_process_exec(
+                self.printer,
+                mpc_fit.fit_mpc_model,
+                (
+                    samples,
+                    heater_power,
+                    ambient_temp,
+                    self.heater.get_pwm_delay(),
+                    fan_breakpoints,
+                    initial,
+                ),
+                (mpc_fit.FitError,),
             )
+        except mpc_fit.FitError as e:
+            raise self.printer.command_error(str(e))
+        if fan is None:
+            res["fan_ambient_transfer"] = []
+            res["fan_ambient_transfer_ci"] = []
+        logging.info("MPC model fit: %s", res)
+        return res
 
-        except self.printer.command_error as e:
-            raise gcmd.error("%s failed: %s" % (gcmd.get_command(), e))
-        finally:
-            self.heater.set_control(old_control)
-            self.heater.alter_target(0.0)
+    def excitation_test(
+        self, gcmd, target_temp, fan_breakpoints, fit_time, control
+    ):
+        # Full power heatup followed by relay control at each fan speed
+        gcmd.respond_info(
+            "Performing heatup test, target is %.1f degrees" % (target_temp,)
+        )
+        fan = self.orig_control.cooling_fan
+        max_power = self.heater.get_max_power()
+        control.fan = fan
+        control.logging = True
+        control.set_output(max_power, target_temp)
+
+        def process(eventtime):
+            temp, _ = self.heater.get_temp(eventtime)
+            return temp < target_temp
+
+        self.printer.wait_while(process)
+        control.relay = True
+        segments = []
+        for idx in range(fan_breakpoints):
+            segments.append(len(control.log))
+            if fan is not None:
+                speed = idx / (fan_breakpoints - 1)
+                fan.set_speed(speed)
+                gcmd.respond_info(
+                    f"Measuring response with {speed * 100.0:.0f}% fan speed"
+                )
+            else:
+                gcmd.respond_info("Measuring response at target temperature")
+            end_time = self.printer.reactor.monotonic() + fit_time
+            self.printer.wait_while(lambda eventtime: eventtime < end_time)
+        control.logging = control.relay = False
+        if fan is not None:
+            fan.set_speed(0.0)
+        self.heater.alter_target(0.0)
+
+        log = control.log
+        control.log = []
+        return log, segments
 
     def wait_stable(self, cycles=5):
         """
@@ -791,16 +970,26 @@ class MpcCalibrate:
 
 class TuningControl:
     def __init__(self, heater):
-        self.value = 0.0
+        self.value = self.power = 0.0
         self.target = None
         self.heater = heater
         self.log = []
         self.logging = False
+        self.relay = False
+        self.fan = None
 
     def temperature_update(self, read_time, temp, target_temp):
+        if self.relay:
+            # Relay (bang-bang) excitation around the target
+            self.power = self.value if temp < self.target else 0.0
+        else:
+            self.power = self.value
         if self.logging:
-            self.log.append((read_time, temp))
-        self.heater.set_pwm(read_time, self.value)
+            fan_speed = 0.0
+            if self.fan is not None:
+                fan_speed = self.fan.get_status(read_time)["speed"]
+            self.log.append((read_time, temp, self.power, fan_speed))
+        self.heater.set_pwm(read_time, self.power)
 
     def check_busy(self, eventtime, smoothed_temp, target_temp):
         return self.value != 0.0 or self.target != 0
@@ -54,6 +54,18 @@ class DangerOptions:
         self.bgflush_extra_time = config.getfloat(
             "bgflush_extra_time", 0.250, minval=0.0
         )
+        self.flush_batch_time_min = config.getfloat(
+            "flush_batch_time_min", 0.100, above=0.0
+        )
+        self.flush_batch_time_max = config.getfloat(
+            "flush_batch_time_max", 0.500, minval=self.flush_batch_time_min
+        )
+        self.flush_batch_cost_ratio = config.getfloat(
+            "flush_batch_cost_ratio", 0.250, above=0.0
+        )
+        self.threaded_step_generation = config.getboolean(
+            "threaded_step_generation", False
+        )
         self.homing_start_delay = config.getfloat(
             "homing_start_delay", 0.001, minval=0.0
         )
@@ -7,6 +7,66 @@
 
 import json
 import logging
+import math
+
+# Number of grid cells per object used by the spatial index
+GRID_CELLS_PER_OBJECT = 4
+
+
+def _point_in_polygon(x, y, polygon):
+    inside = False
+    px, py = polygon[-1]
+    for cx, cy in polygon:
+        if (cy > y) != (py > y):
+            if x < (px - cx) * (y - cy) / (py - cy) + cx:
+                inside = not inside
+        px, py = cx, cy
+    return inside
+
+
+# Uniform grid over the bounding boxes of the defined object polygons
+class ObjectGridIndex:
+    def __init__(self, objects):
+        self.cells = {}
+        self.polygons = {}
+        bounds = []
+        for obj in objects:
+            polygon = obj.get("polygon")
+            try:
+                points = [(float(p[0]), float(p[1])) for p in polygon]
+            except (TypeError, ValueError, IndexError):
+                continue
+            if len(points) < 3:
+                continue
+            self.polygons[obj["name"]] = points
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            bounds.append((obj["name"], min(xs), min(ys), max(xs), max(ys)))
+        self.cell_size = 1.0
+        if not bounds:
+            return
+        min_x = min(b[1] for b in bounds)
+        min_y = min(b[2] for b in bounds)
+        max_x = max(b[3] for b in bounds)
+        max_y = max(b[4] for b in bounds)
+        area = max((max_x - min_x) * (max_y - min_y), 1.0)
+        cell_count = GRID_CELLS_PER_OBJECT * len(bounds)
+        self.cell_size = max(math.sqrt(area / cell_count), 0.001)
+        for name, x0, y0, x1, y1 in bounds:
+            for cx in range(self._cell(x0), self._cell(x1) + 1):
+                for cy in range(self._cell(y0), self._cell(y1) + 1):
+                    self.cells.setdefault((cx, cy), []).append(name)
+
+    def _cell(self, coord):
+        return int(math.floor(coord / self.cell_size))
+
+    def lookup(self, x, y):
+        candidates = self.cells.get((self._cell(x), self._cell(y)), [])
+        return [
+            name
+            for name in candidates
+            if _point_in_polygon(x, y, self.polygons[name])
+        ]
 
 
 class ExcludeObject:
@@ -94,8 +154,13 @@ class ExcludeObject:
 
     def _reset_state(self):
         self.objects = []
+        self.object_definitions = {}
+        self.objects_dirty = False
+        self.object_index = None
         self.excluded_objects = []
+        self.excluded_set = set()
         self.current_object = None
+        self.current_excluded = False
         self.in_excluded_region = False
 
     def _reset_file(self):
@@ -195,12 +260,79 @@ class ExcludeObject:
 
     def _test_in_excluded_region(self):
         # Inside cancelled object
-        return (
-            self.current_object in self.excluded_objects
-            and self.initial_extrusion_moves == 0
-        )
+        return self.current_excluded and self.initial_extrusion_moves == 0
+
+    def _get_objects(self):
+        if self.objects_dirty:
+            self.objects_dirty = False
+            self.objects = [
+                self.object_definitions[name]
+                for name in sorted(self.object_definitions)
+            ]
+        return self.objects
+
+    def get_objects_at(self, x, y):
+        if self.object_index is None:
+            self.object_index = ObjectGridIndex(self._get_objects())
+        return sorted(self.object_index.lookup(x, y))
+
+    def _lookup_file_section(self, vsd):
+        # Object sections come from the background file analysis, which is
+        # started the first time an object is excluded
+        indexer = vsd.file_indexer
+        filename = vsd.file_path()
+        if filename is None:
+            return None
+        if indexer.filename != filename:
+            indexer.start(filename)
+        if indexer.state != "ready":
+            return None
+        return indexer.file_index.get_object_section(vsd.get_file_position())
+
+    def _skip_excluded_section(self, name):
+        # Seek past the object's section when printing from virtual_sdcard
+        vsd = self.printer.lookup_object("virtual_sdcard", None)
+        if vsd is None or not vsd.is_cmd_from_sd():
+            return
+        # The section's moves must be ignored by the transform, and must
+        # not change the state of later moves
+        if not self._test_in_excluded_region():
+            return
+        gcode_status = self.gcode_move.get_status()
+        if (
+            not gcode_status["absolute_coordinates"]
+            or gcode_status["absolute_extrude"]
+        ):
+            return
+        section = self._lookup_file_section(vsd)
+        if section is None or section["name"] != name:
+            return
+        vsd.set_file_position(section["end"])
+        # Replay the net effect of the section.  The moves are ignored by
+        # the transform just like the original ones, so the position and
+        # retraction tracking match the non-seeking path.
+        script = list(section["commands"])
+        extrude_peak = section["extrude_peak"]
+        if extrude_peak is not None:
+            extrude = section["extrude"]
+            if extrude_peak > extrude:
+                script.append("G1 E%.5f" % (extrude_peak,))
+                extrude -= extrude_peak
+            params = [
+                "%s%.6f" % (axis, value)
+                for axis, value in zip("XYZ", section["position"])
+                if value is not None
+            ]
+            if extrude:
+                params.append("E%.5f" % (extrude,))
+            if section["feedrate"] is not None:
+                params.append("F%.3f" % (section["feedrate"],))
+            script.append(" ".join(["G1"] + params))
+        if script:
+            self.gcode.run_script_from_command("\n".join(script))
 
     def get_status(self, eventtime=None):
+        self._get_objects()
         status = {
             "objects": self.objects,
             "excluded_objects": self.excluded_objects,
@@ -229,10 +361,13 @@ class ExcludeObject:
 
     def cmd_EXCLUDE_OBJECT_START(self, gcmd):
         name = gcmd.get("NAME").upper()
-        if not any(obj["name"] == name for obj in self.objects):
+        if name not in self.object_definitions:
             self._add_object_definition({"name": name})
         self.current_object = name
+        self.current_excluded = name in self.excluded_set
         self.was_excluded_at_start = self._test_in_excluded_region()
+        if self.current_excluded:
+            self._skip_excluded_section(name)
 
     cmd_EXCLUDE_OBJECT_END_help = "Marks the end the current object"
 
@@ -250,6 +385,7 @@ class ExcludeObject:
             )
 
         self.current_object = None
+        self.current_excluded = False
 
     cmd_EXCLUDE_OBJECT_help = "Cancel moves inside a specified objects"
 
@@ -257,6 +393,7 @@ class ExcludeObject:
         reset = gcmd.get("RESET", None)
         current = gcmd.get("CURRENT", None)
         name = gcmd.get("NAME", "").upper()
+        position = gcmd.get("POSITION", None)
 
         if reset:
             if name:
@@ -264,9 +401,23 @@ class ExcludeObject:
 
             else:
                 self.excluded_objects = []
+                self.excluded_set = set()
+                self.current_excluded = False
+
+        elif position is not None:
+            try:
+                x, y = [float(v) for v in position.split(",")]
+            except ValueError:
+                raise gcmd.error("Invalid POSITION '%s'" % (position,))
+            names = self.get_objects_at(x, y)
+            if not names:
+                raise gcmd.error("No object found at %.3f,%.3f" % (x, y))
+            for obj_name in names:
+                if obj_name not in self.excluded_set:
+                    self._exclude_object(obj_name)
 
         elif name:
-            if name.upper() not in self.excluded_objects:
+            if name.upper() not in self.excluded_set:
                 self._exclude_object(name.upper())
 
         elif current:
@@ -309,28 +460,34 @@ class ExcludeObject:
             self._list_objects(gcmd)
 
     def _add_object_definition(self, definition):
-        self.objects = sorted(
-            self.objects + [definition], key=lambda o: o["name"]
-        )
+        # The sorted status list is rebuilt on the next status request
+        self.object_definitions[definition["name"]] = definition
+        self.objects_dirty = True
+        self.object_index = None
 
     def _exclude_object(self, name):
         self._register_transform()
         self.gcode.respond_info("Excluding object {}".format(name.upper()))
-        if name not in self.excluded_objects:
-            self.excluded_objects = sorted(self.excluded_objects + [name])
+        if name not in self.excluded_set:
+            self.excluded_set.add(name)
+            self.excluded_objects = sorted(self.excluded_set)
+            if name == self.current_object:
+                self.current_excluded = True
 
     def _unexclude_object(self, name):
         self.gcode.respond_info("Unexcluding object {}".format(name.upper()))
-        if name in self.excluded_objects:
-            excluded_objects = list(self.excluded_objects)
-            excluded_objects.remove(name)
-            self.excluded_objects = sorted(excluded_objects)
+        if name in self.excluded_set:
+            self.excluded_set.discard(name)
+            self.excluded_objects = sorted(self.excluded_set)
+            if name == self.current_object:
+                self.current_excluded = False
 
     def _list_objects(self, gcmd):
+        objects = self._get_objects()
         if gcmd.get("JSON", None) is not None:
-            object_list = json.dumps(self.objects)
+            object_list = json.dumps(objects)
         else:
-            object_list = " ".join(obj["name"] for obj in self.objects)
+            object_list = " ".join(obj["name"] for obj in objects)
         gcmd.respond_info("Known objects: {}".format(object_list))
 
     def _list_excluded_objects(self, gcmd):
@@ -0,0 +1,117 @@
+# First order plus dead time model fit of a heater step response
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import math
+
+import numpy as np
+
+from .mpc_fit import FitError, levenberg_marquardt
+
+DIFF_STEP = 1e-5
+# Ambient temperature is fit in units of 100C
+AMBIENT_SCALE = 100.0
+
+
+def delayed_inputs(times, duties, dead_times):
+    # Average of the (piecewise constant) duty cycle over each sample
+    # interval, delayed by each of the given dead times
+    dts = np.diff(times)
+    integral = np.concatenate(([0.0], np.cumsum(duties[:-1] * dts)))
+    out = np.empty((len(dead_times), len(dts)))
+    for i, dead_time in enumerate(dead_times):
+        shifted = np.interp(times - dead_time, times, integral, left=0.0)
+        out[i] = np.diff(shifted) / dts
+    return out
+
+
+def simulate(params, times, duties, start_temp):
+    # Simulate the temperature for each row of (gain, time_constant,
+    # dead_time, ambient_temp) model parameters
+    params = np.atleast_2d(params)
+    gain, tau, dead_time, ambient = params.T
+    inputs = delayed_inputs(times, duties, dead_time)
+    decay = np.exp(-np.diff(times)[None, :] / tau[:, None])
+    drive = (1.0 - decay) * (gain[:, None] * inputs + ambient[:, None])
+    temp = np.full(len(params), float(start_temp))
+    out = np.empty((len(params), len(times)))
+    out[:, 0] = temp
+    for i in range(len(times) - 1):
+        temp = decay[:, i] * temp + drive[:, i]
+        out[:, i + 1] = temp
+    return out
+
+
+def initial_guess(times, temps, duties, step_end):
+    # Estimate the model from the tangent at the fastest rise of the
+    # initial step and the average duty needed near the target
+    rates = np.diff(temps[:step_end]) / np.diff(times[:step_end])
+    best = int(np.argmax(rates))
+    rate = rates[best]
+    if rate <= 0.0:
+        raise FitError("heater temperature did not rise during step")
+    step_duty = duties[0]
+    dead_time = times[best] - (temps[best] - temps[0]) / rate - times[0]
+    dead_time = max(dead_time, times[1] - times[0])
+    hold_duty = np.mean(duties[step_end:])
+    hold_temp = np.mean(temps[step_end:])
+    if hold_duty <= 0.0:
+        raise FitError("no heater power during excitation")
+    gain = (hold_temp - temps[0]) / hold_duty
+    tau = max(gain * step_duty / rate, 1.0)
+    return gain, tau, dead_time, temps[0]
+
+
+def fit_fopdt(samples, step_end):
+    """
+    Fit the model dT/dt = (gain * duty(t - dead_time) - (T - ambient))
+    / time_constant to a list of (time, temp, duty) samples, where the
+    first step_end samples are the initial constant power step.
+    """
+    data = np.array(samples, dtype=float)
+    if len(data) < 20 or not 2 < step_end < len(data) - 2:
+        raise FitError("not enough samples")
+    times, temps, duties = data[:, 0], data[:, 1], data[:, 2]
+    gain, tau, dead_time, ambient = initial_guess(
+        times, temps, duties, step_end
+    )
+    if gain <= 0.0:
+        raise FitError("heater temperature did not follow heater power")
+    theta = np.array(
+        [
+            math.log(gain),
+            math.log(tau),
+            math.log(dead_time),
+            ambient / AMBIENT_SCALE,
+        ]
+    )
+
+    def to_params(rows):
+        params = np.exp(rows)
+        params[:, 3] = rows[:, 3] * AMBIENT_SCALE
+        return params
+
+    def simulate_rows(rows):
+        return simulate(to_params(rows), times, duties, temps[0])
+
+    theta, cov, cost = levenberg_marquardt(
+        simulate_rows, theta, np.full(4, DIFF_STEP), temps
+    )
+    gain, tau, dead_time, ambient = to_params(theta[None, :])[0].tolist()
+    return {
+        "gain": gain,
+        "time_constant": tau,
+        "dead_time": dead_time,
+        "ambient_temp": ambient,
+        "rms_error": math.sqrt(float(cost) / len(temps)),
+    }
+
+
+def amigo_pid(model):
+    # AMIGO tuning rules for a first order plus dead time model
+    gain = model["gain"]
+    tau = model["time_constant"]
+    dead_time = model["dead_time"]
+    kp = (0.2 + 0.45 * tau / dead_time) / gain
+    ti = dead_time * (0.4 * dead_time + 0.8 * tau) / (dead_time + 0.1 * tau)
+    td = 0.5 * dead_time * tau / (0.3 * dead_time + tau)
+    return kp, kp / ti, kp * td
@@ -0,0 +1,881 @@
+# Pre-analysis of G-Code files (layers, print time, objects)
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import bisect
+import json
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import traceback
+
+from klippy import queuelogger, toolhead
+
+INDEX_VERSION = 2
+LAYER_Z_EPSILON = 0.0001
+POLL_TIME = 0.500
+
+PARAM_RE = re.compile(r"([A-Z])\s*([-+]?[0-9]*\.?[0-9]+(?:E[-+]?[0-9]+)?)")
+EXT_PARAM_RE = re.compile(r"(\S+?)=(\S+)")
+
+# Commands that may appear in an object section that can be seeked past.
+# Only the last one of each kind needs to be run after the seek.
+SECTION_REPLAY_CMDS = {
+    "M73",
+    "M106",
+    "M107",
+    "M204",
+    "SET_FAN_SPEED",
+    "SET_VELOCITY_LIMIT",
+}
+
+
+def get_index_filename(filename):
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, ".%s.index" % (basename,))
+
+
+# Snapshot of the toolhead and extruder limits used for time estimates
+def get_motion_limits(printer):
+    th = printer.lookup_object("toolhead")
+    kin = th.get_kinematics()
+    extruder = th.get_extruder()
+    return {
+        "max_velocity": th.max_velocity,
+        "max_accel": th.max_accel,
+        "minimum_cruise_ratio": th.min_cruise_ratio,
+        "square_corner_velocity": th.square_corner_velocity,
+        "virtual_segments": th.virtual_segments,
+        "accel_scale": th.accel_scale,
+        "max_z_velocity": getattr(kin, "max_z_velocity", th.max_velocity),
+        "max_z_accel": getattr(kin, "max_z_accel", th.max_accel),
+        "instant_corner_velocity": getattr(extruder, "instant_corner_v", 1.0),
+        "max_extrude_only_velocity": getattr(
+            extruder, "max_e_velocity", th.max_velocity
+        ),
+        "max_extrude_only_accel": getattr(
+            extruder, "max_e_accel", th.max_accel
+        ),
+        "max_volumetric_flow": getattr(
+            extruder, "get_max_volumetric_flow", lambda: None
+        )(),
+        "filament_area": getattr(extruder, "filament_area", 1.0),
+    }
+
+
+class _EstimatorExtruder:
+    def __init__(self, limits):
+        self.instant_corner_v = limits["instant_corner_velocity"]
+        self.max_e_velocity = limits["max_extrude_only_velocity"]
+        self.max_e_accel = limits["max_extrude_only_accel"]
+        self.max_flow = limits.get("max_volumetric_flow")
+        self.filament_area = limits.get("filament_area", 1.0)
+
+    def check_move(self, move):
+        axis_r = move.axes_r[3]
+        if (not move.axes_d[0] and not move.axes_d[1]) or axis_r < 0.0:
+            inv_extrude_r = 1.0 / abs(axis_r)
+            move.limit_speed(
+                self.max_e_velocity * inv_extrude_r,
+                self.max_e_accel * inv_extrude_r,
+            )
+        elif self.max_flow is not None and axis_r > 0.0:
+            max_v = self.max_flow / (axis_r * self.filament_area)
+            move.limit_speed(max_v)
+
+    def calc_junction(self, prev_move, move):
+        diff_r = move.axes_r[3] - prev_move.axes_r[3]
+        if diff_r:
+            return (self.instant_corner_v / abs(diff_r)) ** 2
+        return move.max_cruise_v2
+
+
+# Minimal toolhead stand-in so the real look-ahead code can time moves
+class _EstimatorToolHead:
+    def __init__(self, limits, layer_times):
+        self.max_z_velocity = limits["max_z_velocity"]
+        self.max_z_accel = limits["max_z_accel"]
+        self.virtual_segments = limits.get("virtual_segments", False)
+        self.accel_scale = limits.get("accel_scale", 1.0)
+        # Moves are only timed, never queued into a trapq
+        self.trapq_append = None
+        self.extruder = _EstimatorExtruder(limits)
+        self.layer_times = layer_times
+        self.lookahead = toolhead.LookAheadQueue(self)
+        self.set_limits(
+            limits["max_velocity"],
+            limits["max_accel"],
+            limits["square_corner_velocity"],
+            limits["minimum_cruise_ratio"],
+        )
+
+    def set_limits(self, velocity, accel, scv, min_cruise_ratio):
+        self.max_velocity = velocity
+        self.max_accel = accel
+        self.square_corner_velocity = scv
+        self.min_cruise_ratio = min_cruise_ratio
+        scv2 = scv**2
+        self.junction_deviation = scv2 * (math.sqrt(2.0) - 1.0) / accel
+        self.max_accel_to_decel = accel * (1.0 - min_cruise_ratio)
+
+    def move(self, start_pos, end_pos, speed, layer):
+        move = toolhead.Move(self, start_pos, end_pos, speed)
+        if not move.move_d:
+            return
+        move.layer = layer
+        if move.is_kinematic_move and move.axes_d[2]:
+            z_ratio = move.move_d / abs(move.axes_d[2])
+            move.limit_speed(
+                self.max_z_velocity * z_ratio, self.max_z_accel * z_ratio
+            )
+        if move.axes_d[3]:
+            self.extruder.check_move(move)
+        self.lookahead.add_move(move)
+
+    def dwell(self, delay, layer):
+        self.lookahead.flush()
+        self.layer_times[layer] += delay
+
+    def flush(self):
+        self.lookahead.flush()
+
+    # Called by LookAheadQueue with moves that have final timing
+    def _process_moves(self, moves):
+        layer_times = self.layer_times
+        for move in moves:
+            layer_times[move.layer] += move.accel_t + move.cruise_t
+            layer_times[move.layer] += move.decel_t
+
+
+class GCodeAnalyzer:
+    def __init__(self, limits):
+        self.layer_offsets = [0]
+        self.layer_heights = [0.0]
+        self.layer_times = [0.0]
+        self.layer_filament = [0.0]
+        self.toolhead = _EstimatorToolHead(limits, self.layer_times)
+        self.objects = {}
+        self.max_feedrates = {
+            "print": 0.0,
+            "travel": 0.0,
+            "z": 0.0,
+            "extrude_only": 0.0,
+        }
+        # G-Code state
+        self.position = [0.0, 0.0, 0.0, 0.0]
+        self.base_position = [0.0, 0.0, 0.0, 0.0]
+        self.absolute_coord = self.absolute_extrude = True
+        self.speed = 25.0
+        self.current_object = None
+        self.object_sections = []
+        self.section = None
+        self.section_start_pending = False
+        self.layer_z = None
+        self.z_change_offset = 0
+        self.layer_marker_offset = None
+
+    def _note_layer(self, offset, filament):
+        z = self.position[2]
+        if self.layer_z is not None and z <= self.layer_z + LAYER_Z_EPSILON:
+            return
+        if self.layer_z is None:
+            # First layer - any earlier moves are accounted to it
+            self.layer_heights[0] = z
+        else:
+            if self.layer_marker_offset is not None:
+                offset = self.layer_marker_offset
+            self.layer_offsets.append(offset)
+            self.layer_heights.append(z)
+            self.layer_times.append(0.0)
+            self.layer_filament.append(filament)
+        self.layer_z = z
+        self.layer_marker_offset = None
+
+    def _cmd_move(self, params, offset, code):
+        oldpos = list(self.position)
+        newpos = self.position
+        for pos, axis in enumerate("XYZE"):
+            value = params.get(axis)
+            if value is None:
+                continue
+            if pos < 3 and self.absolute_coord:
+                newpos[pos] = value + self.base_position[pos]
+            elif pos == 3 and self.absolute_extrude and self.absolute_coord:
+                newpos[pos] = value + self.base_position[pos]
+            else:
+                newpos[pos] += value
+        if "F" in params and params["F"] > 0.0:
+            self.speed = params["F"] / 60.0
+        axes_d = [newpos[i] - oldpos[i] for i in range(4)]
+        if axes_d[2]:
+            self.z_change_offset = offset
+        extruding = axes_d[3] > 0.0 and (axes_d[0] or axes_d[1])
+        if extruding:
+            self._note_layer(self.z_change_offset, oldpos[3])
+        layer = len(self.layer_times) - 1
+        # Arcs are timed as a single move of the arc length
+        if code in (2, 3) and ("I" in params or "J" in params):
+            move_end = self._arc_end(oldpos, newpos, params, code == 2)
+        else:
+            move_end = newpos
+        self.toolhead.move(oldpos, move_end, self.speed, layer)
+        # Statistics
+        feedrates = self.max_feedrates
+        if axes_d[0] or axes_d[1]:
+            if axes_d[3] > 0.0:
+                kind = "print"
+            else:
+                kind = "travel"
+        elif axes_d[2]:
+            kind = "z"
+        elif axes_d[3]:
+            kind = "extrude_only"
+        else:
+            return
+        feedrates[kind] = max(feedrates[kind], self.speed)
+        if extruding and self.current_object is not None:
+            bbox = self.objects.setdefault(self.current_object, None)
+            xs = (oldpos[0], newpos[0])
+            ys = (oldpos[1], newpos[1])
+            if bbox is None:
+                bbox = [min(xs), min(ys), max(xs), max(ys)]
+            else:
+                bbox = [
+                    min(bbox[0], *xs),
+                    min(bbox[1], *ys),
+                    max(bbox[2], *xs),
+                    max(bbox[3], *ys),
+                ]
+            self.objects[self.current_object] = bbox
+
+    def _arc_end(self, oldpos, newpos, params, clockwise):
+        # Replace the arc by a straight move of the same length
+        cx = oldpos[0] + params.get("I", 0.0)
+        cy = oldpos[1] + params.get("J", 0.0)
+        radius = math.hypot(oldpos[0] - cx, oldpos[1] - cy)
+        start_a = math.atan2(oldpos[1] - cy, oldpos[0] - cx)
+        end_a = math.atan2(newpos[1] - cy, newpos[0] - cx)
+        angle = end_a - start_a
+        if clockwise:
+            angle = -angle
+        if angle <= 0.0:
+            angle += 2.0 * math.pi
+        arc_d = radius * angle
+        chord_d = math.hypot(newpos[0] - oldpos[0], newpos[1] - oldpos[1])
+        if chord_d < 0.000001:
+            return (oldpos[0] + arc_d, oldpos[1], newpos[2], newpos[3])
+        scale = arc_d / chord_d
+        return (
+            oldpos[0] + (newpos[0] - oldpos[0]) * scale,
+            oldpos[1] + (newpos[1] - oldpos[1]) * scale,
+            newpos[2],
+            newpos[3],
+        )
+
+    def _cmd_set_position(self, params):
+        if not params:
+            params = {"X": 0.0, "Y": 0.0, "Z": 0.0, "E": 0.0}
+        for pos, axis in enumerate("XYZE"):
+            value = params.get(axis)
+            if value is not None:
+                self.base_position[pos] = self.position[pos] - value
+
+    def _cmd_extended(self, cmd, line, offset):
+        params = {
+            k.upper(): v for k, v in EXT_PARAM_RE.findall(line.split(";")[0])
+        }
+        if cmd == "EXCLUDE_OBJECT_START":
+            name = params.get("NAME")
+            self.section = None
+            if name is not None:
+                self.current_object = name.upper()
+                self.objects.setdefault(self.current_object, None)
+                self._start_section()
+        elif cmd == "EXCLUDE_OBJECT_END":
+            name = params.get("NAME")
+            if name is None or name.upper() == self.current_object:
+                self._end_section(offset)
+            self.current_object = None
+        elif cmd == "EXCLUDE_OBJECT_DEFINE":
+            name = params.get("NAME")
+            if name is not None:
+                self.objects.setdefault(name.upper(), None)
+        elif cmd == "SET_VELOCITY_LIMIT":
+            th = self.toolhead
+            try:
+                th.set_limits(
+                    float(params.get("VELOCITY", th.max_velocity)),
+                    float(params.get("ACCEL", th.max_accel)),
+                    float(
+                        params.get(
+                            "SQUARE_CORNER_VELOCITY", th.square_corner_velocity
+                        )
+                    ),
+                    float(
+                        params.get("MINIMUM_CRUISE_RATIO", th.min_cruise_ratio)
+                    ),
+                )
+            except (ValueError, ZeroDivisionError):
+                pass
+
+    # Object sections that can be seeked past when the object is excluded
+    def _start_section(self):
+        # Seeking is only equivalent to ignoring the moves with absolute
+        # coordinates and relative extrusion
+        skippable = self.absolute_coord and not self.absolute_extrude
+        self.section = {
+            "name": self.current_object,
+            "start": None,
+            "end": None,
+            "position": [None, None, None],
+            "extrude_peak": None,
+            "extrude": 0.0,
+            "feedrate": None,
+            "commands": {},
+            "skippable": skippable,
+        }
+        # The section starts after the EXCLUDE_OBJECT_START line
+        self.section_start_pending = True
+
+    def _end_section(self, offset):
+        section = self.section
+        self.section = None
+        if section is None or not section["skippable"]:
+            return
+        section["end"] = offset
+        del section["skippable"]
+        section["commands"] = list(section["commands"].values())
+        self.object_sections.append(section)
+
+    def _note_section_line(self, cmd, upper, line):
+        section = self.section
+        if not section["skippable"] or cmd == "EXCLUDE_OBJECT_END":
+            return
+        if cmd[0] == "G" and cmd[1:].isdigit():
+            code = int(cmd[1:])
+            params = {
+                k: float(v) for k, v in PARAM_RE.findall(upper[len(cmd) :])
+            }
+            if code in (0, 1, 2, 3):
+                position = section["position"]
+                for pos, axis in enumerate("XYZ"):
+                    if axis in params:
+                        position[pos] = params[axis]
+                if "E" in params:
+                    section["extrude"] += params["E"]
+                # Highest extruder position reached by any move
+                extrude_peak = section["extrude_peak"]
+                if extrude_peak is None or section["extrude"] > extrude_peak:
+                    section["extrude_peak"] = section["extrude"]
+                if "F" in params:
+                    section["feedrate"] = params["F"]
+                return
+            if code == 92 and list(params) == ["E"]:
+                # Does not change later moves with relative extrusion
+                return
+        elif cmd in SECTION_REPLAY_CMDS:
+            key = cmd
+            if cmd in ("M106", "M107"):
+                params = dict(PARAM_RE.findall(upper[4:]))
+                key = "M106 P%s" % (params.get("P"),)
+            elif cmd != "M73" and cmd != "M204":
+                params = EXT_PARAM_RE.findall(upper)
+                if cmd == "SET_FAN_SPEED":
+                    key = "%s %s" % (cmd, dict(params).get("FAN"))
+                else:
+                    key = "%s %s" % (cmd, sorted(dict(params)))
+            commands = section["commands"]
+            commands.pop(key, None)
+            commands[key] = line.split(";", 1)[0].strip()
+            return
+        section["skippable"] = False
+
+    def process_line(self, line, offset):
+        if self.section_start_pending:
+            self.section_start_pending = False
+            self.section["start"] = offset
+        line = line.strip()
+        if not line:
+            return
+        if line[0] == ";":
+            if line.startswith(";LAYER_CHANGE") or line.startswith(";LAYER:"):
+                self.layer_marker_offset = offset
+            return
+        upper = line.split(";", 1)[0].upper()
+        cmd = upper.split(None, 1)[0] if upper.strip() else ""
+        if not cmd:
+            return
+        if self.section is not None:
+            self._note_section_line(cmd, upper, line)
+        if cmd[0] == "G" and cmd[1:].isdigit():
+            code = int(cmd[1:])
+            if code in (0, 1, 2, 3):
+                params = {k: float(v) for k, v in PARAM_RE.findall(upper[2:])}
+                self._cmd_move(params, offset, code)
+            elif code == 4:
+                params = {k: float(v) for k, v in PARAM_RE.findall(upper[2:])}
+                delay = params.get("P", 0.0) / 1000.0 + params.get("S", 0.0)
+                self.toolhead.dwell(delay, len(self.layer_times) - 1)
+            elif code == 28:
+                self.toolhead.flush()
+            elif code == 90:
+                self.absolute_coord = True
+            elif code == 91:
+                self.absolute_coord = False
+            elif code == 92:
+                params = {k: float(v) for k, v in PARAM_RE.findall(upper[3:])}
+                self._cmd_set_position(params)
+        elif cmd == "M82":
+            self.absolute_extrude = True
+        elif cmd == "M83":
+            self.absolute_extrude = False
+        elif cmd == "M204":
+            params = {k: float(v) for k, v in PARAM_RE.findall(upper[4:])}
+            accel = params.get(
+                "S", min(params.get("P", 0.0), params.get("T", 0.0))
+            )
+            if accel > 0.0:
+                th = self.toolhead
+                th.set_limits(
+                    th.max_velocity,
+                    accel,
+                    th.square_corner_velocity,
+                    th.min_cruise_ratio,
+                )
+        elif cmd.startswith("EXCLUDE_OBJECT") or cmd == "SET_VELOCITY_LIMIT":
+            self._cmd_extended(cmd, line, offset)
+
+    def finish(self, size):
+        self.toolhead.flush()
+        filament = self.position[3]
+        return {
+            "layer_offsets": self.layer_offsets,
+            "layer_heights": self.layer_heights,
+            "layer_times": self.layer_times,
+            "layer_filament": self.layer_filament,
+            "estimated_time": sum(self.layer_times),
+            "filament_total": filament,
+            "objects": self.objects,
+            "object_sections": self.object_sections,
+            "max_feedrates": self.max_feedrates,
+            "size": size,
+        }
+
+
+def analyze_file(filename, limits):
+    analyzer = GCodeAnalyzer(limits)
+    offset = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            analyzer.process_line(line.decode(errors="replace"), offset)
+            offset += len(line)
+    return analyzer.finish(offset)
+
+
+######################################################################
+# Modal state scan (for resuming a file part way through)
+######################################################################
+
+STATE_RE = re.compile(
+    rb"(?:G28|G9[0-2]|M8[23]|M10[4679]|M1[49]0|M22[01]|SET_GCODE_OFFSET"
+    rb"|SET_HEATER_TEMPERATURE|SET_FAN_SPEED)(?![0-9A-Z_])[^\n;]*"
+)
+MOVE_CMDS = ("G0", "G1", "G2", "G3")
+REVERSE_CHUNK_SIZE = 64 * 1024
+
+
+def _parse_params(line):
+    return {k: float(v) for k, v in PARAM_RE.findall(line)}
+
+
+def _get_homing_axes(params):
+    # G28 axis parameters are usually given without a value
+    axes = [pos for pos in range(3) if "XYZ"[pos] in params]
+    return axes or [0, 1, 2]
+
+
+def _get_mode(transitions, pos):
+    # transitions is a sorted list of (file_position, enabled)
+    idx = bisect.bisect_left(transitions, (pos,)) - 1
+    if idx < 0:
+        return True
+    return transitions[idx][1]
+
+
+def _iter_lines_reversed(mm, end):
+    # Yield (line_start, line) from the file in reverse order
+    pos = end
+    partial = b""
+    while pos > 0:
+        start = max(pos - REVERSE_CHUNK_SIZE, 0)
+        lines = (mm[start:pos] + partial).split(b"\n")
+        line_start = start
+        if start:
+            # First line may be incomplete - keep it for the next block
+            partial = lines.pop(0)
+            line_start += len(partial) + 1
+        offsets = []
+        for line in lines:
+            offsets.append(line_start)
+            line_start += len(line) + 1
+        for i in range(len(lines) - 1, -1, -1):
+            yield offsets[i], lines[i]
+        pos = start
+
+
+def _scan_modal_commands(mm, end):
+    state = {
+        "coord_modes": [],
+        "extrude_modes": [],
+        "heaters": {},
+        "fans": {},
+        "factors": {},
+        "offsets": [],
+        "coord_sets": [],
+    }
+    for m in STATE_RE.finditer(mm, 0, end):
+        start = m.start()
+        line_start = mm.rfind(b"\n", 0, start) + 1
+        if start != line_start and mm[line_start:start].strip():
+            continue
+        line = m.group().decode(errors="replace").strip()
+        cmd = line.split(None, 1)[0].upper()
+        if cmd in ("G90", "G91"):
+            state["coord_modes"].append((start, cmd == "G90"))
+        elif cmd in ("M82", "M83"):
+            state["extrude_modes"].append((start, cmd == "M82"))
+        elif cmd in ("M104", "M109", "M140", "M190"):
+            params = _parse_params(line[4:].upper())
+            if cmd in ("M104", "M109"):
+                key = ("M104", int(params.get("T", -1)))
+            else:
+                key = ("M140", -1)
+            state["heaters"][key] = params.get("S", 0.0)
+        elif cmd == "SET_HEATER_TEMPERATURE":
+            params = dict(EXT_PARAM_RE.findall(line))
+            state["heaters"][("HEATER", params.get("HEATER"))] = line
+        elif cmd in ("M106", "M107"):
+            params = _parse_params(line[4:].upper())
+            state["fans"][int(params.get("P", -1))] = line
+        elif cmd == "SET_FAN_SPEED":
+            params = dict(EXT_PARAM_RE.findall(line))
+            state["fans"][params.get("FAN")] = line
+        elif cmd in ("M220", "M221"):
+            state["factors"][cmd] = line
+        elif cmd == "SET_GCODE_OFFSET":
+            state["offsets"].append(line)
+        elif cmd == "G28":
+            axes = _get_homing_axes(line[3:].upper())
+            state["coord_sets"].append((start, cmd, axes))
+        elif cmd == "G92":
+            params = _parse_params(line[3:].upper())
+            state["coord_sets"].append((start, cmd, params))
+    return state
+
+
+def _scan_position(mm, end, coord_modes, extrude_modes):
+    # Find the G-Code position at 'end' by walking backwards until each
+    # axis has an absolute value (summing any relative moves after it)
+    position = [None, None, None, None]
+    pending = [0.0, 0.0, 0.0, 0.0]
+    unresolved = set(range(4))
+    if not _get_mode(extrude_modes, end):
+        # Relative extrusion - the E position does not matter
+        position[3] = 0.0
+        unresolved.discard(3)
+    feedrate = None
+    for line_start, line in _iter_lines_reversed(mm, end):
+        line = line.split(b";", 1)[0].strip().upper()
+        if not line or line[0] != ord("G"):
+            continue
+        parts = line.split(None, 1)
+        cmd = parts[0].decode(errors="replace")
+        if cmd in MOVE_CMDS:
+            params = _parse_params(line[len(cmd) :].decode(errors="replace"))
+            if feedrate is None and "F" in params:
+                feedrate = params["F"]
+            abs_coord = _get_mode(coord_modes, line_start)
+            abs_extrude = abs_coord and _get_mode(extrude_modes, line_start)
+            for pos in list(unresolved):
+                value = params.get("XYZE"[pos])
+                if value is None:
+                    continue
+                if abs_extrude if pos == 3 else abs_coord:
+                    position[pos] = value + pending[pos]
+                    unresolved.discard(pos)
+                else:
+                    pending[pos] += value
+        elif cmd == "G92":
+            params = _parse_params(line[3:].decode(errors="replace"))
+            if not params:
+                params = {"X": 0.0, "Y": 0.0, "Z": 0.0, "E": 0.0}
+            for pos in list(unresolved):
+                value = params.get("XYZE"[pos])
+                if value is not None:
+                    position[pos] = value + pending[pos]
+                    unresolved.discard(pos)
+        elif cmd == "G28":
+            # Position after homing is not known from the file
+            axes = _get_homing_axes(line[3:].decode(errors="replace"))
+            for pos in axes:
+                unresolved.discard(pos)
+        if not unresolved and feedrate is not None:
+            break
+    return position, feedrate
+
+
+def _scan_coord_shift(mm, coord_sets, coord_modes, extrude_modes):
+    # Find the XYZ shift between the position before and after the G92
+    # commands of the file (G28 clears it).  None if the position a G92
+    # was applied to is not known from the file.
+    shift = [0.0, 0.0, 0.0]
+    for start, cmd, args in coord_sets:
+        if cmd == "G28":
+            # args are the homed axes
+            for pos in args:
+                shift[pos] = 0.0
+            continue
+        params = args or {"X": 0.0, "Y": 0.0, "Z": 0.0}
+        axes = [pos for pos in range(3) if "XYZ"[pos] in params]
+        if not axes:
+            continue
+        position, feedrate = _scan_position(
+            mm, start, coord_modes, extrude_modes
+        )
+        for pos in axes:
+            if position[pos] is None or shift[pos] is None:
+                shift[pos] = None
+            else:
+                shift[pos] += position[pos] - params["XYZ"[pos]]
+    return shift
+
+
+def scan_state(filename, offset):
+    """Find the modal state of a G-Code file at the given offset.
+
+    Only state changing commands are parsed, using a regex search over
+    the file, followed by a short backwards scan for the last position.
+    """
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = min(offset, len(mm))
+            state = _scan_modal_commands(mm, offset)
+            position, feedrate = _scan_position(
+                mm, offset, state["coord_modes"], state["extrude_modes"]
+            )
+            coord_shift = _scan_coord_shift(
+                mm,
+                state.pop("coord_sets"),
+                state["coord_modes"],
+                state["extrude_modes"],
+            )
+    state["absolute_coord"] = _get_mode(state.pop("coord_modes"), offset)
+    state["absolute_extrude"] = _get_mode(state.pop("extrude_modes"), offset)
+    state["position"] = position
+    state["coord_shift"] = coord_shift
+    state["feedrate"] = feedrate
+    return state
+
+
+def _get_cache_key(filename, limits):
+    st = os.stat(filename)
+    return {
+        "version": INDEX_VERSION,
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "limits": limits,
+    }
+
+
+def load_cached_index(filename, limits):
+    try:
+        key = _get_cache_key(filename, limits)
+        with open(get_index_filename(filename), "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("key") != key:
+        return None
+    return data.get("index")
+
+
+def build_index(filename, limits):
+    key = _get_cache_key(filename, limits)
+    index = analyze_file(filename, limits)
+    try:
+        with open(get_index_filename(filename), "w") as f:
+            json.dump({"key": key, "index": index}, f)
+    except OSError:
+        logging.exception("Unable to write G-Code file index")
+    return index
+
+
+# Results of a file analysis with helpers for progress queries
+class FileIndex:
+    def __init__(self, index):
+        self.index = index
+        self.layer_offsets = index["layer_offsets"]
+        self.layer_times = index["layer_times"]
+        self.object_sections = {
+            section["start"]: section for section in index["object_sections"]
+        }
+        # Remaining time at the start of each layer
+        remaining = [0.0] * (len(self.layer_times) + 1)
+        for i in range(len(self.layer_times) - 1, -1, -1):
+            remaining[i] = remaining[i + 1] + self.layer_times[i]
+        self.remaining = remaining
+        self.summary = {
+            "layer_count": len(self.layer_offsets),
+            "estimated_time": index["estimated_time"],
+            "filament_total": index["filament_total"],
+            "objects": index["objects"],
+            "max_feedrates": index["max_feedrates"],
+        }
+
+    def get_layer(self, file_position):
+        return max(bisect.bisect_right(self.layer_offsets, file_position), 1)
+
+    def get_layer_offset(self, layer):
+        return self.layer_offsets[layer - 1]
+
+    def get_layer_count(self):
+        return len(self.layer_offsets)
+
+    def find_layer_by_height(self, z):
+        heights = self.index["layer_heights"]
+        return bisect.bisect_left(heights, z - LAYER_Z_EPSILON) + 1
+
+    def get_time_left(self, file_position):
+        layer = self.get_layer(file_position)
+        idx = layer - 1
+        start = self.layer_offsets[idx]
+        if layer < len(self.layer_offsets):
+            end = self.layer_offsets[layer]
+        else:
+            end = self.index["size"]
+        layer_r = 0.0
+        if end > start:
+            layer_r = min(
+                max((file_position - start) / (end - start), 0.0), 1.0
+            )
+        return self.remaining[idx + 1] + self.layer_times[idx] * (1.0 - layer_r)
+
+    def get_object_section(self, file_position):
+        return self.object_sections.get(file_position)
+
+    def get_summary(self):
+        return self.summary
+
+
+# Run file analysis in a background process without blocking the reactor
+class FileIndexer:
+    def __init__(self, printer):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.filename = None
+        self.state = "none"
+        self.file_index = None
+        self.proc = self.conn = None
+        self.poll_timer = None
+        self.callbacks = []
+
+    def reset(self):
+        self._stop()
+        self.filename = None
+        self.state = "none"
+        self.file_index = None
+
+    def _stop(self):
+        if self.poll_timer is not None:
+            self.reactor.unregister_timer(self.poll_timer)
+            self.poll_timer = None
+        if self.proc is not None:
+            if self.proc.is_alive():
+                self.proc.terminate()
+            self.proc.join()
+            self.conn.close()
+            self.proc = self.conn = None
+
+    def start(self, filename):
+        self.reset()
+        self.filename = filename
+        limits = get_motion_limits(self.printer)
+        index = load_cached_index(filename, limits)
+        if index is not None:
+            self._set_result(index)
+            return
+        parent_conn, child_conn = multiprocessing.Pipe()
+
+        def wrapper():
+            queuelogger.clear_bg_logging()
+            try:
+                res = build_index(filename, limits)
+            except:
+                child_conn.send((True, traceback.format_exc()))
+                child_conn.close()
+                return
+            child_conn.send((False, res))
+            child_conn.close()
+
+        self.state = "analyzing"
+        self.conn = parent_conn
+        self.proc = multiprocessing.Process(target=wrapper)
+        self.proc.daemon = True
+        self.proc.start()
+        self.poll_timer = self.reactor.register_timer(
+            self._poll_result, self.reactor.monotonic() + POLL_TIME
+        )
+
+    def _poll_result(self, eventtime):
+        if not self.conn.poll():
+            if self.proc.is_alive():
+                return eventtime + POLL_TIME
+            is_err, res = True, "analysis process exited"
+        else:
+            is_err, res = self.conn.recv()
+        # Release the timer and the process before running callbacks
+        self._stop()
+        if is_err:
+            self.state = "error"
+            logging.error("Error analyzing G-Code file: %s", res)
+        else:
+            self._set_result(res)
+        return self.reactor.NEVER
+
+    def _set_result(self, index):
+        self.file_index = FileIndex(index)
+        self.state = "ready"
+        logging.info(
+            "G-Code file analysis of %s: %d layers, %.1fs estimated",
+            self.filename,
+            self.file_index.get_layer_count(),
+            index["estimated_time"],
+        )
+        callbacks, self.callbacks = self.callbacks, []
+        for cb in callbacks:
+            cb(self.file_index)
+
+    def wait(self, gcode):
+        # Block the calling command until the analysis completes
+        eventtime = last_report_time = self.reactor.monotonic()
+        while self.state == "analyzing":
+            if eventtime > last_report_time + 5.0:
+                last_report_time = eventtime
+                gcode.respond_info("Analyzing G-Code file...", log=False)
+            eventtime = self.reactor.pause(eventtime + 0.1)
+        return self.file_index
+
+    def get_file_index(self):
+        return self.file_index
+
+    def get_status(self, file_position):
+        status = {"state": self.state}
+        if self.file_index is not None:
+            status.update(self.file_index.get_summary())
+            status["current_layer"] = self.file_index.get_layer(file_position)
+            status["estimated_time_left"] = self.file_index.get_time_left(
+                file_position
+            )
+        return status
@@ -136,18 +136,21 @@ class TemplateWrapperJinja:
 
 
 class TemplateWrapperPython:
-    def __init__(self, printer, env, name, script):
+    def __init__(self, printer, env, name, script, function=False):
         self.printer = printer
         self.name = name
         self.toolhead = None
         self.gcode = self.printer.lookup_object("gcode")
         self.gcode_macro = self.printer.lookup_object("gcode_macro")
-        self.create_template_context = self.gcode_macro.create_template_context
         self.checked_own_macro = False
         self.vars = None
+        self.is_function = function
 
         try:
-            self.func = compile(script, name, "exec")
+            if function:
+                code = self._compile_function(script)
+            else:
+                code = compile(script, name, "exec")
         except SyntaxError as e:
             msg = "Error compiling expression '%s': %s at line %d column %d" % (
                 self.name,
@@ -158,8 +161,8 @@ class TemplateWrapperPython:
             logging.exception(msg)
             raise self.gcode.error(msg)
 
-    def run_gcode_from_command(self, context=None):
-        helpers = {
+        # Helpers are bound once and shared by every call of this macro
+        self.helpers = {
             "printer": GetStatusWrapperPython(self.printer),
             "emit": self._action_emit,
             "wait_while": self._action_wait_while,
@@ -178,22 +181,50 @@ class TemplateWrapperPython:
             "action_call_remote_method": self.gcode_macro._action_call_remote_method,
             "math": math,
         }
+        self.globals = dict(self.helpers)
+        if function:
+            # Run the module once to define the macro function
+            exec(code, self.globals)
+            self.func = self.globals.pop("__macro__")
+        else:
+            self.func = code
+
+    def _compile_function(self, script):
+        # Wrap the script body in a function, keeping the original line
+        # numbers so tracebacks point at the user's script
+        tree = ast.parse(script, self.name)
+        wrapper = ast.parse("def __macro__(params, rawparams):\n    pass")
+        func_def = wrapper.body[0]
+        if tree.body:
+            func_def.body = tree.body
+        return compile(wrapper, self.name, "exec")
 
-        if not self.checked_own_macro:
-            self.checked_own_macro = True
-            own_macro = self.printer.lookup_object(
-                self.name.split(":")[0], None
-            )
-            if own_macro is not None and isinstance(own_macro, GCodeMacro):
-                self.vars = TemplateVariableWrapperPython(own_macro)
-        if self.vars is not None:
-            helpers["own_vars"] = self.vars
+    def create_template_context(self, eventtime=None):
+        # The printer wrapper and actions are already part of the globals
+        return {}
 
+    def _check_own_macro(self):
+        self.checked_own_macro = True
+        own_macro = self.printer.lookup_object(self.name.split(":")[0], None)
+        if own_macro is not None and isinstance(own_macro, GCodeMacro):
+            self.vars = TemplateVariableWrapperPython(own_macro)
+            self.helpers["own_vars"] = self.vars
+            self.globals["own_vars"] = self.vars
+
+    def run_gcode_from_command(self, context=None):
+        if not self.checked_own_macro:
+            self._check_own_macro()
         if context is None:
             context = {}
-        exec_globals = dict(context | helpers)
         try:
-            exec(self.func, exec_globals, {})
+            if self.is_function:
+                self.func(context.get("params", {}), context.get("rawparams"))
+            else:
+                # Each call gets its own namespace so names assigned by
+                # one call don't leak into the next
+                exec_globals = dict(context)
+                exec_globals.update(self.helpers)
+                exec(self.func, exec_globals, {})
         except Exception as e:
             msg = "Error evaluating '%s': %s" % (
                 self.name,
@@ -283,10 +314,19 @@ class TemplateVariableWrapperPython:
 
 
 class Template:
-    def __init__(self, printer, env, name, script, script_type="gcode") -> None:
+    def __init__(
+        self,
+        printer,
+        env,
+        name,
+        script,
+        script_type="gcode",
+        python_function=False,
+    ) -> None:
         self.name = name
         self.printer = printer
         self.env = env
+        self.python_function = python_function
         self.reload(script_type, script)
 
     def __call__(self, context=None):
@@ -302,7 +342,11 @@ class Template:
     ):
         if script_type == "python":
             self.function = TemplateWrapperPython(
-                self.printer, self.env, self.name, script
+                self.printer,
+                self.env,
+                self.name,
+                script,
+                function=self.python_function,
             )
         else:
             self.function = TemplateWrapperJinja(
@@ -330,14 +374,21 @@ class PrinterGCodeMacro:
             "RELOAD_GCODE_MACROS", self.cmd_RELOAD_GCODE_MACROS
         )
 
-    def load_template(self, config, option, default=None):
+    def load_template(
+        self, config, option, default=None, python_function=False
+    ):
         name = "%s:%s" % (config.get_name(), option)
         if default is None:
             script_type, script = config.getscript(option)
         else:
             script_type, script = config.getscript(option, default)
         return Template(
-            self.printer, self.env, name, script, script_type=script_type
+            self.printer,
+            self.env,
+            name,
+            script,
+            script_type=script_type,
+            python_function=python_function,
         )
 
     def _action_emergency_stop(self, msg="action_emergency_stop"):
@@ -412,7 +463,11 @@ class GCodeMacro:
         self.alias = name.upper()
         self.printer = printer = config.get_printer()
         gcode_macro = printer.load_object(config, "gcode_macro")
-        self.template = gcode_macro.load_template(config, "gcode")
+        self.template = gcode_macro.load_template(
+            config,
+            "gcode",
+            python_function=config.getboolean("python_function", False),
+        )
         self.gcode = printer.lookup_object("gcode")
         self.rename_existing = config.get("rename_existing", None)
         self.cmd_desc = config.get("description", "G-Code macro")
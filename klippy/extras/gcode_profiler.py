@@ -0,0 +1,190 @@
+# Track host time spent running G-Code commands and macros
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+
+SORT_KEYS = ["self", "total", "wait", "calls"]
+
+
+class CommandProfile:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.wait_time = 0.0
+
+    def get_stats(self):
+        return {
+            "calls": self.calls,
+            "total_time": self.total_time,
+            "self_time": self.self_time,
+            "wait_time": self.wait_time,
+        }
+
+    def get_sort_value(self, key):
+        if key == "total":
+            return self.total_time
+        if key == "wait":
+            return self.wait_time
+        if key == "calls":
+            return self.calls
+        return self.self_time
+
+
+class GCodeProfiler:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        self.gcode = self.printer.lookup_object("gcode")
+        self.enabled = False
+        self.profiles = {}
+        # Stack of [child_time, child_wait_time] for nested commands
+        self.call_stack = []
+        self.start_time = None
+        self.report_count = config.getint("report_count", 20, minval=1)
+        self.reset_on_print = config.getboolean("reset_on_print", True)
+        enable = config.getboolean("enable", False)
+        # Register handlers
+        if enable:
+            self.printer.register_event_handler(
+                "klippy:ready", self._handle_ready
+            )
+        if self.reset_on_print:
+            self.printer.register_event_handler(
+                "print_stats:reset", self._handle_print_reset
+            )
+        self.gcode.register_command(
+            "GCODE_PROFILE",
+            self.cmd_GCODE_PROFILE,
+            desc=self.cmd_GCODE_PROFILE_help,
+        )
+        webhooks = self.printer.lookup_object("webhooks")
+        webhooks.register_endpoint(
+            "gcode_profiler/dump", self._handle_dump_request
+        )
+        webhooks.register_endpoint(
+            "gcode_profiler/reset", self._handle_reset_request
+        )
+
+    def _handle_ready(self):
+        self.set_enabled(True)
+
+    def _handle_print_reset(self):
+        if self.enabled:
+            self.reset()
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        self.call_stack = []
+        if enabled:
+            if self.start_time is None:
+                self.start_time = self.reactor.monotonic()
+            self.gcode.set_profiler(self)
+        else:
+            self.gcode.set_profiler(None)
+
+    def reset(self):
+        self.profiles = {}
+        self.start_time = None
+        if self.enabled:
+            self.start_time = self.reactor.monotonic()
+
+    # Called by GCodeDispatch for every command while enabled
+    def run_command(self, cmd, handler, gcmd):
+        call_stack = self.call_stack
+        frame = [0.0, 0.0]
+        call_stack.append(frame)
+        monotonic = self.reactor.monotonic
+        get_pause_time = self.reactor.get_pause_time
+        # Time spent blocked in the reactor (move queue, heater waits,
+        # dwells, ...) is counted as wait time instead of self time
+        start_wait = get_pause_time()
+        start_time = monotonic()
+        try:
+            handler(gcmd)
+        finally:
+            total_time = monotonic() - start_time
+            wait_time = get_pause_time() - start_wait
+            if call_stack and call_stack[-1] is frame:
+                call_stack.pop()
+                if call_stack:
+                    parent = call_stack[-1]
+                    parent[0] += total_time
+                    parent[1] += wait_time
+            profile = self.profiles.get(cmd)
+            if profile is None:
+                profile = self.profiles[cmd] = CommandProfile()
+            profile.calls += 1
+            profile.total_time += total_time
+            profile.self_time += total_time - frame[0] - (wait_time - frame[1])
+            profile.wait_time += wait_time - frame[1]
+
+    def get_profile(self, eventtime=None):
+        if eventtime is None:
+            eventtime = self.reactor.monotonic()
+        duration = 0.0
+        if self.start_time is not None:
+            duration = eventtime - self.start_time
+        return {
+            "enabled": self.enabled,
+            "duration": duration,
+            "commands": {
+                cmd: profile.get_stats()
+                for cmd, profile in self.profiles.items()
+            },
+        }
+
+    def get_status(self, eventtime):
+        return {"enabled": self.enabled}
+
+    def _handle_dump_request(self, web_request):
+        web_request.send(self.get_profile())
+
+    def _handle_reset_request(self, web_request):
+        self.reset()
+
+    cmd_GCODE_PROFILE_help = "Report or control the G-Code command profiler"
+
+    def cmd_GCODE_PROFILE(self, gcmd):
+        enable = gcmd.get_int("ENABLE", None, minval=0, maxval=1)
+        reset = gcmd.get_int("RESET", 0, minval=0, maxval=1)
+        if reset:
+            self.reset()
+        if enable is not None:
+            self.set_enabled(bool(enable))
+        if reset or enable is not None:
+            gcmd.respond_info(
+                "G-Code profiler %s" % (["disabled", "enabled"][self.enabled],)
+            )
+            return
+        sort_key = gcmd.get("SORT", "self").lower()
+        if sort_key not in SORT_KEYS:
+            raise gcmd.error("SORT must be one of %s" % (", ".join(SORT_KEYS),))
+        count = gcmd.get_int("COUNT", self.report_count, minval=1)
+        if not self.profiles:
+            state = ["disabled", "enabled"][self.enabled]
+            gcmd.respond_info("No G-Code profile data (profiler %s)" % (state,))
+            return
+        profiles = sorted(
+            self.profiles.items(),
+            key=lambda item: item[1].get_sort_value(sort_key),
+            reverse=True,
+        )
+        lines = ["command: calls total_ms self_ms wait_ms"]
+        for cmd, profile in profiles[:count]:
+            lines.append(
+                "%s: %d %.3f %.3f %.3f"
+                % (
+                    cmd,
+                    profile.calls,
+                    profile.total_time * 1000.0,
+                    profile.self_time * 1000.0,
+                    profile.wait_time * 1000.0,
+                )
+            )
+        gcmd.respond_info("\n".join(lines))
+
+
+def load_config(config):
+    return GCodeProfiler(config)
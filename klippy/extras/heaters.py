@@ -219,6 +219,8 @@ class Heater:
             if degrees != 0.0 and hasattr(self.control, "check_valid"):
                 self.control.check_valid()
             self.target_temp = degrees
+        if hasattr(self.sensor, "note_target"):
+            self.sensor.note_target(degrees)
 
     def get_temp(self, eventtime):
         est_print_time = self.mcu_pwm.get_mcu().estimated_print_time(eventtime)
@@ -249,6 +251,8 @@ class Heater:
         if target_temp:
             target_temp = max(self.min_temp, min(self.max_temp, target_temp))
         self.target_temp = target_temp
+        if hasattr(self.sensor, "note_target"):
+            self.sensor.note_target(target_temp)
 
     def stats(self, eventtime):
         est_print_time = self.mcu_pwm.get_mcu().estimated_print_time(eventtime)
@@ -5,7 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 
-from . import bus
+from . import adaptive_report, bus
 from .danger_options import get_danger_options
 
 ######################################################################
@@ -109,7 +109,22 @@ class HTU21D:
             )
         self.deviceId = config.get("sensor_type")
         self.temp = self.min_temp = self.max_temp = self.humidity = 0.0
-        self.sample_timer = self.reactor.register_timer(self._sample_htu21d)
+        self.poll_client = bus.lookup_i2c_poller(self.mcu).register_client(
+            self.i2c, self._sample_htu21d
+        )
+        self.adaptive_report = adaptive_report.AdaptiveReportTime(
+            config, self, self.poll_client, self.report_time
+        )
+        if self.hold_master_mode:
+            temp_cmd = HTU21D_COMMANDS["HTU21D_TEMP"]
+            humid_cmd = HTU21D_COMMANDS["HTU21D_HUMID"]
+        else:
+            temp_cmd = HTU21D_COMMANDS["HTU21D_TEMP_NH"]
+            humid_cmd = HTU21D_COMMANDS["HTU21D_HUMID_NH"]
+        delays = HTU21D_DEVICES[self.deviceId][self.resolution]
+        self.poll_client.set_steps(
+            [([temp_cmd], delays[0], [], 3), ([humid_cmd], delays[1], [], 3)]
+        )
         self.printer.add_object("htu21d " + self.name, self)
         self.printer.register_event_handler(
             "klippy:connect", self.handle_connect
@@ -121,7 +136,7 @@ class HTU21D:
 
     def handle_connect(self):
         self._init_htu21d()
-        self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        self.poll_client.start(self.reactor.NOW)
 
     def setup_minmax(self, min_temp, max_temp):
         self.min_temp = min_temp
@@ -130,6 +145,9 @@ class HTU21D:
     def setup_callback(self, cb):
         self._callback = cb
 
+    def note_target(self, target):
+        self.adaptive_report.note_target(target)
+
     def get_report_time_delta(self):
         return self.report_time
 
@@ -176,23 +194,14 @@ class HTU21D:
         self.i2c.i2c_write([HTU21D_COMMANDS["WRITE"]], registerData)
         logging.info("htu21d: Setting resolution to %s " % self.resolution)
 
-    def _sample_htu21d(self, eventtime):
+    def _sample_htu21d(self, eventtime, responses):
+        if responses is None:
+            logging.error("htu21d: Error reading data")
+            self.temp = self.humidity = 0.0
+            return self.reactor.NEVER
         try:
             # Read Temeprature
-            if self.hold_master_mode:
-                params = self.i2c.i2c_write([HTU21D_COMMANDS["HTU21D_TEMP"]])
-            else:
-                params = self.i2c.i2c_write([HTU21D_COMMANDS["HTU21D_TEMP_NH"]])
-
-            # Wait
-            self.reactor.pause(
-                self.reactor.monotonic()
-                + HTU21D_DEVICES[self.deviceId][self.resolution][0]
-            )
-
-            params = self.i2c.i2c_read([], 3)
-
-            response = bytearray(params["response"])
+            response = responses[0]
             rtemp = response[0] << 8
             rtemp |= response[1]
             if self._chekCRC8(rtemp) != response[2]:
@@ -204,20 +213,7 @@ class HTU21D:
                 logging.debug("htu21d: Temperature %.2f " % self.temp)
 
             # Read Humidity
-            if self.hold_master_mode:
-                self.i2c.i2c_write([HTU21D_COMMANDS["HTU21D_HUMID"]])
-            else:
-                self.i2c.i2c_write([HTU21D_COMMANDS["HTU21D_HUMID_NH"]])
-
-            # Wait
-            self.reactor.pause(
-                self.reactor.monotonic()
-                + HTU21D_DEVICES[self.deviceId][self.resolution][1]
-            )
-
-            params = self.i2c.i2c_read([], 3)
-
-            response = bytearray(params["response"])
+            response = responses[1]
             rhumid = response[0] << 8
             rhumid |= response[1]
             if self._chekCRC8(rhumid) != response[2]:
@@ -260,7 +256,9 @@ class HTU21D:
         measured_time = self.reactor.monotonic()
         print_time = self.i2c.get_mcu().estimated_print_time(measured_time)
         self._callback(print_time, self.temp)
-        return measured_time + self.report_time
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
     def _chekCRC8(self, data):
         for bit in range(0, 16):
@@ -275,6 +273,7 @@ class HTU21D:
         return {
             "temperature": round(self.temp, 2),
             "humidity": self.humidity,
+            "report_time": self.adaptive_report.get_report_time(),
         }
 
 
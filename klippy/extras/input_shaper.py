@@ -97,6 +97,12 @@ class AxisInputShaper:
             )
         return success
 
+    def set_shaped_trapq(self, shaped_trapq):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        ffi_lib.shaped_trapq_set_shaper_params(
+            shaped_trapq, self.axis.encode(), self.n, self.A, self.T
+        )
+
     def disable_shaping(self):
         if self.saved is None and self.n:
             self.saved = (self.n, self.A, self.T)
@@ -131,6 +137,9 @@ class InputShaper:
         ]
         self.input_shaper_stepper_kinematics = []
         self.orig_stepper_kinematics = []
+        # Optional pre-shaped motion queue shared by all shaped steppers
+        self.use_shaped_trapq = config.getboolean("use_shaped_trapq", False)
+        self.shaped_trapq = None
         # Register gcode commands
         gcode = self.printer.lookup_object("gcode")
         gcode.register_command(
@@ -142,8 +151,25 @@ class InputShaper:
     def get_shapers(self):
         return self.shapers
 
+    def get_shaped_trapq(self):
+        return self.shaped_trapq
+
+    def _handle_set_position(self):
+        # The trapq history was rewritten (eg, an aborted homing move)
+        ffi_main, ffi_lib = chelper.get_ffi()
+        ffi_lib.shaped_trapq_reset(self.shaped_trapq)
+
     def connect(self):
         self.toolhead = self.printer.lookup_object("toolhead")
+        if self.use_shaped_trapq:
+            ffi_main, ffi_lib = chelper.get_ffi()
+            self.shaped_trapq = ffi_main.gc(
+                ffi_lib.shaped_trapq_alloc(self.toolhead.get_trapq()),
+                ffi_lib.shaped_trapq_free,
+            )
+            self.printer.register_event_handler(
+                "toolhead:set_position", self._handle_set_position
+            )
         # Configure initial values
         self._update_input_shaping(error=self.printer.config_error)
 
@@ -163,6 +189,8 @@ class InputShaper:
         if res < 0:
             stepper.set_stepper_kinematics(sk)
             return None
+        if self.shaped_trapq is not None:
+            ffi_lib.input_shaper_set_shaped_trapq(is_sk, self.shaped_trapq)
         self.input_shaper_stepper_kinematics.append(is_sk)
         return is_sk
 
@@ -188,6 +216,9 @@ class InputShaper:
                 self.toolhead.note_step_generation_scan_time(
                     new_delay, old_delay
                 )
+        if self.shaped_trapq is not None:
+            for shaper in self.shapers:
+                shaper.set_shaped_trapq(self.shaped_trapq)
         if failed_shapers:
             error = error or self.printer.command_error
             raise error(
@@ -5,7 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 
-from . import bus
+from . import adaptive_report, bus
 from .danger_options import get_danger_options
 
 LM75_CHIP_ADDR = 0x48
@@ -37,7 +37,13 @@ class LM75:
             "lm75_report_time", LM75_REPORT_TIME, minval=LM75_MIN_REPORT_TIME
         )
         self.temp = self.min_temp = self.max_temp = 0.0
-        self.sample_timer = self.reactor.register_timer(self._sample_lm75)
+        self.poll_client = bus.lookup_i2c_poller(self.mcu).register_client(
+            self.i2c, self._sample_lm75
+        )
+        self.adaptive_report = adaptive_report.AdaptiveReportTime(
+            config, self, self.poll_client, self.report_time
+        )
+        self.poll_client.set_steps([(None, 0.0, [LM75_REGS["TEMP"]], 2)])
         self.printer.add_object("lm75 " + self.name, self)
         self.printer.register_event_handler(
             "klippy:connect", self.handle_connect
@@ -49,7 +55,7 @@ class LM75:
 
     def handle_connect(self):
         self._init_lm75()
-        self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        self.poll_client.start(self.reactor.NOW)
 
     def setup_minmax(self, min_temp, max_temp):
         self.min_temp = min_temp
@@ -58,6 +64,9 @@ class LM75:
     def setup_callback(self, cb):
         self._callback = cb
 
+    def note_target(self, target):
+        self.adaptive_report.note_target(target)
+
     def get_report_time_delta(self):
         return self.report_time
 
@@ -75,14 +84,12 @@ class LM75:
         except:
             pass
 
-    def _sample_lm75(self, eventtime):
-        try:
-            sample = self.read_register("TEMP", 2)
-            self.temp = self.degrees_from_sample(sample)
-        except Exception:
-            logging.exception("lm75: Error reading data")
+    def _sample_lm75(self, eventtime, responses):
+        if responses is None:
+            logging.error("lm75: Error reading data")
             self.temp = 0.0
             return self.reactor.NEVER
+        self.temp = self.degrees_from_sample(responses[0])
 
         if (
             self.temp < self.min_temp or self.temp > self.max_temp
@@ -94,7 +101,9 @@ class LM75:
 
         measured_time = self.reactor.monotonic()
         self._callback(self.mcu.estimated_print_time(measured_time), self.temp)
-        return measured_time + self.report_time
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
     def read_register(self, reg_name, read_len):
         # read a single register
@@ -112,6 +121,7 @@ class LM75:
     def get_status(self, eventtime):
         return {
             "temperature": round(self.temp, 2),
+            "report_time": self.adaptive_report.get_report_time(),
         }
 
 
@@ -34,6 +34,8 @@ class TrapezoidalMove:
     x_r: float
     y_r: float
     z_r: float
+    c3: float
+    c4: float
 
     def __init__(self, move, time_offset=0.0):
         # copy c data to python memory
@@ -47,6 +49,8 @@ class TrapezoidalMove:
         self.x_r = float(move.x_r)
         self.y_r = float(move.y_r)
         self.z_r = float(move.z_r)
+        self.c3 = float(move.c3)
+        self.c4 = float(move.c4)
 
     def to_dict(self) -> dict[str, float]:
         return {
@@ -60,6 +64,8 @@ class TrapezoidalMove:
             "x_r": float(self.x_r),
             "y_r": float(self.y_r),
             "z_r": float(self.z_r),
+            "c3": float(self.c3),
+            "c4": float(self.c4),
         }
 
 
@@ -399,7 +405,12 @@ class TapAnalysis:
     def _move_dist(move: TrapezoidalMove, print_time: float):
         move_t = move.move_t
         move_time = max(0.0, min(move_t, print_time - move.print_time))
-        dist = (move.start_v + (0.5 * move.accel) * move_time) * move_time
+        # Quartic terms are only non-zero with S-curve acceleration
+        dist = (
+            move.start_v
+            + (0.5 * move.accel + (move.c3 + move.c4 * move_time) * move_time)
+            * move_time
+        ) * move_time
         return dist
 
     @staticmethod
@@ -443,7 +454,7 @@ class TapAnalysis:
         homing_move = self._moves[PROBE_CRUISE]
         halt_move = self._moves[PROBE_HALT]
         # acceleration should be 0! This is the 'coasting' move:
-        if homing_move.accel != 0.0:
+        if homing_move.accel != 0.0 or homing_move.c3 != 0.0:
             raise TapValidationError(
                 "COASTING_MOVE_ACCELERATION",
                 "Probing move is accelerating/decelerating which is invalid",
@@ -4,6 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
+import math
 
 from klippy import chelper
 
@@ -114,6 +115,7 @@ class DumpTrapQ:
                 "acceleration",
                 "start_position",
                 "direction",
+                "scurve_terms",
             )
         }
         self.batch_bulk.add_mux_endpoint(
@@ -144,7 +146,7 @@ class DumpTrapQ:
         for i, m in enumerate(data):
             out.append(
                 "move %d: pt=%.6f mt=%.6f sv=%.6f a=%.6f"
-                " sp=(%.6f,%.6f,%.6f) ar=(%.6f,%.6f,%.6f)"
+                " sp=(%.6f,%.6f,%.6f) ar=(%.6f,%.6f,%.6f) c=(%.6f,%.6f)"
                 % (
                     i,
                     m.print_time,
@@ -157,26 +159,29 @@ class DumpTrapQ:
                     m.x_r,
                     m.y_r,
                     m.z_r,
+                    m.c3,
+                    m.c4,
                 )
             )
         logging.info("\n".join(out))
 
-    def get_trapq_position(self, print_time):
+    def get_trapq_positions(self, print_times):
         ffi_main, ffi_lib = chelper.get_ffi()
-        data = ffi_main.new("struct pull_move[1]")
-        count = ffi_lib.trapq_extract_old(self.trapq, data, 1, 0.0, print_time)
-        if not count:
-            return None, None
-        move = data[0]
-        move_time = max(0.0, min(move.move_t, print_time - move.print_time))
-        dist = (move.start_v + 0.5 * move.accel * move_time) * move_time
-        pos = (
-            move.start_x + move.x_r * dist,
-            move.start_y + move.y_r * dist,
-            move.start_z + move.z_r * dist,
-        )
-        velocity = move.start_v + move.accel * move_time
-        return pos, velocity
+        count = len(print_times)
+        times = ffi_main.new("double[]", list(print_times))
+        out = ffi_main.new("double[]", count * 4)
+        ffi_lib.trapq_get_positions(self.trapq, times, count, out)
+        res = []
+        for i in range(count):
+            velocity = out[i * 4 + 3]
+            if math.isnan(velocity):
+                res.append((None, None))
+                continue
+            res.append((tuple(out[i * 4 : i * 4 + 3]), velocity))
+        return res
+
+    def get_trapq_position(self, print_time):
+        return self.get_trapq_positions([print_time])[0]
 
     def _process_batch(self, eventtime):
         qtime = self.last_batch_msg[0] + min(self.last_batch_msg[1], 0.100)
@@ -189,6 +194,7 @@ class DumpTrapQ:
                 m.accel,
                 (m.start_x, m.start_y, m.start_z),
                 (m.x_r, m.y_r, m.z_r),
+                (m.c3, m.c4),
             )
             for m in data
         ]
@@ -208,11 +214,13 @@ class PrinterMotionReport:
         self.printer = config.get_printer()
         self.steppers = {}
         self.trapqs = {}
+        self.input_shaper = None
         # get_status information
         self.next_status_time = 0.0
         gcode = self.printer.lookup_object("gcode")
         self.last_status = {
             "live_position": gcode.Coord(0.0, 0.0, 0.0, 0.0),
+            "live_shaped_position": gcode.Coord(0.0, 0.0, 0.0, 0.0),
             "live_velocity": 0.0,
             "live_extruder_velocity": 0.0,
             "steppers": [],
@@ -241,6 +249,7 @@ class PrinterMotionReport:
                 break
             etrapq = extruder.get_trapq()
             self.trapqs[ename] = DumpTrapQ(self.printer, ename, etrapq)
+        self.input_shaper = self.printer.lookup_object("input_shaper", None)
         # Populate 'trapq' and 'steppers' in get_status result
         self.last_status["steppers"] = list(sorted(self.steppers.keys()))
         self.last_status["trapq"] = list(sorted(self.trapqs.keys()))
@@ -306,9 +315,25 @@ class PrinterMotionReport:
             if pos is not None:
                 epos = (pos[0],)
                 evelocity = velocity
+        # Calculate the input shaped toolhead position
+        shaped_xyzpos = xyzpos
+        shaped_trapq = None
+        if self.input_shaper is not None:
+            shaped_trapq = self.input_shaper.get_shaped_trapq()
+        if shaped_trapq is not None:
+            ffi_main, ffi_lib = chelper.get_ffi()
+            res = ffi_main.new("double[6]")
+            ret = ffi_lib.shaped_trapq_get_position(
+                shaped_trapq, print_time, res
+            )
+            if not ret:
+                shaped_xyzpos = (res[0], res[1], res[2])
         # Report status
         self.last_status = dict(self.last_status)
         self.last_status["live_position"] = toolhead.Coord(*(xyzpos + epos))
+        self.last_status["live_shaped_position"] = toolhead.Coord(
+            *(shaped_xyzpos + epos)
+        )
         self.last_status["live_velocity"] = xyzvelocity
         self.last_status["live_extruder_velocity"] = evelocity
         return self.last_status
@@ -0,0 +1,167 @@
+# Least squares fit of the MPC heater model from a recorded trajectory
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import math
+
+import numpy as np
+
+MAX_SIM_STEP = 0.05
+MAX_ITERATIONS = 100
+DIFF_STEP = 1e-5
+CONFIDENCE_SIGMA = 1.96
+
+
+class FitError(Exception):
+    pass
+
+
+def fan_weights(fan_speeds, fan_breakpoints):
+    # Linear interpolation weights of the fan transfer breakpoints
+    # (matches the interpolation done in ControlMPC)
+    weights = np.zeros((len(fan_speeds), fan_breakpoints))
+    if fan_breakpoints == 1:
+        weights[:, 0] = 1.0
+        return weights
+    fan_break = np.clip(fan_speeds, 0.0, 1.0) * (fan_breakpoints - 1)
+    below = np.minimum(np.floor(fan_break).astype(int), fan_breakpoints - 2)
+    frac = fan_break - below
+    rows = np.arange(len(fan_speeds))
+    weights[rows, below] = 1.0 - frac
+    weights[rows, below + 1] = frac
+    return weights
+
+
+def simulate(params, times, powers, weights, ambient_temp, start_temp):
+    # Simulate the sensor temperature for each row of model parameters
+    # (block_heat_capacity, sensor_responsiveness, transfer...)
+    params = np.atleast_2d(params)
+    heat_capacity = params[:, 0]
+    responsiveness = params[:, 1]
+    transfers = params[:, 2:] @ weights.T
+    block_temp = np.full(len(params), float(start_temp))
+    sensor_temp = block_temp.copy()
+    out = np.empty((len(params), len(times)))
+    out[:, 0] = sensor_temp
+    for i in range(1, len(times)):
+        dt = times[i] - times[i - 1]
+        steps = max(1, int(math.ceil(dt / MAX_SIM_STEP)))
+        step_t = dt / steps
+        power = powers[i - 1]
+        transfer = transfers[:, i - 1]
+        for _ in range(steps):
+            block_temp += (
+                (power - transfer * (block_temp - ambient_temp))
+                * step_t
+                / heat_capacity
+            )
+            sensor_temp += (block_temp - sensor_temp) * responsiveness * step_t
+        out[:, i] = sensor_temp
+    return out
+
+
+def applied_powers(times, duties, heater_power, pwm_delay):
+    # Power in effect during each sample interval (pwm updates are
+    # scheduled pwm_delay after the temperature reading)
+    pwm_times = times + pwm_delay
+    idx = np.searchsorted(pwm_times, times + 1e-6, side="right") - 1
+    powers = np.where(idx >= 0, duties[np.maximum(idx, 0)], 0.0)
+    return powers * heater_power
+
+
+def levenberg_marquardt(simulate_rows, theta, diff_steps, measured):
+    # Least squares fit of the parameters theta.  simulate_rows() is
+    # called with a 2d array of parameter rows and returns the simulated
+    # measurements of each row.
+    param_count = len(theta)
+    probes = np.vstack([np.zeros(param_count), np.diag(diff_steps)])
+
+    def evaluate(theta, with_jacobian):
+        rows = theta + probes if with_jacobian else theta[None, :]
+        sim = simulate_rows(rows)
+        residuals = sim[0] - measured
+        if not with_jacobian:
+            return residuals, None
+        return residuals, (sim[1:] - sim[0]).T / diff_steps
+
+    residuals, jac = evaluate(theta, True)
+    cost = residuals @ residuals
+    damping = 1e-3
+    for _ in range(MAX_ITERATIONS):
+        jtj = jac.T @ jac
+        grad = jac.T @ residuals
+        improved = False
+        while damping < 1e10:
+            lhs = jtj + damping * np.diag(np.diag(jtj) + 1e-12)
+            step = np.clip(np.linalg.solve(lhs, -grad), -1.0, 1.0)
+            new_residuals, _ = evaluate(theta + step, False)
+            new_cost = new_residuals @ new_residuals
+            if new_cost < cost:
+                improved = True
+                break
+            damping *= 10.0
+        if not improved:
+            break
+        theta = theta + step
+        damping = max(damping * 0.3, 1e-9)
+        done = cost - new_cost < 1e-10 * cost or np.max(np.abs(step)) < 1e-8
+        residuals, jac = evaluate(theta, True)
+        cost = residuals @ residuals
+        if done:
+            break
+    if not np.all(np.isfinite(theta)) or not np.isfinite(cost):
+        raise FitError("model fit did not converge")
+    # Linearized covariance of the parameters
+    variance = cost / max(1, len(measured) - param_count)
+    try:
+        cov = np.linalg.inv(jac.T @ jac) * variance
+    except np.linalg.LinAlgError:
+        raise FitError("model parameters are not identifiable")
+    return theta, cov, cost
+
+
+def fit_mpc_model(
+    samples, heater_power, ambient_temp, pwm_delay, fan_breakpoints, initial
+):
+    """
+    Fit block_heat_capacity, sensor_responsiveness and the ambient
+    transfer at each fan breakpoint to a list of (time, temp, duty,
+    fan_speed) samples.  The fit is performed in log space (so that all
+    constants stay positive) with a Levenberg-Marquardt iteration.
+    """
+    data = np.array(samples, dtype=float)
+    times, temps = data[:, 0], data[:, 1]
+    powers = applied_powers(times, data[:, 2], heater_power, pwm_delay)
+    weights = fan_weights(data[:, 3], fan_breakpoints)
+    start_temp = temps[0]
+    param_count = 2 + fan_breakpoints
+    if len(samples) <= 2 * param_count:
+        raise FitError("not enough samples")
+    theta = np.log(
+        [initial["block_heat_capacity"], initial["sensor_responsiveness"]]
+        + list(initial["fan_ambient_transfer"])
+    )
+
+    def simulate_rows(rows):
+        return simulate(
+            np.exp(rows), times, powers, weights, ambient_temp, start_temp
+        )
+
+    theta, cov, cost = levenberg_marquardt(
+        simulate_rows, theta, np.full(param_count, DIFF_STEP), temps
+    )
+
+    # Confidence intervals from the linearized parameter covariance
+    values = np.exp(theta)
+    intervals = values * CONFIDENCE_SIGMA * np.sqrt(np.maximum(np.diag(cov), 0))
+    values, intervals = values.tolist(), intervals.tolist()
+    return {
+        "block_heat_capacity": values[0],
+        "sensor_responsiveness": values[1],
+        "ambient_transfer": values[2],
+        "fan_ambient_transfer": values[2:],
+        "block_heat_capacity_ci": intervals[0],
+        "sensor_responsiveness_ci": intervals[1],
+        "ambient_transfer_ci": intervals[2],
+        "fan_ambient_transfer_ci": intervals[2:],
+        "rms_error": math.sqrt(float(cost) / len(temps)),
+    }
@@ -6,6 +6,8 @@
 import logging
 import math
 
+from klippy import mathutil
+
 from . import heaters
 
 
@@ -28,6 +30,7 @@ class PIDCalibrate:
         write_file,
         gcmd,
         calibrate_secondary,
+        method="relay",
     ):
         if isinstance(heater.control, heaters.ControlDualLoopPID):
             if calibrate_secondary:
@@ -67,6 +70,8 @@ class PIDCalibrate:
                     % (heater.get_name(), target)
                 )
                 pheaters.set_temperature(heater, max_temp, True)
+        elif method == "fopdt":
+            calibrate = ControlStepTune(heater, target)
         else:
             calibrate = ControlAutoTune(heater, target, tolerance)
 
@@ -86,6 +91,8 @@ class PIDCalibrate:
 
         if calibrate.check_busy(0.0, 0.0, 0.0):
             raise gcmd.error("pid_calibrate interrupted")
+        if method == "fopdt":
+            self._fit_model(gcmd, calibrate)
         # Log and report results
         kp, ki, kd = calibrate.calc_pid()
         logging.info(
@@ -97,6 +104,36 @@ class PIDCalibrate:
         )
         return kp, ki, kd, old_control
 
+    def _fit_model(self, gcmd, calibrate):
+        try:
+            from . import fopdt_fit
+        except ImportError:
+            raise gcmd.error(
+                "Failed to import `numpy` module, required for METHOD=FOPDT"
+            )
+        gcmd.respond_info(
+            "Fitting heater model to %d samples" % (len(calibrate.data),)
+        )
+        try:
+            model = mathutil.background_process_exec(
+                self.printer, calibrate.fit_model, (), (fopdt_fit.FitError,)
+            )
+        except fopdt_fit.FitError as e:
+            raise gcmd.error("pid_calibrate failed: %s" % (e,))
+        logging.info("Autotune: FOPDT model: %s", model)
+        gcmd.respond_info(
+            "Heater model: gain=%.2f time_constant=%.2f dead_time=%.3f"
+            " ambient=%.1f rms_error=%.3f"
+            % (
+                model["gain"],
+                model["time_constant"],
+                model["dead_time"],
+                model["ambient_temp"],
+                model["rms_error"],
+            )
+        )
+        calibrate.model = model
+
     cmd_PID_CALIBRATE_help = "Run PID calibration test"
 
     def cmd_PID_CALIBRATE(self, gcmd):
@@ -105,6 +142,9 @@ class PIDCalibrate:
         write_file = gcmd.get_int("WRITE_FILE", 0)
         tolerance = gcmd.get_float("TOLERANCE", TUNE_PID_TOL, above=0.0)
         profile_name = gcmd.get("PROFILE", "default")
+        method = gcmd.get("METHOD", "relay").lower()
+        if method not in ("relay", "fopdt"):
+            raise gcmd.error("Unknown PID calibration method '%s'" % (method,))
         pheaters = self.printer.lookup_object("heaters")
         try:
             heater = pheaters.lookup_heater(heater_name)
@@ -112,7 +152,10 @@ class PIDCalibrate:
             raise gcmd.error(str(e))
         self.printer.lookup_object("toolhead").get_last_move_time()
 
-        if isinstance(heater.control, heaters.ControlDualLoopPID):
+        is_dual_loop = isinstance(heater.control, heaters.ControlDualLoopPID)
+        if is_dual_loop and method != "relay":
+            raise gcmd.error("METHOD=FOPDT does not support dual_loop_pid")
+        if is_dual_loop:
             # Calibrate the inner (secondary) loop
             kp_s, ki_s, kd_s, _ = self._calibrate(
                 pheaters,
@@ -181,6 +224,7 @@ class PIDCalibrate:
                 write_file,
                 gcmd,
                 calibrate_secondary=False,
+                method=method,
             )
 
             logging.info("Autotune: final: Kp=%f Ki=%f Kd=%f", Kp, Ki, Kd)
@@ -494,5 +538,138 @@ class ControlAutoTune:
         return "autotune"
 
 
+TUNE_STEP_BITS = 15
+TUNE_STEP_BIT_RATIO = 20.0
+TUNE_STEP_MIN_BIT_TIME = 1.0
+
+
+class ControlStepTune:
+    def __init__(self, heater, target):
+        self.heater = heater
+        self.heater_max_power = heater.get_max_power()
+        self.gcode = heater.printer.lookup_object("gcode")
+        self.target = target
+        # the excitation is kept within these temperatures
+        self.temp_high = target + TUNE_PID_DELTA / 2.0
+        self.temp_low = target - TUNE_PID_DELTA / 2.0
+        self.started = self.done = self.errored = False
+        self.start_time = 0.0
+        # index of the first sample after the initial step
+        self.step_end = None
+        self.step_end_time = 0.0
+        # time and value of the overshoot after the initial step
+        self.peak_time = 0.0
+        self.peak_temp = target
+        self.settled = False
+        # pseudo random binary sequence state
+        self.bit_time = self.bit_end_time = 0.0
+        self.bit_count = 0
+        self.lfsr = 1
+        # (time, temp, pwm, target) of every sample
+        self.data = []
+        self.model = None
+
+    def temperature_update(
+        self, read_time, temp, target_temp, secondary_temp=None
+    ):
+        if self.done:
+            return
+        if not self.started:
+            # ensure the starting temp is low enough to run the test.
+            if temp >= self.temp_low:
+                self.errored = True
+                self.finish(read_time)
+                self.gcode.respond_info(
+                    "temperature is too high to start calibration"
+                )
+                return
+            self.started = True
+            self.start_time = read_time
+        if self.step_end is None and temp >= self.target:
+            # Initial step done - let the overshoot settle
+            self.step_end = len(self.data)
+            self.step_end_time = read_time
+        if self.step_end is None:
+            value = self.heater_max_power
+        elif not self.settled:
+            value = 0.0
+            if temp > self.peak_temp:
+                self.peak_temp = temp
+                self.peak_time = read_time
+            if temp < self.target:
+                # Scale the sequence to the step and overshoot durations
+                self.settled = True
+                step_time = self.step_end_time - self.start_time
+                self.bit_time = max(
+                    TUNE_STEP_MIN_BIT_TIME,
+                    step_time / TUNE_STEP_BIT_RATIO,
+                    self.peak_time - self.step_end_time,
+                )
+                self.bit_end_time = read_time
+                self.gcode.respond_info(
+                    "Heater reached target after %.1fs, applying %d steps"
+                    " of %.1fs" % (step_time, TUNE_STEP_BITS, self.bit_time)
+                )
+        if self.settled:
+            if read_time >= self.bit_end_time:
+                if self.bit_count >= TUNE_STEP_BITS:
+                    self.finish(read_time)
+                    return
+                # 4 bit maximal length linear feedback shift register
+                feedback = ((self.lfsr >> 3) ^ (self.lfsr >> 2)) & 1
+                self.lfsr = ((self.lfsr << 1) | feedback) & 0xF
+                self.bit_count += 1
+                self.bit_end_time += self.bit_time
+            value = self.heater_max_power if self.lfsr & 1 else 0.0
+            if temp > self.temp_high:
+                value = 0.0
+            elif temp < self.temp_low:
+                value = self.heater_max_power
+        self.data.append((read_time, temp, value, self.target))
+        self.heater.set_pwm(read_time, value)
+
+    def finish(self, read_time):
+        self.heater.set_pwm(read_time, 0.0)
+        self.heater.alter_target(0)
+        self.done = True
+
+    def check_busy(self, eventtime, smoothed_temp, target_temp):
+        if eventtime == 0.0 and smoothed_temp == 0.0 and target_temp == 0.0:
+            return self.errored
+        return not self.done
+
+    def write_file(self, filename):
+        f = open(filename, "w")
+        f.write("time, temp, pwm, target\n")
+        data = [
+            "%.5f, %.5f, %.5f, %.5f" % (time, temp, pwm, target)
+            for time, temp, pwm, target in self.data
+        ]
+        f.write("\n".join(data))
+        f.close()
+
+    def fit_model(self):
+        from . import fopdt_fit
+
+        samples = [(time, temp, pwm) for time, temp, pwm, _ in self.data]
+        return fopdt_fit.fit_fopdt(samples, self.step_end)
+
+    def calc_pid(self):
+        from . import fopdt_fit
+
+        kp, ki, kd = fopdt_fit.amigo_pid(self.model)
+        base = heaters.PID_PARAM_BASE
+        return kp * base, ki * base, kd * base
+
+    def update_smooth_time(self, write_to_profile):
+        return
+
+    def get_profile(self):
+        return {"name": "autotune"}
+
+    def get_type(self):
+        return "autotune"
+
+
 def load_config(config):
     return PIDCalibrate(config)
@@ -8,7 +8,7 @@ from __future__ import annotations
 import logging
 import math
 from enum import IntEnum
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 from klippy import Printer, pins
 from klippy.configfile import ConfigWrapper
@@ -190,6 +190,13 @@ class ProbeRetryState:
     def get_attempt(self):
         return self._bad_probe_count
 
+    def accepts_probe(self, is_good: Optional[bool]) -> bool:
+        """Returns True if the probe is accepted without re-probing"""
+        return (
+            bool(is_good)
+            or self.retry_policy.bad_probe_strategy is RetryStrategy.IGNORE
+        )
+
     def evaluate_probe(self, is_good: Optional[bool], gcmd) -> bool:
         """
         Evaluate probe result based on strategy.
@@ -197,10 +204,7 @@ class ProbeRetryState:
         Returns False if probe should be retried.
         Raises error if strategy is FAIL or retries exhausted.
         """
-        if (
-            is_good
-            or self.retry_policy.bad_probe_strategy is RetryStrategy.IGNORE
-        ):
+        if self.accepts_probe(is_good):
             return True
         if self.retry_policy.bad_probe_strategy is RetryStrategy.FAIL:
             raise gcmd.error("Probe failed because it was deemed bad quality")
@@ -250,15 +254,19 @@ class RetrySession:
         self._gcmd = self._pos = self._quantized_pos = self._retry_state = None
         self._point_lookup.clear()
 
+    def _lookup_state(self, pos: list[float]) -> ProbeRetryState:
+        quantized_pos = self._quantize_position((pos[0], pos[1]))
+        if quantized_pos not in self._point_lookup:
+            self._point_lookup[quantized_pos] = ProbeRetryState(
+                (pos[0], pos[1]), self.retry_policy
+            )
+        return self._point_lookup[quantized_pos]
+
     def set_position(self, pos: list[float]) -> None:
         """Set the current ideal position being probed"""
         self._pos = (pos[0], pos[1])
         self._quantized_pos = self._quantize_position((pos[0], pos[1]))
-        if self._quantized_pos not in self._point_lookup:
-            self._point_lookup[self._quantized_pos] = ProbeRetryState(
-                self._pos, self.retry_policy
-            )
-        self._retry_state = self._point_lookup[self._quantized_pos]
+        self._retry_state = self._lookup_state(pos)
 
     def get_position(self) -> tuple[float, float]:
         return self._pos
@@ -267,12 +275,22 @@ class RetrySession:
         """Get the actual probe position for the current 'ideal' position"""
         return self._retry_state.get_position()
 
+    def get_probe_position_at(
+        self, pos: list[float]
+    ) -> tuple[float, float, None]:
+        """Get the probe position for an ideal position, without moving
+        the session to it"""
+        return self._lookup_state(pos).get_position()
+
     def can_retry(self) -> bool:
         return self._retry_state.has_retries_remaining()
 
     def get_bad_probe_count(self):
         return self._retry_state.get_bad_probe_count()
 
+    def accepts_probe(self, is_good: bool) -> bool:
+        return self._retry_state.accepts_probe(is_good)
+
     def evaluate_probe(self, is_good: bool) -> bool:
         return self._retry_state.evaluate_probe(is_good, self._gcmd)
 
@@ -478,6 +496,17 @@ class PrinterProbe:
         )
         return epos[:3], is_good
 
+    def start_scan_session(self, gcmd: GCodeCommand):
+        # Returns None if the probe can't sample while moving
+        start_scan_session = getattr(self.mcu_probe, "start_scan_session", None)
+        if start_scan_session is None:
+            return None
+        toolhead = self.printer.lookup_object("toolhead")
+        curtime = self.printer.get_reactor().monotonic()
+        if "z" not in toolhead.get_status(curtime)["homed_axes"]:
+            raise self.printer.command_error("Must home before probe")
+        return start_scan_session(gcmd)
+
     def _move(self, coord, speed):
         self.printer.lookup_object("toolhead").manual_move(coord, speed)
 
@@ -520,13 +549,22 @@ class PrinterProbe:
         self._move([None, None, pos[2] + sample_retract_dist], lift_speed)
 
     def _run_probe_with_retries(
-        self, speed: float, retry_session: RetrySession, gcmd: GCodeCommand
+        self,
+        speed: float,
+        retry_session: RetrySession,
+        gcmd: GCodeCommand,
+        after_trigger: Optional[Callable[[], None]] = None,
     ) -> list[float]:
         """Probe for a single good result with retries based on strategy"""
         while retry_session.can_retry():
             self._move(retry_session.get_probe_position(), self.retry_speed)
             # Probe position
             pos, is_good = self._probe(speed, gcmd)
+            if after_trigger is not None and retry_session.accepts_probe(
+                is_good
+            ):
+                # No re-probe will follow, queue the next moves right away
+                after_trigger()
             if retry_session.evaluate_probe(is_good):
                 # return the x/y of the original requested location
                 return list(retry_session.get_position() + (pos[2],))
@@ -539,7 +577,10 @@ class PrinterProbe:
         )
 
     def run_probe(
-        self, gcmd: GCodeCommand, retry_session: Optional[RetrySession] = None
+        self,
+        gcmd: GCodeCommand,
+        retry_session: Optional[RetrySession] = None,
+        after_trigger: Optional[Callable[[], None]] = None,
     ) -> list[float]:
         speed = gcmd.get_float("PROBE_SPEED", self.speed, above=0.0)
         sample_count = gcmd.get_int("SAMPLES", self.sample_count, minval=1)
@@ -567,9 +608,14 @@ class PrinterProbe:
         retries = 0
         positions = []
         self._discard_first_result(speed, local_retry_session, gcmd)
+        if sample_count > 1:
+            # Later samples are probed in place
+            after_trigger = None
         while len(positions) < sample_count:
             # Probe position with retries
-            pos = self._run_probe_with_retries(speed, local_retry_session, gcmd)
+            pos = self._run_probe_with_retries(
+                speed, local_retry_session, gcmd, after_trigger
+            )
             positions.append(pos)
             # Check samples tolerance
             z_positions = [p[2] for p in positions]
@@ -870,6 +916,7 @@ class ProbePointsHelper:
         self.lift_speed = self.speed
         self.probe_offsets = (0.0, 0.0, 0.0)
         self.results = []
+        self._moves_queued = False
 
     def get_probe_points(self):
         return self.probe_points
@@ -892,11 +939,12 @@ class ProbePointsHelper:
             return gcmd.get_float("LIFT_SPEED", self.lift_speed, above=0.0)
         return self.lift_speed
 
-    def _lift_toolhead(self):
+    def _lift_toolhead(self, after_probe=False):
         toolhead = self.printer.lookup_object("toolhead")
         # Lift toolhead
         speed = self.lift_speed
-        if not self.results and not self.enforce_lift_speed:
+        probed = self.results or after_probe
+        if not probed and not self.enforce_lift_speed:
             # Use full speed to first probe position
             speed = self.speed
         z_pos = self.horizontal_move_z
@@ -905,34 +953,67 @@ class ProbePointsHelper:
             z_pos = toolhead.get_position()[2] + self.horizontal_z_clearance
         toolhead.manual_move([None, None, z_pos], speed)
 
-    def _next_pos(self):
-        nextpos = list(self.probe_points[len(self.results)])
+    def _get_point(self, index):
+        nextpos = list(self.probe_points[index])
         if self.use_offsets:
             nextpos[0] -= self.probe_offsets[0]
             nextpos[1] -= self.probe_offsets[1]
+        return nextpos
+
+    def _next_pos(self):
+        nextpos = self._get_point(len(self.results))
         self.retry_session.set_position(nextpos)
         return self.retry_session.get_probe_position()
 
+    def _finalize(self):
+        toolhead = self.printer.lookup_object("toolhead")
+        toolhead.get_last_move_time()
+        res = self.finalize_callback(self.probe_offsets, self.results)
+        if isinstance(res, (int, float)):
+            if self.adaptive_horizontal_move_z:
+                # then res is error
+                error = math.ceil(res)
+                self.horizontal_move_z = max(
+                    error + self.probe_offsets[2],
+                    self.min_horizontal_move_z,
+                )
+            return res == 0
+        return res != "retry"
+
+    def _lift_depends_on_results(self):
+        return (
+            self.adaptive_horizontal_move_z
+            or self.horizontal_z_clearance is not None
+        )
+
+    def _queue_next_moves(self):
+        # Called once the probe has triggered and its result is accepted
+        if self._lift_depends_on_results():
+            return
+        toolhead = self.printer.lookup_object("toolhead")
+        self._lift_toolhead(after_probe=True)
+        next_index = len(self.results) + 1
+        if next_index < len(self.probe_points):
+            nextpos = self._get_point(next_index)
+            pos = self.retry_session.get_probe_position_at(nextpos)
+            toolhead.manual_move(pos, self.speed)
+        self._moves_queued = True
+
     def _move_next(self):
         toolhead = self.printer.lookup_object("toolhead")
+        moves_queued, self._moves_queued = self._moves_queued, False
         # Check if done probing
         done = False
         finalize = len(self.results) >= len(self.probe_points)
         if finalize:
-            toolhead.get_last_move_time()
-            res = self.finalize_callback(self.probe_offsets, self.results)
-            if isinstance(res, (int, float)):
-                if res == 0:
-                    done = True
-                if self.adaptive_horizontal_move_z:
-                    # then res is error
-                    error = math.ceil(res)
-                    self.horizontal_move_z = max(
-                        error + self.probe_offsets[2],
-                        self.min_horizontal_move_z,
-                    )
-            elif res != "retry":
-                done = True
+            if not moves_queued and not self._lift_depends_on_results():
+                # Lift while the results are processed
+                self._lift_toolhead()
+            done = self._finalize()
+        elif moves_queued:
+            # Lift and travel were queued when the probe triggered
+            self._next_pos()
+            return False
         self._lift_toolhead()
         if finalize:
             self.results = []
@@ -949,13 +1030,12 @@ class ProbePointsHelper:
         # Lookup objects
         probe = self.printer.lookup_object("probe", None)
         method = gcmd.get("METHOD", "automatic").lower()
-        if method == "rapid_scan":
-            gcmd.respond_info(
-                "METHOD=rapid_scan not supported, using automatic"
-            )
+        is_scan = method == "rapid_scan"
+        if is_scan:
             method = "automatic"
 
         self.results = []
+        self._moves_queued = False
 
         def_move_z = self.default_horizontal_move_z
         self.horizontal_move_z = gcmd.get_float("HORIZONTAL_MOVE_Z", def_move_z)
@@ -983,17 +1063,52 @@ class ProbePointsHelper:
             raise gcmd.error(
                 "horizontal_move_z can't be less than probe's z_offset"
             )
+        scan_session = None
+        if is_scan:
+            scan_session = probe.start_scan_session(gcmd)
+            if scan_session is None:
+                gcmd.respond_info(
+                    "METHOD=rapid_scan not supported, using automatic"
+                )
+        if scan_session is not None:
+            try:
+                self._scan_probe(scan_session)
+            finally:
+                scan_session.end_probe_session()
+                self.retry_session.end()
+            return
         probe.multi_probe_begin()
         while True:
             done = self._move_next()
             if done:
                 break
-            pos = probe.run_probe(gcmd, self.retry_session)
+            pos = probe.run_probe(
+                gcmd, self.retry_session, self._queue_next_moves
+            )
             logging.info(f"Probe pos:{pos}")
             self.results.append(pos)
         probe.multi_probe_end()
         self.retry_session.end()
 
+    def _scan_probe(self, scan_session):
+        # Move over all points without stopping, sampling the probe as
+        # the toolhead passes each point
+        toolhead = self.printer.lookup_object("toolhead")
+        done = False
+        while not done:
+            self._lift_toolhead()
+            for point in self.probe_points:
+                nextpos = [point[0], point[1], None]
+                if self.use_offsets:
+                    nextpos[0] -= self.probe_offsets[0]
+                    nextpos[1] -= self.probe_offsets[1]
+                toolhead.manual_move(nextpos, self.speed)
+                scan_session.run_probe()
+            self.results = scan_session.pull_probed_results()
+            done = self._finalize()
+            self.results = []
+        self._lift_toolhead()
+
     def _manual_probe_start(self):
         done = self._move_next()
         if not done:
@@ -10,6 +10,9 @@ from klippy import mcu
 
 from . import ldc1612, manual_probe, probe
 
+# Sensor heights reported outside of the calibration table
+OUT_OF_RANGE = 99.9
+
 
 # Tool for calibrating the sensor Z detection and applying that calibration
 class EddyCalibration:
@@ -51,9 +54,9 @@ class EddyCalibration:
         for i, (samp_time, freq, dummy_z) in enumerate(samples):
             pos = bisect.bisect(self.cal_freqs, freq)
             if pos >= len(self.cal_zpos):
-                zpos = -99.9
+                zpos = -OUT_OF_RANGE
             elif pos == 0:
-                zpos = 99.9
+                zpos = OUT_OF_RANGE
             else:
                 # XXX - could further optimize and avoid div by zero
                 this_freq = self.cal_freqs[pos]
@@ -369,6 +372,119 @@ class EddyEndstopWrapper:
     def get_position_endstop(self):
         return self._z_offset
 
+    def start_scan_session(self, gcmd):
+        if not self._calibration.is_calibrated():
+            raise self._printer.command_error(
+                "Must calibrate probe_eddy_current first"
+            )
+        return EddyScanningProbe(
+            self._printer, self._sensor_helper, self._z_offset, gcmd
+        )
+
+
+# Sample the sensor while moving past each probe point (METHOD=rapid_scan)
+class EddyScanningProbe:
+    def __init__(self, printer, sensor_helper, z_offset, gcmd):
+        self._printer = printer
+        self._mcu = sensor_helper.get_mcu()
+        self._z_offset = z_offset
+        self._sample_time = gcmd.get_float("SAMPLE_TIME", 0.100, above=0.0)
+        motion_report = printer.lookup_object("motion_report")
+        self._trapq = motion_report.trapqs["toolhead"]
+        # Pending (start_time, end_time, pos_time) sample windows
+        self._probe_times = []
+        self._samples = []
+        self._results = []
+        self._sample_count = 0
+        self._need_stop = False
+        sensor_helper.add_client(self._add_measurement)
+
+    def _add_measurement(self, msg):
+        if self._need_stop:
+            return False
+        self._samples.extend(msg["data"])
+        self._check_samples()
+        return True
+
+    def _check_samples(self):
+        samples = self._samples
+        while self._probe_times and samples:
+            start_time, end_time, pos_time = self._probe_times[0]
+            if samples[-1][0] < end_time:
+                break
+            self._probe_times.pop(0)
+            zs = [z for t, freq, z in samples if start_time <= t <= end_time]
+            # Lookup the toolhead position now (trapq history expires)
+            pos, velocity = self._trapq.get_trapq_position(pos_time)
+            self._results.append((pos, zs))
+            self._sample_count += len(zs)
+        # Discard samples that can no longer be part of a sample window
+        if self._probe_times:
+            min_time = self._probe_times[0][0]
+        elif samples:
+            min_time = samples[-1][0] - self._sample_time
+        else:
+            return
+        while samples and samples[0][0] < min_time:
+            samples.pop(0)
+
+    def _note_probe_time(self, print_time):
+        half_time = 0.5 * self._sample_time
+        self._probe_times.append(
+            (print_time - half_time, print_time + half_time, print_time)
+        )
+
+    def run_probe(self):
+        # Sample the sensor as the toolhead passes the end of the last move
+        toolhead = self._printer.lookup_object("toolhead")
+        toolhead.register_lookahead_callback(self._note_probe_time)
+
+    def pull_probed_results(self):
+        # Flush lookahead (so all probe times are known)
+        toolhead = self._printer.lookup_object("toolhead")
+        toolhead.get_last_move_time()
+        # Wait for samples to arrive
+        reactor = self._printer.get_reactor()
+        while self._probe_times:
+            systime = reactor.monotonic()
+            est_print_time = self._mcu.estimated_print_time(systime)
+            if est_print_time > self._probe_times[-1][1] + 1.0:
+                raise self._printer.command_error(
+                    "probe_eddy_current sensor outage"
+                )
+            reactor.pause(systime + 0.010)
+        axis_twist_compensation = self._printer.lookup_object(
+            "axis_twist_compensation", None
+        )
+        results = []
+        for pos, zs in self._results:
+            if pos is None or not zs:
+                raise self._printer.command_error(
+                    "Unable to obtain probe_eddy_current sensor readings"
+                )
+            if max([abs(z) for z in zs]) >= OUT_OF_RANGE:
+                raise self._printer.command_error(
+                    "probe_eddy_current sensor not in valid range"
+                )
+            # Report the position at which the sensor would read z_offset
+            sensor_z = sum(zs) / len(zs)
+            epos = [pos[0], pos[1], self._z_offset + pos[2] - sensor_z]
+            if axis_twist_compensation is not None:
+                epos[2] += axis_twist_compensation.get_z_compensation_value(pos)
+            results.append(epos)
+        gcode = self._printer.lookup_object("gcode")
+        gcode.respond_info(
+            "probe_eddy_current: scanned %d points from %d samples"
+            % (len(results), self._sample_count)
+        )
+        self._results = []
+        self._sample_count = 0
+        return results
+
+    def end_probe_session(self):
+        self._need_stop = True
+        self._samples = []
+
 
 # Main "printer object"
 class PrinterEddyProbe:
@@ -6,7 +6,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 
-from . import bus
+from . import adaptive_report, bus
 from .danger_options import get_danger_options
 
 ######################################################################
@@ -66,7 +66,16 @@ class SHT3X:
         self.deviceId = config.get("sensor_type")
         self.temp = self.min_temp = self.max_temp = self.humidity = 0.0
 
-        self.sample_timer = self.reactor.register_timer(self._sample_sht3x)
+        # Attempt the measurement read up to 5 times
+        self.poll_client = bus.lookup_i2c_poller(self.mcu).register_client(
+            self.i2c, self._sample_sht3x, retries=4
+        )
+        self.adaptive_report = adaptive_report.AdaptiveReportTime(
+            config, self, self.poll_client, self.report_time
+        )
+        self.poll_client.set_steps(
+            [(None, 0.0, SHT3X_CMD["OTHER"]["FETCH"], 6)]
+        )
         self.printer.add_object("sht3x " + self.name, self)
         self.printer.register_event_handler(
             "klippy:connect", self.handle_connect
@@ -78,7 +87,7 @@ class SHT3X:
 
     def handle_connect(self):
         self._init_sht3x()
-        self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        self.poll_client.start(self.reactor.NOW)
 
     def setup_minmax(self, min_temp, max_temp):
         self.min_temp = min_temp
@@ -87,6 +96,9 @@ class SHT3X:
     def setup_callback(self, cb):
         self._callback = cb
 
+    def note_target(self, target):
+        self.adaptive_report.note_target(target)
+
     def get_report_time_delta(self):
         return self.report_time
 
@@ -113,25 +125,13 @@ class SHT3X:
         # Wait <=15.5ms for first measurement
         self.reactor.pause(self.reactor.monotonic() + 0.0155)
 
-    def _sample_sht3x(self, eventtime):
+    def _sample_sht3x(self, eventtime, responses):
+        if responses is None:
+            logging.error("sht3x: Error reading data")
+            self.temp = self.humidity = 0.0
+            return self.reactor.NEVER
         try:
-            # Read measurment
-            retries = 5
-            params = None
-            error = None
-            while retries > 0 and params is None:
-                try:
-                    params = self.i2c.i2c_read(
-                        SHT3X_CMD["OTHER"]["FETCH"], 6, retry=False
-                    )
-                except self._error as e:
-                    error = e
-                    self.reactor.pause(self.reactor.monotonic() + 0.5)
-                    retries -= 1
-            if params is None:
-                raise error
-
-            response = bytearray(params["response"])
+            response = responses[0]
             rtemp = response[0] << 8
             rtemp |= response[1]
             if self._crc8(rtemp) != response[2]:
@@ -164,7 +164,9 @@ class SHT3X:
         measured_time = self.reactor.monotonic()
         print_time = self.i2c.get_mcu().estimated_print_time(measured_time)
         self._callback(print_time, self.temp)
-        return measured_time + self.report_time
+        return measured_time + self.adaptive_report.next_report_time(
+            measured_time, self.temp, self.min_temp, self.max_temp
+        )
 
     def _split_bytes(self, data):
         bytes = []
@@ -191,6 +193,7 @@ class SHT3X:
         return {
             "temperature": round(self.temp, 2),
             "humidity": round(self.humidity, 1),
+            "report_time": self.adaptive_report.get_report_time(),
         }
 
 
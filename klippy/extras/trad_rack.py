@@ -2360,6 +2360,13 @@ class TradRackToolHead(toolhead.ToolHead, object):
         self.square_corner_velocity = config.getfloat(
             "square_corner_velocity", 5.0, minval=0.0
         )
+        planners = {"default": False, "virtual_segment": True}
+        self.virtual_segments = config.getchoice(
+            "junction_planner", planners, "default"
+        )
+        accel_profile = config.getchoice(
+            "accel_profile", toolhead.ACCEL_PROFILES, "trapezoid"
+        )
         self.junction_deviation = self.max_accel_to_decel = 0.0
         self._calc_junction_deviation()
         # Input stall detection
@@ -2377,6 +2384,7 @@ class TradRackToolHead(toolhead.ToolHead, object):
         self.drip_completion = None
         # Flush tracking
         self.flush_timer = self.reactor.register_timer(self._flush_handler)
+        self.flush_scheduler = toolhead.FlushScheduler()
         self.do_kick_flush_timer = True
         self.last_flush_time = self.last_sg_flush_time = (
             self.min_restart_time
@@ -2390,7 +2398,7 @@ class TradRackToolHead(toolhead.ToolHead, object):
         # Setup iterative solver
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
-        self.trapq_append = ffi_lib.trapq_append
+        self._set_accel_profile(accel_profile)
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
         self.step_generators = []
         # Create kinematic class
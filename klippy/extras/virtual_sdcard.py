@@ -8,6 +8,8 @@ import logging
 import os
 import sys
 
+from . import gcode_analysis
+
 VALID_GCODE_EXTS = ["gcode", "g", "gco"]
 
 
@@ -37,6 +39,9 @@ class VirtualSD:
         self.must_pause_work = self.cmd_from_sd = False
         self.next_file_position = 0
         self.work_timer = None
+        # File analysis
+        self.analyze_files = config.getboolean("analyze_files", False)
+        self.file_indexer = gcode_analysis.FileIndexer(self.printer)
         # Error handling
         gcode_macro = self.printer.load_object(config, "gcode_macro")
         self.on_error_gcode = gcode_macro.load_template(
@@ -58,6 +63,16 @@ class VirtualSD:
             self.cmd_SDCARD_PRINT_FILE,
             desc=self.cmd_SDCARD_PRINT_FILE_help,
         )
+        self.gcode.register_command(
+            "SDCARD_ANALYZE_FILE",
+            self.cmd_SDCARD_ANALYZE_FILE,
+            desc=self.cmd_SDCARD_ANALYZE_FILE_help,
+        )
+        self.gcode.register_command(
+            "SDCARD_RESUME_FILE",
+            self.cmd_SDCARD_RESUME_FILE,
+            desc=self.cmd_SDCARD_RESUME_FILE_help,
+        )
 
     def handle_shutdown(self):
         if self.work_timer is not None:
@@ -119,6 +134,7 @@ class VirtualSD:
             "is_active": self.is_active(),
             "file_position": self.file_position,
             "file_size": self.file_size,
+            "file_index": self.file_indexer.get_status(self.file_position),
         }
 
     def file_path(self):
@@ -167,6 +183,7 @@ class VirtualSD:
             self.current_file.close()
             self.current_file = None
         self.file_position = self.file_size = 0
+        self.file_indexer.reset()
         self.print_stats.reset()
         self.printer.send_event("virtual_sdcard:reset_file")
 
@@ -194,6 +211,114 @@ class VirtualSD:
         self._load_file(gcmd, filename, check_subdirs=True)
         self.do_resume()
 
+    cmd_SDCARD_RESUME_FILE_help = (
+        "Loads a SD file and starts the print at the given layer or height"
+    )
+
+    def cmd_SDCARD_RESUME_FILE(self, gcmd):
+        if self.work_timer is not None:
+            raise gcmd.error("SD busy")
+        layer = gcmd.get_int("LAYER", None, minval=1)
+        z = gcmd.get_float("Z", None, minval=0.0)
+        if (layer is None) == (z is None):
+            raise gcmd.error("Must specify exactly one of LAYER or Z")
+        z_hop = gcmd.get_float("Z_HOP", 2.0, minval=0.0)
+        heat = gcmd.get_int("HEAT", 1, minval=0, maxval=1)
+        self._reset_file()
+        filename = gcmd.get("FILENAME")
+        if filename[0] == "/":
+            filename = filename[1:]
+        self._load_file(gcmd, filename, check_subdirs=True)
+        fname = self.current_file.name
+        if self.file_indexer.filename != fname:
+            self.file_indexer.start(fname)
+        if self.file_indexer.state == "analyzing":
+            # Not cached - the whole file must be analyzed to find layers
+            gcmd.respond_info(
+                "Analyzing %s (%d bytes) to find the layer, this may"
+                " take a while..." % (filename, self.file_size)
+            )
+        file_index = self.file_indexer.wait(self.gcode)
+        if file_index is None:
+            raise gcmd.error("Unable to analyze file")
+        if layer is None:
+            layer = file_index.find_layer_by_height(z)
+        if layer > file_index.get_layer_count():
+            raise gcmd.error(
+                "File only has %d layers" % (file_index.get_layer_count(),)
+            )
+        offset = file_index.get_layer_offset(layer)
+        try:
+            state = gcode_analysis.scan_state(fname, offset)
+        except:
+            logging.exception("virtual_sdcard resume scan")
+            raise gcmd.error("Unable to scan file")
+        if None in state["coord_shift"]:
+            raise gcmd.error(
+                "Unable to resume: the file sets its position with G92"
+                " at a position not known from the file"
+            )
+        gcmd.respond_info(
+            "Resuming at layer %d (file position %d)" % (layer, offset)
+        )
+        self.gcode.run_script_from_command(
+            "\n".join(self._get_resume_script(state, heat, z_hop))
+        )
+        self.file_position = offset
+        self.do_resume()
+
+    def _get_resume_script(self, state, heat, z_hop):
+        script = []
+        heaters = state["heaters"]
+        waits = []
+        for (kind, name), value in sorted(
+            heaters.items(), key=lambda i: str(i[0])
+        ):
+            if kind == "HEATER":
+                script.append(value)
+                continue
+            tool = " T%d" % (name,) if name >= 0 else ""
+            script.append("%s%s S%.3f" % (kind, tool, value))
+            if value > 0.0:
+                wait_cmd = {"M104": "M109", "M140": "M190"}[kind]
+                waits.append("%s%s S%.3f" % (wait_cmd, tool, value))
+        if heat:
+            script.extend(sorted(waits, reverse=True))
+        script.extend(state["fans"].values())
+        script.extend(state["factors"].values())
+        if state["offsets"]:
+            # Replay the file's offset changes from a clean state
+            script.append("SET_GCODE_OFFSET X=0 Y=0 Z=0")
+            script.extend(state["offsets"])
+        # Restore the position, moving above the print first.  Positions
+        # shifted by G92 in the file are moved to without the shift, which
+        # is then applied again.
+        position = state["position"]
+        shift = state["coord_shift"]
+        x, y, z = [
+            None if p is None else p + s for p, s in zip(position, shift)
+        ]
+        script.append("G90")
+        if z is not None:
+            script.append("G1 Z%.3f F600" % (z + z_hop,))
+        if x is not None and y is not None:
+            script.append("G1 X%.3f Y%.3f F6000" % (x, y))
+        if z is not None:
+            script.append("G1 Z%.3f F600" % (z,))
+        shifted = [
+            "%s%.3f" % ("XYZ"[i], position[i])
+            for i in range(3)
+            if shift[i] and position[i] is not None
+        ]
+        if shifted:
+            script.append("G92 " + " ".join(shifted))
+        script.append(["M83", "M82"][state["absolute_extrude"]])
+        script.append("G92 E%.5f" % (position[3] or 0.0,))
+        if state["feedrate"] is not None:
+            script.append("G1 F%.3f" % (state["feedrate"],))
+        script.append(["G91", "G90"][state["absolute_coord"]])
+        return script
+
     def cmd_M20(self, gcmd):
         # List SD card
         files = self.get_file_list(self.with_subdirs)
@@ -216,15 +341,18 @@ class VirtualSD:
             filename = filename[1:]
         self._load_file(gcmd, filename, self.with_subdirs)
 
-    def _load_file(self, gcmd, filename, check_subdirs=False):
+    def _lookup_file(self, filename, check_subdirs=False):
         files = self.get_file_list(check_subdirs)
         flist = [f[0] for f in files]
         files_by_lower = {fname.lower(): fname for fname, fsize in files}
         fname = filename
+        if fname not in flist:
+            fname = files_by_lower[fname.lower()]
+        return os.path.join(self.sdcard_dirname, fname)
+
+    def _load_file(self, gcmd, filename, check_subdirs=False):
         try:
-            if fname not in flist:
-                fname = files_by_lower[fname.lower()]
-            fname = os.path.join(self.sdcard_dirname, fname)
+            fname = self._lookup_file(filename, check_subdirs)
             f = io.open(fname, "r", newline="")
             f.seek(0, os.SEEK_END)
             fsize = f.tell()
@@ -238,8 +366,47 @@ class VirtualSD:
         self.file_position = 0
         self.file_size = fsize
         self.print_stats.set_current_file(filename)
+        if self.analyze_files:
+            self.file_indexer.start(fname)
         self.printer.send_event("virtual_sdcard:load_file")
 
+    cmd_SDCARD_ANALYZE_FILE_help = (
+        "Analyze a G-Code file for layers, print time and objects"
+    )
+
+    def cmd_SDCARD_ANALYZE_FILE(self, gcmd):
+        filename = gcmd.get("FILENAME", None)
+        indexer = self.file_indexer
+        if filename is None:
+            if self.current_file is None:
+                raise gcmd.error("No file loaded")
+            fname = self.current_file.name
+        else:
+            if filename.startswith("/"):
+                filename = filename[1:]
+            try:
+                fname = self._lookup_file(filename, check_subdirs=True)
+            except:
+                raise gcmd.error("Unable to open file")
+            if self.current_file is None or fname != self.current_file.name:
+                indexer = gcode_analysis.FileIndexer(self.printer)
+        if indexer.filename != fname or indexer.state == "error":
+            indexer.start(fname)
+        file_index = indexer.wait(self.gcode)
+        if file_index is None:
+            raise gcmd.error("Unable to analyze file")
+        summary = file_index.get_summary()
+        gcmd.respond_info(
+            "Layers: %d\nEstimated time: %.0fs\nFilament: %.1fmm\n"
+            "Objects: %d"
+            % (
+                summary["layer_count"],
+                summary["estimated_time"],
+                summary["filament_total"],
+                len(summary["objects"]),
+            )
+        )
+
     def cmd_M24(self, gcmd):
         # Start/resume SD print
         self.do_resume()
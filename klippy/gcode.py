@@ -163,6 +163,7 @@ class GCodeDispatch:
         self.status_commands = {}
         self._interrupt_counter = 0
         self._script_context = 0
+        self._profiler = None
         # Register commands needed before config file is loaded
         handlers = [
             "M110",
@@ -187,6 +188,9 @@ class GCodeDispatch:
     def increment_interrupt_counter(self):
         self._interrupt_counter += 1
 
+    def set_profiler(self, profiler):
+        self._profiler = profiler
+
     def is_traditional_gcode(self, cmd):
         # A "traditional" g-code command is a letter and followed by a number
         try:
@@ -314,8 +318,12 @@ class GCodeDispatch:
             if self._script_context > 0 and cmd == "RETURN":
                 return
             handler = self.gcode_handlers.get(cmd, self.cmd_default)
+            profiler = self._profiler
             try:
-                handler(gcmd)
+                if profiler is None or not cmd:
+                    handler(gcmd)
+                else:
+                    profiler.run_command(cmd, handler, gcmd)
             except self.error as e:
                 self._respond_error(str(e))
                 self.printer.send_event("gcode:command_error")
@@ -3,6 +3,7 @@
 # Copyright (C) 2016-2022  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
+import bisect
 import logging
 import math
 
@@ -235,10 +236,32 @@ class PrinterExtruder:
         self.instant_corner_v = config.getfloat(
             "instantaneous_corner_velocity", 1.0, minval=0.0
         )
+        # Setup volumetric flow limit
+        self.max_flow = config.getfloat("max_volumetric_flow", None, above=0.0)
+        flow_table = config.getlists(
+            "volumetric_flow_table",
+            None,
+            seps=(",", "\n"),
+            parser=float,
+            count=2,
+        )
+        self.flow_table = None
+        if flow_table is not None:
+            self.flow_table = sorted(flow_table)
+            temps = [t for t, f in self.flow_table]
+            if len(set(temps)) != len(temps):
+                raise config.error(
+                    "Temperature may not exist twice in volumetric_flow_table"
+                )
+            if min([f for t, f in self.flow_table]) <= 0.0:
+                raise config.error(
+                    "Flow in volumetric_flow_table must be above zero"
+                )
+        self.flow_target_temp = None
+        self.flow_limit = self.max_flow
         # Setup extruder trapq (trapezoidal motion queue)
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
-        self.trapq_append = ffi_lib.trapq_append
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
 
         # Setup extruder stepper
@@ -271,6 +294,7 @@ class PrinterExtruder:
     def get_status(self, eventtime):
         sts = self.heater.get_status(eventtime)
         sts["can_extrude"] = self.heater.can_extrude
+        sts["max_volumetric_flow"] = self.get_max_volumetric_flow()
         if self.extruder_stepper is not None:
             sts.update(self.extruder_stepper.get_status(eventtime))
         return sts
@@ -287,6 +311,38 @@ class PrinterExtruder:
     def stats(self, eventtime):
         return self.heater.stats(eventtime)
 
+    def get_max_volumetric_flow(self):
+        if self.flow_table is None:
+            return self.max_flow
+        # Interpolate the flow table at the heater target temperature
+        target_temp = self.heater.target_temp
+        if target_temp == self.flow_target_temp:
+            return self.flow_limit
+        table = self.flow_table
+        pos = bisect.bisect(table, (target_temp,))
+        if pos <= 0:
+            flow = table[0][1]
+        elif pos >= len(table):
+            flow = table[-1][1]
+        else:
+            (t0, f0), (t1, f1) = table[pos - 1], table[pos]
+            flow = f0 + (f1 - f0) * (target_temp - t0) / (t1 - t0)
+        if self.max_flow is not None:
+            flow = min(flow, self.max_flow)
+        self.flow_target_temp = target_temp
+        self.flow_limit = flow
+        return flow
+
+    def get_volumetric_flow(self, print_time):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        out = ffi_main.new("double[4]")
+        times = ffi_main.new("double[1]", [print_time])
+        ffi_lib.trapq_get_positions(self.trapq, times, 1, out)
+        velocity = out[3]
+        if math.isnan(velocity) or velocity <= 0.0:
+            return 0.0
+        return velocity * self.filament_area
+
     def check_move(self, move):
         axis_r = move.axes_r[3]
         if not self.heater.can_extrude:
@@ -324,6 +380,12 @@ class PrinterExtruder:
                 "See the 'max_extrude_cross_section' config option for details"
                 % (area, self.max_extrude_ratio * self.filament_area)
             )
+        elif axis_r > 0.0:
+            max_flow = self.get_max_volumetric_flow()
+            if max_flow is not None:
+                # Limit the volumetric flow rate of the extrusion
+                max_v = max_flow / (axis_r * self.filament_area)
+                move.limit_speed(max_v)
 
     def calc_junction(self, prev_move, move):
         diff_r = move.axes_r[3] - prev_move.axes_r[3]
@@ -344,7 +406,8 @@ class PrinterExtruder:
             if axis_r > 0.0 and (move.axes_d[0] or move.axes_d[1]):
                 pressure_advance = self.extruder_stepper.pressure_advance
         # Queue movement (x is extruder movement, y is pressure advance flag)
-        self.trapq_append(
+        # using the acceleration profile the move was planned with
+        move.trapq_append(
             self.trapq,
             print_time,
             move.accel_t,
@@ -434,6 +497,9 @@ class DummyExtruder:
     def find_past_position(self, print_time):
         return 0.0
 
+    def get_volumetric_flow(self, print_time):
+        return 0.0
+
     def calc_junction(self, prev_move, move):
         return move.max_cruise_v2
 
@@ -169,7 +169,7 @@ class RotaryDeltaKinematics:
                 raise move.move_error()
             limit_xy2 = -1.0
         if move.axes_d[2]:
-            move.limit_speed(self.max_z_velocity, move.accel)
+            move.limit_speed(self.max_z_velocity)
             limit_xy2 = -1.0
         self.limit_xy2 = limit_xy2
 
@@ -99,6 +99,52 @@ def background_coordinate_descent(printer, adj_params, params, error_func):
     return res
 
 
+# Helper to run a calculation in a background process so that it does
+# not block the main thread.  Exceptions of the 'expected_errors' types
+# are raised again as is, others are reported as a command error.
+def background_process_exec(printer, method, args, expected_errors=()):
+    parent_conn, child_conn = multiprocessing.Pipe()
+
+    def wrapper():
+        queuelogger.clear_bg_logging()
+        try:
+            res = method(*args)
+        except expected_errors as e:
+            child_conn.send((True, e, traceback.format_exc()))
+            child_conn.close()
+            return
+        except:
+            child_conn.send((True, None, traceback.format_exc()))
+            child_conn.close()
+            return
+        child_conn.send((False, res, None))
+        child_conn.close()
+
+    # Start a process to perform the calculation
+    calc_proc = multiprocessing.Process(target=wrapper)
+    calc_proc.daemon = True
+    calc_proc.start()
+    # Wait for the process to finish
+    reactor = printer.get_reactor()
+    gcode = printer.lookup_object("gcode")
+    eventtime = last_report_time = reactor.monotonic()
+    while calc_proc.is_alive():
+        if eventtime > last_report_time + 5.0:
+            last_report_time = eventtime
+            gcode.respond_info("Wait for calculations..", log=False)
+        eventtime = reactor.pause(eventtime + 0.1)
+    # Return results
+    is_err, res, tb = parent_conn.recv()
+    calc_proc.join()
+    parent_conn.close()
+    if is_err:
+        logging.error("Error in remote calculation: %s", tb)
+        if res is not None:
+            raise res
+        raise printer.command_error("Error in remote calculation: %s" % (tb,))
+    return res
+
+
 ######################################################################
 # Trilateration
 ######################################################################
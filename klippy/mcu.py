@@ -124,6 +124,64 @@ class CommandQueryWrapper:
         return self._do_send(cmds, minclock, reqclock, retry)
 
 
+# Send several query commands at once and wait for all of the responses
+class QueryBatch:
+    TIMEOUT_TIME = 5.0
+    RETRY_TIME = 0.500
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.reactor = serial.get_reactor()
+        self.queries = []
+
+    def add_query(self, query_cmd, data=()):
+        self.queries.append((query_cmd, query_cmd._cmd.encode(data)))
+
+    def _send_missing(self, results):
+        for (query_cmd, cmd), params in zip(self.queries, results):
+            if params is None:
+                self.serial.raw_send(cmd, 0, 0, query_cmd._cmd_queue)
+
+    def send(self, retry=True):
+        if not self.queries:
+            return []
+        results = [None] * len(self.queries)
+        remaining = [len(self.queries)]
+        completion = self.reactor.completion()
+        min_query_time = self.reactor.monotonic()
+        handlers = []
+        for i, (query_cmd, cmd) in enumerate(self.queries):
+
+            def handle_callback(params, i=i):
+                if results[i] is not None:
+                    return
+                if params["#sent_time"] < min_query_time:
+                    return
+                results[i] = params
+                remaining[0] -= 1
+                if not remaining[0]:
+                    self.reactor.async_complete(completion, True)
+
+            key = (query_cmd._response, query_cmd._oid)
+            handlers.append(key)
+            self.serial.register_response(handle_callback, *key)
+        try:
+            self._send_missing(results)
+            timeout_time = query_time = self.reactor.monotonic()
+            if retry:
+                timeout_time += self.TIMEOUT_TIME
+            while completion.wait(query_time + self.RETRY_TIME) is None:
+                query_time = self.reactor.monotonic()
+                if query_time > timeout_time:
+                    # Queries without a response are returned as None
+                    break
+                self._send_missing(results)
+        finally:
+            for key in handlers:
+                self.serial.register_response(None, *key)
+        return results
+
+
 # Wrapper around command sending
 class CommandWrapper:
     def __init__(self, serial, msgformat, cmd_queue=None):
@@ -819,6 +877,10 @@ class MCU:
         self._stepqueues = []
         self._steppersync = None
         self._flush_callbacks = []
+        # Step generation on a background thread
+        self._threaded_stepgen = get_danger_options().threaded_step_generation
+        self._stepgen_thread = None
+        self._stepgen_queuing = False
         # Stats
         self._get_status_info = {}
         self._stats_sumsq_base = 0.0
@@ -1356,6 +1418,9 @@ class MCU:
             self._printer.command_error,
         )
 
+    def create_query_batch(self):
+        return QueryBatch(self._serial)
+
     def try_lookup_command(self, msgformat):
         try:
             return self.lookup_command(msgformat)
@@ -1480,6 +1545,34 @@ class MCU:
                 "Internal error in MCU '%s' stepcompress" % (self._name,)
             )
 
+    def begin_step_generation(self):
+        self._stepgen_queuing = self._threaded_stepgen
+
+    def queue_step_generation(self, sk):
+        if not self._stepgen_queuing:
+            return False
+        if self._stepgen_thread is None:
+            ffi_main, ffi_lib = chelper.get_ffi()
+            self._stepgen_thread = ffi_main.gc(
+                ffi_lib.stepgen_thread_alloc(), ffi_lib.stepgen_thread_free
+            )
+        ret = self._ffi_lib.stepgen_thread_queue(self._stepgen_thread, sk)
+        if ret:
+            raise error("Internal error in MCU '%s' stepgen" % (self._name,))
+        return True
+
+    def start_step_generation(self, flush_time):
+        self._stepgen_queuing = False
+        if self._stepgen_thread is not None:
+            self._ffi_lib.stepgen_thread_start(self._stepgen_thread, flush_time)
+
+    def finish_step_generation(self):
+        if self._stepgen_thread is None:
+            return
+        ret = self._ffi_lib.stepgen_thread_wait(self._stepgen_thread)
+        if ret:
+            raise error("Internal error in stepcompress")
+
     def check_active(self, print_time, eventtime):
         if self._steppersync is None:
             return
@@ -252,6 +252,18 @@ class SelectReactor:
 
     def pause(self, waketime):
         g = greenlet.getcurrent()
+        start_time = self.monotonic()
+        eventtime = self._pause(g, waketime)
+        g.pause_time = getattr(g, "pause_time", 0.0) + (
+            self.monotonic() - start_time
+        )
+        return eventtime
+
+    def get_pause_time(self):
+        # Total time the calling greenlet has spent blocked in pause()
+        return getattr(greenlet.getcurrent(), "pause_time", 0.0)
+
+    def _pause(self, g, waketime):
         if g is not self._g_dispatch:
             if self._g_dispatch is None:
                 return self._sys_pause(waketime)
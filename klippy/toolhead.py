@@ -16,14 +16,33 @@ from .kinematics import extruder
 #   seconds), _r is ratio (scalar between 0.0 and 1.0)
 
 
+# Junction limits of the "virtual_segment" junction planner
+CURVE_COLLINEAR_SIN2 = 1e-18
+CURVE_MAX_SIN2 = math.sin(math.radians(15.0)) ** 2
+CURVE_PLANE_COS2 = math.cos(math.radians(5.0)) ** 2
+CURVE_RADIUS_TOLERANCE = 0.05
+
+
+# Velocity profiles of the acceleration and deceleration of moves
+ACCEL_PROFILES = {"trapezoid": "trapezoid", "scurve": "scurve"}
+# Peak acceleration of an S-curve phase relative to its average
+SCURVE_PEAK_ACCEL = 1.5
+
+
 # Class to track each move request
 class Move:
     def __init__(self, toolhead, start_pos, end_pos, speed):
         self.toolhead = toolhead
         self.start_pos = tuple(start_pos)
         self.end_pos = tuple(end_pos)
-        self.accel = toolhead.max_accel
+        # Acceleration profile the move is planned and queued with
+        self.trapq_append = toolhead.trapq_append
+        # Planned (average) acceleration per unit of acceleration limit
+        self.accel_scale = toolhead.accel_scale
+        self.accel = toolhead.max_accel * self.accel_scale
         self.junction_deviation = toolhead.junction_deviation
+        self.virtual_segments = toolhead.virtual_segments
+        self.curve = None
         self.timing_callbacks = []
         velocity = min(speed, toolhead.max_velocity)
         self.is_kinematic_move = True
@@ -56,15 +75,18 @@ class Move:
         self.max_cruise_v2 = velocity**2
         self.delta_v2 = 2.0 * move_d * self.accel
         self.max_smoothed_v2 = 0.0
-        self.smooth_delta_v2 = 2.0 * move_d * toolhead.max_accel_to_decel
+        self.smooth_delta_v2 = (
+            2.0 * move_d * toolhead.max_accel_to_decel * self.accel_scale
+        )
         self.next_junction_v2 = 999999999.9
 
-    def limit_speed(self, speed, accel):
+    def limit_speed(self, speed, accel=None):
         speed2 = speed**2
         if speed2 < self.max_cruise_v2:
             self.max_cruise_v2 = speed2
             self.min_move_t = self.move_d / speed
-        self.accel = min(self.accel, accel)
+        if accel is not None:
+            self.accel = min(self.accel, accel * self.accel_scale)
         self.delta_v2 = 2.0 * self.move_d * self.accel
         self.smooth_delta_v2 = min(self.smooth_delta_v2, self.delta_v2)
 
@@ -96,6 +118,16 @@ class Move:
             + axes_r[1] * prev_axes_r[1]
             + axes_r[2] * prev_axes_r[2]
         )
+        if self.virtual_segments and junction_cos_theta < 0.0:
+            curve_v2 = self.calc_curve_junction(prev_move)
+            if curve_v2 is not None:
+                # Junction within a virtual segment
+                self.max_start_v2 = min(max_start_v2, curve_v2)
+                self.max_smoothed_v2 = min(
+                    self.max_start_v2,
+                    prev_move.max_smoothed_v2 + prev_move.smooth_delta_v2,
+                )
+                return
         sin_theta_d2 = math.sqrt(max(0.5 * (1.0 - junction_cos_theta), 0.0))
         cos_theta_d2 = math.sqrt(max(0.5 * (1.0 + junction_cos_theta), 0.0))
         one_minus_sin_theta_d2 = 1.0 - sin_theta_d2
@@ -121,6 +153,46 @@ class Move:
             max_start_v2, prev_move.max_smoothed_v2 + prev_move.smooth_delta_v2
         )
 
+    def calc_curve_junction(self, prev_move):
+        # Check if the junction continues a run of collinear or constant
+        # curvature segments (such as a tessellated arc).  Such a run is
+        # treated as a single "virtual segment" that is limited by its
+        # centripetal acceleration instead of per junction cornering.
+        a = prev_move.axes_r
+        b = self.axes_r
+        nx = a[1] * b[2] - a[2] * b[1]
+        ny = a[2] * b[0] - a[0] * b[2]
+        nz = a[0] * b[1] - a[1] * b[0]
+        sin2 = nx * nx + ny * ny + nz * nz
+        if sin2 < CURVE_COLLINEAR_SIN2:
+            return 999999999.9
+        if sin2 > CURVE_MAX_SIN2:
+            return None
+        # Radius of the circle through the segment start, junction and end
+        pd = prev_move.axes_d
+        d = self.axes_d
+        cx, cy, cz = pd[0] + d[0], pd[1] + d[1], pd[2] + d[2]
+        r2 = (cx * cx + cy * cy + cz * cz) / (4.0 * sin2)
+        curve = prev_move.curve
+        if curve is not None:
+            cnx, cny, cnz, csin2, r2_min, r2_max, radius = curve
+            ndot = nx * cnx + ny * cny + nz * cnz
+            if (
+                ndot > 0.0
+                and ndot * ndot >= CURVE_PLANE_COS2 * sin2 * csin2
+                and r2_min <= r2 <= r2_max
+            ):
+                # Same turn direction, plane, and radius as the run
+                self.curve = curve
+                return min(self.accel, prev_move.accel) * radius
+        # Start a new run at this junction
+        tol = CURVE_RADIUS_TOLERANCE
+        self.curve = (
+            nx, ny, nz, sin2,
+            r2 * (1.0 - tol) ** 2, r2 * (1.0 + tol) ** 2, math.sqrt(r2),
+        )  # fmt: skip
+        return None
+
     def set_junction(self, start_v2, cruise_v2, end_v2):
         # Determine accel, cruise, and decel portions of the move distance
         half_inv_accel = 0.5 / self.accel
@@ -250,6 +322,58 @@ MOVE_HISTORY_EXPIRE = 30.0
 DRIP_SEGMENT_TIME = 0.050
 DRIP_TIME = 0.100
 
+FLUSH_COST_SMOOTH = 0.25
+
+
+# Tune the step generation batch size from the measured host cost
+class FlushScheduler:
+    def __init__(self):
+        dopts = get_danger_options()
+        self.min_batch_time = dopts.flush_batch_time_min
+        self.max_batch_time = max(
+            dopts.flush_batch_time_max, self.min_batch_time
+        )
+        self.cost_ratio_high = dopts.flush_batch_cost_ratio
+        # Start with the largest batches until the host cost is known
+        self.batch_time = self.max_batch_time
+        self.cost_ratio = None
+        self.gen_time = self.gen_span = 0.0
+
+    def note_flush(self, gen_time, span):
+        self.gen_time += gen_time
+        self.gen_span += span
+
+    def update(self, buffer_time):
+        # Host seconds spent generating steps per second of print time
+        if self.gen_span > 0.0:
+            ratio = self.gen_time / self.gen_span
+            if self.cost_ratio is None:
+                self.cost_ratio = ratio
+            else:
+                self.cost_ratio += (ratio - self.cost_ratio) * FLUSH_COST_SMOOTH
+            self.gen_time = self.gen_span = 0.0
+        # Use large batches if the mcu queue is draining
+        low_buffer = 0.0 < buffer_time < BGFLUSH_LOW_TIME
+        if self.cost_ratio is None or low_buffer:
+            self.batch_time = self.max_batch_time
+            return
+        load = min(1.0, self.cost_ratio / self.cost_ratio_high)
+        self.batch_time = self.min_batch_time + load * (
+            self.max_batch_time - self.min_batch_time
+        )
+
+    def get_move_batch_time(self):
+        return self.batch_time
+
+    def get_bgflush_batch_time(self):
+        return self.batch_time * (BGFLUSH_BATCH_TIME / MOVE_BATCH_TIME)
+
+    def stats(self):
+        return "flush_batch=%.3f step_gen_cost=%.4f" % (
+            self.batch_time,
+            self.cost_ratio or 0.0,
+        )
+
 
 class DripModeEndSignal(Exception):
     pass
@@ -286,6 +410,13 @@ class ToolHead:
         self.square_corner_velocity = config.getfloat(
             "square_corner_velocity", 5.0, minval=0.0
         )
+        planners = {"default": False, "virtual_segment": True}
+        self.virtual_segments = config.getchoice(
+            "junction_planner", planners, "default"
+        )
+        accel_profile = config.getchoice(
+            "accel_profile", ACCEL_PROFILES, "trapezoid"
+        )
         self.orig_cfg = {}
         self.orig_cfg["max_velocity"] = self.max_velocity
         self.orig_cfg["max_accel"] = self.max_accel
@@ -308,6 +439,7 @@ class ToolHead:
         self.drip_completion = None
         # Flush tracking
         self.flush_timer = self.reactor.register_timer(self._flush_handler)
+        self.flush_scheduler = FlushScheduler()
         self.do_kick_flush_timer = True
         self.last_flush_time = self.min_restart_time = 0.0
         self.need_flush_time = self.step_gen_time = self.clear_history_time = (
@@ -319,7 +451,7 @@ class ToolHead:
         # Setup iterative solver
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
-        self.trapq_append = ffi_lib.trapq_append
+        self._set_accel_profile(accel_profile)
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
         self.step_generators = []
         # Create kinematics class
@@ -409,8 +541,22 @@ class ToolHead:
             self.print_time - self.kin_flush_delay,
         )
         sg_flush_time = max(sg_flush_want, flush_time)
-        for sg in self.step_generators:
-            sg(sg_flush_time)
+        gen_start = self.reactor.monotonic()
+        for m in self.all_mcus:
+            m.begin_step_generation()
+        try:
+            for sg in self.step_generators:
+                sg(sg_flush_time)
+        finally:
+            # Wait for any mcu background step generation
+            for m in self.all_mcus:
+                m.start_step_generation(sg_flush_time)
+            for m in self.all_mcus:
+                m.finish_step_generation()
+        self.flush_scheduler.note_flush(
+            self.reactor.monotonic() - gen_start,
+            max(0.0, sg_flush_time - self.min_restart_time),
+        )
         self.min_restart_time = max(self.min_restart_time, sg_flush_time)
         # Free trapq entries that are no longer needed
         clear_history_time = self.clear_history_time
@@ -429,8 +575,9 @@ class ToolHead:
         flush_time = max(self.last_flush_time, self.print_time - pt_delay)
         self.print_time = max(self.print_time, next_print_time)
         want_flush_time = max(flush_time, self.print_time - pt_delay)
+        batch_time = self.flush_scheduler.get_move_batch_time()
         while 1:
-            flush_time = min(flush_time + MOVE_BATCH_TIME, want_flush_time)
+            flush_time = min(flush_time + batch_time, want_flush_time)
             self._advance_flush_time(flush_time)
             if flush_time >= want_flush_time:
                 break
@@ -462,7 +609,7 @@ class ToolHead:
         next_move_time = self.print_time
         for move in moves:
             if move.is_kinematic_move:
-                self.trapq_append(
+                move.trapq_append(
                     self.trapq,
                     next_move_time,
                     move.accel_t,
@@ -586,7 +733,11 @@ class ToolHead:
                 buffer_time = self.last_flush_time - est_print_time
                 if buffer_time > BGFLUSH_LOW_TIME:
                     return eventtime + buffer_time - BGFLUSH_LOW_TIME
-                ftime = est_print_time + BGFLUSH_LOW_TIME + BGFLUSH_BATCH_TIME
+                ftime = (
+                    est_print_time
+                    + BGFLUSH_LOW_TIME
+                    + self.flush_scheduler.get_bgflush_batch_time()
+                )
                 self._advance_flush_time(min(end_flush, ftime))
         except:
             logging.exception("Exception in flush_handler")
@@ -714,10 +865,16 @@ class ToolHead:
         is_active = buffer_time > -60.0 or not self.special_queuing_state
         if self.special_queuing_state == "Drip":
             buffer_time = 0.0
-        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
-            self.print_time,
-            max(buffer_time, 0.0),
-            self.print_stall,
+        self.flush_scheduler.update(self.last_flush_time - est_print_time)
+        return (
+            is_active,
+            "print_time=%.3f buffer_time=%.3f print_stall=%d %s"
+            % (
+                self.print_time,
+                max(buffer_time, 0.0),
+                self.print_stall,
+                self.flush_scheduler.stats(),
+            ),
         )
 
     def check_busy(self, eventtime):
@@ -740,6 +897,10 @@ class ToolHead:
                 "max_accel": self.max_accel,
                 "minimum_cruise_ratio": self.min_cruise_ratio,
                 "square_corner_velocity": self.square_corner_velocity,
+                "accel_profile": self.accel_profile,
+                "volumetric_flow": self.extruder.get_volumetric_flow(
+                    estimated_print_time
+                ),
             }
         )
         return res
@@ -809,6 +970,13 @@ class ToolHead:
         min_cruise_ratio = gcmd.get_float(
             "MINIMUM_CRUISE_RATIO", None, minval=0.0, below=1.0
         )
+        accel_profile = gcmd.get("ACCEL_PROFILE", None)
+        if accel_profile is not None:
+            accel_profile = accel_profile.lower()
+            if accel_profile not in ACCEL_PROFILES:
+                raise gcmd.error(
+                    "Invalid ACCEL_PROFILE '%s'" % (accel_profile,)
+                )
         if min_cruise_ratio is None:
             req_accel_to_decel = gcmd.get_float(
                 "ACCEL_TO_DECEL", None, above=0.0
@@ -829,6 +997,8 @@ class ToolHead:
             self.square_corner_velocity = square_corner_velocity
         if min_cruise_ratio is not None:
             self.min_cruise_ratio = min_cruise_ratio
+        if accel_profile is not None:
+            self._set_accel_profile(accel_profile)
         msg = [
             "max_velocity: %.6f" % self.max_velocity,
             "max_accel: %.6f" % self.max_accel,
@@ -876,6 +1046,7 @@ class ToolHead:
             (
                 "minimum_cruise_ratio: %.6f" % self.min_cruise_ratio,
                 "square_corner_velocity: %.6f" % self.square_corner_velocity,
+                "accel_profile: %s" % self.accel_profile,
             )
         )
 
@@ -888,9 +1059,21 @@ class ToolHead:
                 and max_accel is None
                 and square_corner_velocity is None
                 and min_cruise_ratio is None
+                and accel_profile is None
             ):
                 gcmd.respond_info("\n".join(msg), log=False)
 
+    def _set_accel_profile(self, accel_profile):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.accel_profile = accel_profile
+        if accel_profile == "scurve":
+            self.trapq_append = ffi_lib.trapq_append_scurve
+            # Keep the peak acceleration within the configured limits
+            self.accel_scale = 1.0 / SCURVE_PEAK_ACCEL
+        else:
+            self.trapq_append = ffi_lib.trapq_append
+            self.accel_scale = 1.0
+
     cmd_RESET_VELOCITY_LIMIT_help = "Reset printer velocity limits"
 
     def cmd_RESET_VELOCITY_LIMIT(self, gcmd):
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# Benchmark step compression on a corpus of step times
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import array
+import json
+import math
+import optparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from klippy import chelper  # noqa: E402
+
+CORPUS_VERSION = 1
+MCU_FREQ = 72000000.0
+MAX_STEPPER_ERROR = 0.000025
+# Start late enough that the initial trapq null move does not begin at zero
+START_TIME = 2.0
+MAX_CLOCK = (1 << 64) - 1
+# History markers are placed after all steps so they are not extracted
+MARKER_CLOCK = 1 << 63
+
+# Filament per mm of XY movement (0.45mm line, 0.2mm layer, 1.75mm filament)
+EXTRUDE_RATIO = 0.45 * 0.2 / (math.pi * 0.875**2)
+
+
+######################################################################
+# Motion profiles
+######################################################################
+
+
+# Generate a list of (start, end, start_v, cruise_v, end_v, accel) moves
+def gen_infill(line_length=60.0, count=20, speed=300.0, accel=10000.0):
+    moves = []
+    x = y = 0.0
+    for i in range(count):
+        nx = line_length if not i % 2 else 0.0
+        moves.append(((x, y), (nx, y), 0.0, speed, 0.0, accel))
+        moves.append(((nx, y), (nx, y + 0.45), 0.0, speed, 0.0, accel))
+        x, y = nx, y + 0.45
+    return moves
+
+
+def gen_gyroid(length=800.0, seg=0.5, speed=200.0, accel=10000.0):
+    moves = []
+    count = int(length / seg)
+    ramp = int(speed**2 / (2.0 * accel) / seg) + 1
+    pos = (0.0, 0.0)
+    for i in range(count):
+        x = (i + 1) * seg * 0.7
+        npos = (x, 8.0 * math.sin(x / 5.0))
+        start_v = min(speed, math.sqrt(2.0 * accel * i * seg))
+        end_v = min(speed, math.sqrt(2.0 * accel * (i + 1) * seg))
+        if i >= count - ramp:
+            start_v = min(start_v, math.sqrt(2.0 * accel * (count - i) * seg))
+            end_v = min(end_v, math.sqrt(2.0 * accel * (count - i - 1) * seg))
+        moves.append((pos, npos, start_v, speed, end_v, accel))
+        pos = npos
+    return moves
+
+
+PROFILES = {"infill": gen_infill, "gyroid": gen_gyroid}
+
+# Stepper setups: (name, axis, step_dist, pressure_advance)
+STEPPERS = [
+    ("x", "x", 0.0125, None),
+    ("y", "y", 0.0125, None),
+    ("x_256", "x", 40.0 / (200 * 256), None),
+    ("e_pa", "e", 22.6789 / (200 * 16 * 50 / 17), 0.040),
+]
+
+
+# Fill a trapq with the moves of a motion profile
+def fill_trapq(moves, extruder):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    tq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    print_time = START_TIME
+    epos = 0.0
+    for start, end, start_v, cruise_v, end_v, accel in moves:
+        axes_d = (end[0] - start[0], end[1] - start[1])
+        dist = math.sqrt(axes_d[0] ** 2 + axes_d[1] ** 2)
+        # Lower the cruise velocity if the move is too short to reach it
+        peak_v2 = (2.0 * accel * dist + start_v**2 + end_v**2) * 0.5
+        cruise_v = min(cruise_v, math.sqrt(peak_v2))
+        accel_t = (cruise_v - start_v) / accel
+        decel_t = (cruise_v - end_v) / accel
+        accel_d = (start_v + cruise_v) * 0.5 * accel_t
+        decel_d = (end_v + cruise_v) * 0.5 * decel_t
+        cruise_t = max(0.0, dist - accel_d - decel_d) / cruise_v
+        if extruder:
+            r = EXTRUDE_RATIO
+            ffi_lib.trapq_append(
+                tq, print_time, accel_t, cruise_t, decel_t,
+                epos, 0.0, 0.0, 1.0, 1.0, 0.0,
+                start_v * r, cruise_v * r, accel * r
+            )  # fmt: skip
+            epos += dist * r
+        else:
+            ffi_lib.trapq_append(
+                tq, print_time, accel_t, cruise_t, decel_t,
+                start[0], start[1], 0.0,
+                axes_d[0] / dist, axes_d[1] / dist, 0.0,
+                start_v, cruise_v, accel
+            )  # fmt: skip
+        print_time += accel_t + cruise_t + decel_t
+    return tq, print_time
+
+
+######################################################################
+# Corpus generation
+######################################################################
+
+
+# Convert queue_step history back into (sdir, count) runs and step clocks
+def extract_steps(sc):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    data = ffi_main.new("struct pull_history_steps[1024]")
+    hist = []
+    end_clock = MAX_CLOCK
+    while True:
+        count = ffi_lib.stepcompress_extract_old(
+            sc, data, len(data), 0, end_clock
+        )
+        for i in range(count):
+            hs = data[i]
+            if hs.step_count:
+                hist.append(
+                    (hs.first_clock, hs.step_count, hs.interval, hs.add)
+                )
+        if count < len(data):
+            break
+        end_clock = data[count - 1].first_clock
+    hist.reverse()
+    runs = []
+    clocks = array.array("Q")
+    for clock, step_count, interval, add in hist:
+        sdir = int(step_count > 0)
+        if not runs or runs[-1][0] != sdir:
+            runs.append([sdir, 0])
+        runs[-1][1] += abs(step_count)
+        for i in range(abs(step_count)):
+            clocks.append(clock)
+            interval += add
+            clock += interval
+    return runs, clocks
+
+
+# Generate the step times of a stepper following a motion profile
+def gen_trace(profile, stepper):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    name, axis, step_dist, pressure_advance = stepper
+    tq, end_time = fill_trapq(PROFILES[profile](), axis == "e")
+    if axis == "e":
+        sk = ffi_main.gc(ffi_lib.extruder_stepper_alloc(), ffi_lib.free)
+        ffi_lib.extruder_set_pressure_advance(sk, pressure_advance, 0.040)
+    else:
+        sk = ffi_lib.cartesian_stepper_alloc(axis.encode())
+        sk = ffi_main.gc(sk, ffi_lib.free)
+    # Record the exact step times with a zero max_error stepcompress
+    sc = ffi_main.gc(ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free)
+    ffi_lib.stepcompress_fill(sc, 0, 0, 0)
+    ss = ffi_lib.steppersync_alloc(ffi_main.NULL, [sc], 1, 0)
+    ss = ffi_main.gc(ss, ffi_lib.steppersync_free)
+    ffi_lib.steppersync_set_time(ss, 0.0, MCU_FREQ)
+    ffi_lib.itersolve_set_stepcompress(sk, sc, step_dist)
+    ffi_lib.itersolve_set_trapq(sk, tq)
+    ret = ffi_lib.itersolve_generate_steps(sk, end_time + 1.0)
+    if ret:
+        raise Exception("Step generation failed for %s" % (name,))
+    ffi_lib.stepcompress_set_last_position(sc, MARKER_CLOCK, 0)
+    runs, clocks = extract_steps(sc)
+    return {
+        "name": "%s_%s" % (profile, name),
+        "mcu_freq": MCU_FREQ,
+        "max_error": int(MAX_STEPPER_ERROR * MCU_FREQ),
+        "runs": runs,
+        "clocks": clocks,
+    }
+
+
+def gen_corpus():
+    return [gen_trace(p, s) for p in sorted(PROFILES) for s in STEPPERS]
+
+
+# Corpus file: a json header line followed by the raw step clocks
+def save_corpus(filename, corpus):
+    header = [{k: v for k, v in t.items() if k != "clocks"} for t in corpus]
+    with open(filename, "wb") as f:
+        data = {"version": CORPUS_VERSION, "traces": header}
+        f.write(json.dumps(data).encode() + b"\n")
+        for trace in corpus:
+            trace["clocks"].tofile(f)
+
+
+def load_corpus(filename):
+    with open(filename, "rb") as f:
+        data = json.loads(f.readline())
+        if data.get("version") != CORPUS_VERSION:
+            raise Exception("Unsupported corpus version")
+        corpus = data["traces"]
+        for trace in corpus:
+            clocks = array.array("Q")
+            clocks.fromfile(f, sum(count for sdir, count in trace["runs"]))
+            trace["clocks"] = clocks
+    return corpus
+
+
+######################################################################
+# Benchmark
+######################################################################
+
+
+# Compress a trace and return (elapsed_time, queue_step_count)
+def compress_trace(trace):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    sc = ffi_main.gc(ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free)
+    ffi_lib.stepcompress_fill(sc, trace["max_error"], 0, 0)
+    clocks = ffi_main.from_buffer("uint64_t[]", trace["clocks"])
+    runs = [
+        (sdir, ffi_main.cast("uint64_t *", clocks) + pos, count)
+        for sdir, count, pos in trace["run_pos"]
+    ]
+    start_time = time.perf_counter()
+    for sdir, ptr, count in runs:
+        ret = ffi_lib.stepcompress_queue_steps(sc, sdir, ptr, count)
+        if ret:
+            raise Exception("Step compression failed on %s" % (trace["name"]))
+    ret = ffi_lib.stepcompress_set_last_position(sc, MARKER_CLOCK, 0)
+    if ret:
+        raise Exception("Step compression failed on %s" % (trace["name"]))
+    elapsed = time.perf_counter() - start_time
+    data = ffi_main.new("struct pull_history_steps[1024]")
+    msg_count = 0
+    end_clock = MAX_CLOCK
+    while True:
+        count = ffi_lib.stepcompress_extract_old(
+            sc, data, len(data), 0, end_clock
+        )
+        msg_count += len([1 for i in range(count) if data[i].step_count])
+        if count < len(data):
+            break
+        end_clock = data[count - 1].first_clock
+    return elapsed, msg_count
+
+
+def run_benchmark(corpus, repeat):
+    for trace in corpus:
+        pos = 0
+        trace["run_pos"] = []
+        for sdir, count in trace["runs"]:
+            trace["run_pos"].append((sdir, count, pos))
+            pos += count
+    print(
+        "%-16s %9s %8s %9s %10s %9s"
+        % ("trace", "steps", "msgs", "steps/msg", "time_ms", "Msteps/s")
+    )
+    total_steps = total_msgs = total_time = 0
+    for trace in corpus:
+        steps = len(trace["clocks"])
+        results = [compress_trace(trace) for i in range(repeat)]
+        elapsed = min(r[0] for r in results)
+        msgs = results[0][1]
+        print(
+            "%-16s %9d %8d %9.2f %10.3f %9.2f"
+            % (
+                trace["name"],
+                steps,
+                msgs,
+                steps / float(msgs),
+                elapsed * 1000.0,
+                steps / elapsed / 1000000.0,
+            )
+        )
+        total_steps += steps
+        total_msgs += msgs
+        total_time += elapsed
+    print(
+        "%-16s %9d %8d %9.2f %10.3f %9.2f"
+        % (
+            "total",
+            total_steps,
+            total_msgs,
+            total_steps / float(total_msgs),
+            total_time * 1000.0,
+            total_steps / total_time / 1000000.0,
+        )
+    )
+
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option(
+        "-l", "--load", type="string", dest="load", help="load corpus file"
+    )
+    opts.add_option(
+        "-s", "--save", type="string", dest="save", help="save corpus file"
+    )
+    opts.add_option(
+        "-r", "--repeat", type="int", dest="repeat", default=5,
+        help="number of runs of each trace (default 5)",
+    )  # fmt: skip
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    if options.load:
+        corpus = load_corpus(options.load)
+    else:
+        corpus = gen_corpus()
+    if options.save:
+        save_corpus(options.save, corpus)
+    run_benchmark(corpus, options.repeat)
+
+
+if __name__ == "__main__":
+    main()
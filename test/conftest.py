@@ -55,3 +55,128 @@ def config_root(request, tmp_path):
     tmp_config_root = tmp_path / "printer"
     shutil.copytree(src, tmp_config_root)
     yield tmp_config_root
+
+
+class FakeReactor:
+    """Reactor with a manual clock for host module unit tests"""
+
+    NOW = 0.0
+    NEVER = 9999999999999999.9
+
+    def __init__(self):
+        self.time = 0.0
+        self.timers = {}
+        self.pauses = []
+
+    def monotonic(self):
+        return self.time
+
+    def register_timer(self, callback, waketime=NEVER):
+        self.timers[callback] = waketime
+        return callback
+
+    def update_timer(self, timer, waketime):
+        self.timers[timer] = waketime
+
+    def unregister_timer(self, timer):
+        del self.timers[timer]
+
+    def pause(self, waketime):
+        self.pauses.append(waketime - self.time)
+        self.time = max(self.time, waketime)
+        return self.time
+
+
+class FakeGCode:
+    def __init__(self):
+        self.commands = {}
+        self.messages = []
+
+    def register_command(self, cmd, func, desc=None):
+        self.commands[cmd] = func
+
+    def respond_info(self, msg, log=True):
+        self.messages.append(msg)
+
+
+class FakePrinter:
+    command_error = config_error = Exception
+
+    def __init__(self):
+        self.reactor = FakeReactor()
+        self.objects = {"gcode": FakeGCode()}
+
+    def get_reactor(self):
+        return self.reactor
+
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+
+    def add_object(self, name, obj):
+        self.objects[name] = obj
+
+    def load_object(self, config, name, default=None):
+        return self.objects.get(name, default)
+
+    def register_event_handler(self, event, callback):
+        pass
+
+
+class FakeConfig:
+    """Config section returning the given options or the defaults"""
+
+    error = Exception
+
+    def __init__(self, printer, name, options):
+        self.printer = printer
+        self.name = name
+        self.options = options
+
+    def get_printer(self):
+        return self.printer
+
+    def get_name(self):
+        return self.name
+
+    def get(self, option, default=None, **kw):
+        return self.options.get(option, default)
+
+    getfloat = getint = getboolean = get
+
+    def getchoice(self, option, choices, default=None):
+        return choices[self.options.get(option, default)]
+
+
+class FakeGCmd:
+    """G-Code command with the given parameters"""
+
+    error = Exception
+
+    def __init__(self, params):
+        self.params = params
+
+    def get(self, name, default=None, **kw):
+        return self.params.get(name, default)
+
+    get_float = get_int = get
+
+
+@pytest.fixture
+def printer():
+    return FakePrinter()
+
+
+@pytest.fixture
+def make_config(printer):
+    def make(name="test", **options):
+        return FakeConfig(printer, name, options)
+
+    return make
+
+
+@pytest.fixture
+def make_gcmd():
+    def make(**params):
+        return FakeGCmd(params)
+
+    return make
@@ -0,0 +1,81 @@
+import types
+
+import pytest
+
+from klippy.extras import adaptive_report, heaters
+
+
+class DummyHeater:
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.target = 0.0
+
+    def get_temp(self, eventtime):
+        return 20.0, self.target
+
+
+class DummyPollClient:
+    def __init__(self, reactor):
+        self.next_time = reactor.NEVER
+
+    def reschedule(self, waketime):
+        self.next_time = min(self.next_time, waketime)
+
+
+@pytest.fixture
+def make_adaptive(printer, make_config):
+    printer.add_object("heaters", types.SimpleNamespace(heaters={}))
+
+    def make(sensor=None, **options):
+        poll_client = DummyPollClient(printer.get_reactor())
+        return adaptive_report.AdaptiveReportTime(
+            make_config(**options), sensor, poll_client, 1.0
+        )
+
+    return make
+
+
+def test_disabled_by_default(make_adaptive):
+    adaptive = make_adaptive()
+    for temp in (20.0, 20.0, 20.0):
+        assert adaptive.next_report_time(0.0, temp, -40.0, 125.0) == 1.0
+
+
+def test_backoff_and_reset(make_adaptive):
+    adaptive = make_adaptive(max_report_time=5.0)
+    times = [
+        adaptive.next_report_time(0.0, 20.0 + i * 0.01, -40.0, 125.0)
+        for i in range(6)
+    ]
+    assert times == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+    assert adaptive.get_report_time() == 5.0
+    # A significant change restores the configured rate
+    assert adaptive.next_report_time(0.0, 21.0, -40.0, 125.0) == 1.0
+    assert adaptive.next_report_time(0.0, 21.0, -40.0, 125.0) == 2.0
+
+
+@pytest.mark.parametrize("temp", [-36.0, 121.0])
+def test_fast_near_limits(make_adaptive, temp):
+    adaptive = make_adaptive(max_report_time=5.0)
+    for _ in range(4):
+        assert adaptive.next_report_time(0.0, temp, -40.0, 125.0) == 1.0
+
+
+def test_heater_sensor(printer, make_adaptive):
+    sensor = object()
+    heater = DummyHeater(sensor)
+    printer.lookup_object("heaters").heaters["heater_bed"] = heater
+    adaptive = make_adaptive(sensor, max_report_time=60.0)
+    times = [
+        adaptive.next_report_time(0.0, 20.0, -40.0, 125.0) for _ in range(5)
+    ]
+    # Readings stay fresh enough for the heater
+    assert max(times) < heaters.QUELL_STALE_TIME
+    assert times[-1] == max(times) > 1.0
+    # Setting a target polls the sensor right away
+    printer.get_reactor().time = 100.0
+    heater.target = 60.0
+    adaptive.note_target(heater.target)
+    assert adaptive.poll_client.next_time == 100.0
+    assert adaptive.get_report_time() == 1.0
+    assert adaptive.next_report_time(0.0, 20.0, -40.0, 125.0) == 1.0
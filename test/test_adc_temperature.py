@@ -0,0 +1,57 @@
+import pytest
+
+from klippy.extras import adc_temperature, thermistor
+
+
+class DummyConfig:
+    def get_name(self):
+        return "heater_dummy"
+
+    def getfloat(self, option, default=None, **kw):
+        return default
+
+
+@pytest.fixture
+def beta_thermistor():
+    therm = thermistor.Thermistor(4700.0, 0.0)
+    therm.setup_coefficients_beta(25.0, 100000.0, 3950.0)
+    return therm
+
+
+def test_thermistor_table(beta_thermistor):
+    table = adc_temperature.ADCLookupTable(beta_thermistor)
+    for i in range(1, 20000):
+        adc = i / 20000.0
+        temp = beta_thermistor.calc_temp(adc)
+        if -20.0 <= temp <= 350.0:
+            assert table.calc_temp(adc) == pytest.approx(temp, abs=0.01)
+    for temp in range(-20, 351):
+        adc = beta_thermistor.calc_adc(temp)
+        assert table.calc_adc(temp) == pytest.approx(adc, abs=0.00001)
+        assert table.calc_temp(table.calc_adc(temp)) == pytest.approx(
+            temp, abs=0.01
+        )
+
+
+def test_thermistor_table_limits(beta_thermistor):
+    # Values outside of the table use the analytic form
+    table = adc_temperature.ADCLookupTable(beta_thermistor)
+    for adc in (0.0, 0.00001, 1.0):
+        assert table.calc_temp(adc) == beta_thermistor.calc_temp(adc)
+    for temp in (-300.0, 5000.0):
+        assert table.calc_adc(temp) == beta_thermistor.calc_adc(temp)
+
+
+def test_linear_voltage_table():
+    params = [(0.0, 0.5), (100.0, 1.5), (300.0, 3.5)]
+    linear = adc_temperature.LinearVoltage(DummyConfig(), params)
+    table = adc_temperature.ADCLookupTable(linear)
+    for i in range(1001):
+        adc = i / 1000.0
+        assert table.calc_temp(adc) == pytest.approx(
+            linear.calc_temp(adc), abs=0.001
+        )
+    for temp in range(-50, 401):
+        assert table.calc_adc(temp) == pytest.approx(
+            linear.calc_adc(temp), abs=0.00001
+        )
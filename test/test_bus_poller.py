@@ -0,0 +1,189 @@
+import pytest
+
+from klippy.extras import bus
+
+
+class DummyBatch:
+    def __init__(self, mcu):
+        self.mcu = mcu
+        self.queries = []
+
+    def add_query(self, query_cmd, data=()):
+        self.queries.append(data)
+
+    def send(self, retry=True):
+        self.mcu.batches.append(self.queries)
+        if self.mcu.fail:
+            raise Exception("timeout")
+        results = []
+        for oid, reg, n in self.queries:
+            if self.mcu.missing.get(oid, 0):
+                # No response to this query
+                self.mcu.missing[oid] -= 1
+                results.append(None)
+                continue
+            results.append({"response": bytes([oid] * n)})
+        return results
+
+
+class DummyMCU:
+    def __init__(self, printer):
+        self.printer = printer
+        self.batches = []
+        self.fail = False
+        self.missing = {}
+
+    def get_printer(self):
+        return self.printer
+
+    def create_query_batch(self):
+        return DummyBatch(self)
+
+
+class DummyI2C:
+    i2c_read_cmd = None
+
+    def __init__(self, oid):
+        self.oid = oid
+        self.writes = []
+
+    def i2c_write_noack(self, data):
+        self.writes.append(data)
+
+    def add_i2c_read(self, batch, write, read_len):
+        batch.add_query(None, [self.oid, write, read_len])
+
+
+@pytest.fixture
+def mcu(printer):
+    return DummyMCU(printer)
+
+
+def test_poller_batches_steps(mcu):
+    reactor = mcu.get_printer().get_reactor()
+    poller = bus.I2CPoller(mcu)
+    results = {}
+
+    def make_client(oid, steps, period):
+        def callback(eventtime, responses):
+            results[oid] = responses
+            return eventtime + period
+
+        client = poller.register_client(DummyI2C(oid), callback)
+        client.set_steps(steps)
+        client.start(reactor.NOW)
+        return client
+
+    c1 = make_client(1, [(None, 0.0, [0x10], 2)], 1.0)
+    c2 = make_client(2, [([0xF3], 0.05, [], 3), ([0xF5], 0.02, [], 3)], 1.0)
+    next_time = poller._poll_event(0.0)
+    # Reads of each step are sent in one batch
+    assert mcu.batches == [[[1, [0x10], 2], [2, [], 3]], [[2, [], 3]]]
+    assert reactor.pauses == pytest.approx([0.05, 0.02])
+    assert c2.i2c.writes == [[0xF3], [0xF5]]
+    assert c1.i2c.writes == []
+    assert results[1] == [bytearray([1, 1])]
+    assert results[2] == [bytearray([2] * 3)] * 2
+    assert next_time == 1.0
+
+
+def test_poller_schedule(mcu):
+    poller = bus.I2CPoller(mcu)
+    calls = []
+
+    def callback(eventtime, responses):
+        calls.append(eventtime)
+        return eventtime + 10.0
+
+    fast = poller.register_client(DummyI2C(1), callback)
+    fast.set_steps([(None, 0.0, [], 1)])
+    slow = poller.register_client(DummyI2C(2), callback)
+    slow.set_steps([(None, 0.0, [], 1)])
+    fast.start(0.0)
+    slow.start(5.05)
+    assert poller._poll_event(0.0) == 5.05
+    assert len(mcu.batches[-1]) == 1
+    # Clients due shortly after each other share a batch
+    fast.next_time = 5.0
+    assert poller._poll_event(5.0) == 15.0
+    assert len(mcu.batches[-1]) == 2
+    slow.stop()
+    assert slow.next_time == poller.reactor.NEVER
+
+
+def test_poller_error(mcu):
+    mcu.fail = True
+    poller = bus.I2CPoller(mcu)
+    results = []
+
+    def callback(eventtime, responses):
+        results.append(responses)
+        return poller.reactor.NEVER
+
+    client = poller.register_client(DummyI2C(1), callback)
+    client.set_steps([(None, 0.0, [], 1)])
+    client.start(0.0)
+    assert poller._poll_event(0.0) == poller.reactor.NEVER
+    assert results == [None]
+
+
+def test_poller_failed_client(mcu):
+    poller = bus.I2CPoller(mcu)
+    results = {}
+
+    def make_client(oid, retries):
+        def callback(eventtime, responses):
+            results[oid] = responses
+            return (
+                eventtime + 1.0
+                if responses is not None
+                else poller.reactor.NEVER
+            )
+
+        client = poller.register_client(DummyI2C(oid), callback, retries)
+        client.set_steps([(None, 0.0, [], 1), (None, 0.0, [], 1)])
+        client.start(0.0)
+        return client
+
+    make_client(1, 4)
+    make_client(2, 4)
+    make_client(3, 2)
+    # Device 2 recovers on the last retry, device 3 does not answer
+    mcu.missing = {2: 4, 3: 10}
+    assert poller._poll_event(0.0) == 1.0
+    assert results[1] == [bytearray([1])] * 2
+    assert results[2] == [bytearray([2])] * 2
+    assert results[3] is None
+    # Only the missing reads were resent and the failed device does
+    # not run its next step
+    assert mcu.batches[:5] == [
+        [[1, [], 1], [2, [], 1], [3, [], 1]],
+        [[2, [], 1], [3, [], 1]],
+        [[2, [], 1], [3, [], 1]],
+        [[2, [], 1]],
+        [[2, [], 1]],
+    ]
+    assert mcu.batches[5:] == [[[1, [], 1], [2, [], 1]]]
+
+
+def test_poller_callback_error(mcu):
+    poller = bus.I2CPoller(mcu)
+    calls = []
+
+    def bad_callback(eventtime, responses):
+        raise ValueError("bad data")
+
+    def callback(eventtime, responses):
+        calls.append(responses)
+        return eventtime + 1.0
+
+    bad = poller.register_client(DummyI2C(1), bad_callback)
+    good = poller.register_client(DummyI2C(2), callback)
+    for client in (bad, good):
+        client.set_steps([(None, 0.0, [], 1)])
+        client.start(0.0)
+    # Only the failing device stops polling
+    assert poller._poll_event(0.0) == 1.0
+    assert bad.next_time == poller.reactor.NEVER
+    assert poller._poll_event(1.0) == 2.0
+    assert calls == [[bytearray([2])]] * 2
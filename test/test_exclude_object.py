@@ -0,0 +1,234 @@
+import pytest
+
+from klippy.extras import exclude_object, gcode_analysis
+
+LIMITS = {
+    "max_velocity": 300.0,
+    "max_accel": 3000.0,
+    "minimum_cruise_ratio": 0.5,
+    "square_corner_velocity": 5.0,
+    "max_z_velocity": 10.0,
+    "max_z_accel": 100.0,
+    "instant_corner_velocity": 1.0,
+    "max_extrude_only_velocity": 50.0,
+    "max_extrude_only_accel": 500.0,
+}
+
+GCODE = """G90
+M83
+EXCLUDE_OBJECT_START NAME=part_a
+G1 X10 Y10 E0.5 F1200
+G1 X11 Y10 E0.5
+G1 X11 Y11 E0.5
+G1 X10 Y11 E0.5
+G1 X10 Y10 E0.5
+G1 E-0.6 F1800
+EXCLUDE_OBJECT_END NAME=part_a
+EXCLUDE_OBJECT_START NAME=part_b
+G1 X20 Y10 E1.0 F1200
+G1 E-0.8 F1800
+M106 S200
+G1 X30 Y20 Z0.6 F6000
+G1 E0.3
+G1 E-0.5
+EXCLUDE_OBJECT_END NAME=part_b
+G1 E0.8
+G1 X5 Y5 E0.4 F1200
+"""
+
+
+class DummyTransform:
+    def __init__(self):
+        self.moves = []
+
+    def get_position(self):
+        return [0.0, 0.0, 0.0, 0.0]
+
+    def move(self, newpos, speed):
+        self.moves.append(list(newpos))
+
+
+class DummyGCodeMove:
+    # Minimal G90/M83 G1 handling feeding the move transform
+    def __init__(self):
+        self.transform = None
+        self.position = [0.0, 0.0, 0.0, 0.0]
+        self.speed = 25.0
+
+    def set_move_transform(self, transform, force=False):
+        old, self.transform = self.transform, transform
+        return old
+
+    def get_status(self, eventtime=None):
+        return {"absolute_coordinates": True, "absolute_extrude": False}
+
+    def reset_last_position(self):
+        pass
+
+    def cmd_G1(self, params):
+        for pos, axis in enumerate("XYZ"):
+            if axis in params:
+                self.position[pos] = params[axis]
+        self.position[3] += params.get("E", 0.0)
+        if "F" in params:
+            self.speed = params["F"] / 60.0
+        self.transform.move(list(self.position), self.speed)
+
+
+class DummyVirtualSD:
+    def __init__(self, filename, index):
+        self.filename = filename
+        self.file_indexer = self
+        self.state = "ready"
+        self.file_index = gcode_analysis.FileIndex(index)
+        self.file_position = 0
+
+    def file_path(self):
+        return self.filename
+
+    def is_cmd_from_sd(self):
+        return True
+
+    def get_file_position(self):
+        return self.file_position
+
+    def set_file_position(self, pos):
+        self.file_position = pos
+
+
+class DummyExtruder:
+    def get_name(self):
+        return "extruder"
+
+
+class DummyToolhead:
+    def get_extruder(self):
+        return DummyExtruder()
+
+
+class DummyTuningTower:
+    def is_active(self):
+        return False
+
+
+class DummyGCode:
+    def __init__(self, printer):
+        self.printer = printer
+        self.scripts = []
+
+    def register_command(self, cmd, func, desc=None):
+        pass
+
+    def respond_info(self, msg):
+        pass
+
+    def run_script_from_command(self, script):
+        self.scripts.append(script)
+        for line in script.split("\n"):
+            self.printer.run_line(line)
+
+
+class DummyGCmd:
+    def __init__(self, params):
+        self.params = params
+
+    def get(self, name, default=None):
+        return self.params.get(name, default)
+
+
+class DummyPrinter:
+    def __init__(self):
+        self.gcode_move = DummyGCodeMove()
+        self.gcode_move.set_move_transform(DummyTransform())
+        self.objects = {
+            "gcode": DummyGCode(self),
+            "tuning_tower": DummyTuningTower(),
+            "toolhead": DummyToolhead(),
+        }
+        self.fan = None
+
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+
+    def load_object(self, config, name):
+        return self.gcode_move
+
+    def register_event_handler(self, event, callback):
+        pass
+
+    def run_line(self, line):
+        words = line.split()
+        cmd = words[0]
+        params = {w[0]: float(w[1:]) for w in words[1:] if w[1:]}
+        if cmd == "G1":
+            self.gcode_move.cmd_G1(params)
+        elif cmd == "M106":
+            self.fan = params["S"]
+
+
+class DummyConfig:
+    def __init__(self, printer):
+        self.printer = printer
+
+    def get_printer(self):
+        return self.printer
+
+    def getboolean(self, option, default=None):
+        return default
+
+
+def run_file(path, seek):
+    data = path.read_bytes()
+    printer = DummyPrinter()
+    exclude = exclude_object.ExcludeObject(DummyConfig(printer))
+    exclude._handle_connect()
+    vsd = DummyVirtualSD(
+        str(path), gcode_analysis.analyze_file(str(path), LIMITS)
+    )
+    if seek:
+        printer.objects["virtual_sdcard"] = vsd
+    exclude.cmd_EXCLUDE_OBJECT(DummyGCmd({"NAME": "part_b"}))
+    # Minimal virtual_sdcard work loop
+    while vsd.file_position < len(data):
+        pos = vsd.file_position
+        line_end = data.index(b"\n", pos) + 1
+        vsd.file_position = line_end
+        line = data[pos:line_end].decode().strip()
+        words = line.split()
+        if words[0].startswith("EXCLUDE_OBJECT"):
+            params = dict(w.split("=") for w in words[1:])
+            getattr(exclude, "cmd_" + words[0])(DummyGCmd(params))
+        elif words[0] not in ("G90", "M83"):
+            printer.run_line(line)
+    return printer, exclude
+
+
+def test_skip_matches_ignored_moves(tmp_path):
+    path = tmp_path / "test.gcode"
+    path.write_text(GCODE)
+    printer, exclude = run_file(path, seek=False)
+    seek_printer, seek_exclude = run_file(path, seek=True)
+    # The section was seeked past instead of being read
+    assert len(seek_printer.lookup_object("gcode").scripts) == 1
+    assert seek_printer.fan == printer.fan == 200.0
+    assert seek_printer.gcode_move.speed == printer.gcode_move.speed
+    for attr in [
+        "last_position",
+        "last_position_excluded",
+        "last_position_extruded",
+        "max_position_excluded",
+        "max_position_extruded",
+        "extruder_adj",
+    ]:
+        assert getattr(seek_exclude, attr) == pytest.approx(
+            getattr(exclude, attr)
+        ), attr
+    assert seek_exclude.extrusion_offsets["extruder"] == pytest.approx(
+        exclude.extrusion_offsets["extruder"]
+    )
+    # Same moves sent to the toolhead after the excluded section
+    moves = exclude.next_transform.moves
+    seek_moves = seek_exclude.next_transform.moves
+    assert len(moves) == len(seek_moves) == 8
+    for move, seek_move in zip(moves, seek_moves):
+        assert seek_move == pytest.approx(move)
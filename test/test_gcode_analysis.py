@@ -0,0 +1,303 @@
+import math
+
+import pytest
+
+from klippy import reactor
+from klippy.extras import gcode_analysis, virtual_sdcard
+
+LIMITS = {
+    "max_velocity": 300.0,
+    "max_accel": 3000.0,
+    "minimum_cruise_ratio": 0.5,
+    "square_corner_velocity": 5.0,
+    "max_z_velocity": 10.0,
+    "max_z_accel": 100.0,
+    "instant_corner_velocity": 1.0,
+    "max_extrude_only_velocity": 50.0,
+    "max_extrude_only_accel": 500.0,
+}
+
+GCODE = """; test file
+G90
+M83
+G28
+G1 X10 Y10 F6000
+EXCLUDE_OBJECT_DEFINE NAME=part_1
+;LAYER_CHANGE
+G1 Z0.2 F600
+EXCLUDE_OBJECT_START NAME=part_1
+G1 X20 Y10 E1.0 F1200
+G1 X20 Y20 E1.0
+EXCLUDE_OBJECT_END NAME=part_1
+G4 P500
+;LAYER_CHANGE
+G1 Z0.4 F600
+EXCLUDE_OBJECT_START NAME=part_1
+G1 X10 Y20 E1.0 F1200
+G2 X10 Y10 I0 J-5 E1.5
+EXCLUDE_OBJECT_END NAME=part_1
+G1 E-0.5 F1800
+"""
+
+
+@pytest.fixture
+def gcode_file(tmp_path):
+    path = tmp_path / "test.gcode"
+    path.write_text(GCODE)
+    return path
+
+
+def test_analyze_file(gcode_file):
+    index = gcode_analysis.analyze_file(str(gcode_file), LIMITS)
+    data = gcode_file.read_bytes()
+    assert index["layer_heights"] == [0.2, 0.4]
+    second = data.index(b";LAYER_CHANGE", data.index(b"G4"))
+    assert index["layer_offsets"] == [0, second]
+    assert index["layer_filament"] == [0.0, 2.0]
+    assert index["filament_total"] == pytest.approx(4.0)
+    assert index["objects"] == {"PART_1": [10.0, 10.0, 20.0, 20.0]}
+    assert index["max_feedrates"]["print"] == 20.0
+    assert index["max_feedrates"]["travel"] == 100.0
+    assert index["max_feedrates"]["z"] == 10.0
+    assert index["max_feedrates"]["extrude_only"] == 30.0
+    # 10mm + 10mm at 20mm/s plus the dwell
+    assert index["layer_times"][0] > 1.5
+    # 10mm line plus half circle of radius 5 at 20mm/s
+    arc_time = (10.0 + 5.0 * 3.14159) / 20.0
+    assert index["layer_times"][1] > arc_time
+    assert index["layer_times"][1] < arc_time + 1.0
+
+
+def test_index_cache(gcode_file):
+    filename = str(gcode_file)
+    assert gcode_analysis.load_cached_index(filename, LIMITS) is None
+    index = gcode_analysis.build_index(filename, LIMITS)
+    cached = gcode_analysis.load_cached_index(filename, LIMITS)
+    assert cached == index
+    limits = dict(LIMITS, max_accel=1000.0)
+    assert gcode_analysis.load_cached_index(filename, limits) is None
+
+
+class DummyPrinter:
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def get_reactor(self):
+        return self.reactor
+
+
+def test_background_indexer(gcode_file, monkeypatch):
+    monkeypatch.setattr(gcode_analysis, "get_motion_limits", lambda p: LIMITS)
+    r = reactor.Reactor()
+    indexer = gcode_analysis.FileIndexer(DummyPrinter(r))
+    timers = list(r._timers)
+    indexer.start(str(gcode_file))
+    assert indexer.state == "analyzing"
+
+    def check(eventtime):
+        if indexer.state != "analyzing":
+            r.end()
+        return eventtime + 0.050
+
+    check_timer = r.register_timer(check, r.NOW)
+    r.run()
+    r.unregister_timer(check_timer)
+    assert indexer.state == "ready"
+    assert indexer.get_file_index().get_layer_count() == 2
+    # The poll timer was released
+    assert indexer.poll_timer is None and r._timers == timers
+
+
+def test_time_left(gcode_file):
+    index = gcode_analysis.analyze_file(str(gcode_file), LIMITS)
+    file_index = gcode_analysis.FileIndex(index)
+    total = index["estimated_time"]
+    assert file_index.get_time_left(0) == pytest.approx(total)
+    assert file_index.get_time_left(index["size"]) == pytest.approx(0.0)
+    second = index["layer_offsets"][1]
+    assert file_index.get_layer(second - 1) == 1
+    assert file_index.get_layer(second) == 2
+    assert file_index.get_time_left(second) == pytest.approx(
+        index["layer_times"][1]
+    )
+    assert file_index.find_layer_by_height(0.4) == 2
+
+
+STATE_GCODE = """M140 S60
+M104 S200
+M190 S60
+M109 S200
+G90
+M82
+G28
+SET_GCODE_OFFSET Z=0.05
+G92 E0
+;LAYER_CHANGE
+G1 Z0.2 F600
+G1 X10 Y10 E1.0 F1200
+M106 S128
+; M106 S0
+G91
+G1 Z0.4 E-0.5
+G90
+G1 X20 E2.0
+;LAYER_CHANGE
+G1 Z0.4
+M107
+"""
+
+
+def test_scan_state(tmp_path):
+    path = tmp_path / "state.gcode"
+    path.write_text(STATE_GCODE)
+    data = path.read_bytes()
+    offset = data.rindex(b";LAYER_CHANGE")
+    state = gcode_analysis.scan_state(str(path), offset)
+    assert state["absolute_coord"] is True
+    assert state["absolute_extrude"] is True
+    assert state["position"] == [20.0, 10.0, pytest.approx(0.6), 2.0]
+    assert state["feedrate"] == 1200.0
+    assert state["heaters"] == {("M140", -1): 60.0, ("M104", -1): 200.0}
+    assert state["fans"] == {-1: "M106 S128"}
+    assert state["offsets"] == ["SET_GCODE_OFFSET Z=0.05"]
+    state = gcode_analysis.scan_state(str(path), len(data))
+    assert state["fans"] == {-1: "M107"}
+
+
+def test_resume_script(tmp_path):
+    path = tmp_path / "state.gcode"
+    path.write_text(STATE_GCODE)
+    offset = path.read_bytes().rindex(b";LAYER_CHANGE")
+    state = gcode_analysis.scan_state(str(path), offset)
+    get_script = virtual_sdcard.VirtualSD._get_resume_script
+    script = get_script(None, state, True, 2.0)
+    assert "M104 S200.000" in script and "M109 S200.000" in script
+    assert "M190 S60.000" in script
+    # HEAT=0 still sets the targets, only the waits are skipped
+    script = get_script(None, state, False, 2.0)
+    assert "M104 S200.000" in script and "M140 S60.000" in script
+    assert not [l for l in script if l.startswith(("M109", "M190"))]
+    # Offsets are replayed on top of cleared offsets
+    idx = script.index("SET_GCODE_OFFSET X=0 Y=0 Z=0")
+    assert script[idx + 1] == "SET_GCODE_OFFSET Z=0.05"
+
+
+SHIFT_GCODE = """G90
+M82
+G28
+G1 X100 Y50 Z5 F6000
+G92 X0 Y0 Z0 E0
+G1 Z0.2 F600
+G1 X10 Y10 E1.0 F1200
+G28 X
+G1 X20 Y20 E2.0
+;LAYER_CHANGE
+G1 Z0.4
+"""
+
+
+def test_resume_coord_shift(tmp_path):
+    path = tmp_path / "shift.gcode"
+    path.write_text(SHIFT_GCODE)
+    data = path.read_bytes()
+    state = gcode_analysis.scan_state(str(path), data.rindex(b";LAYER"))
+    assert state["position"] == [20.0, 20.0, 0.2, 2.0]
+    # G28 X clears the X shift of the G92
+    assert state["coord_shift"] == [0.0, 50.0, 5.0]
+    get_script = virtual_sdcard.VirtualSD._get_resume_script
+    script = get_script(None, state, False, 2.0)
+    # Move to the unshifted position, then shift the coordinates again
+    idx = script.index("G1 Z7.200 F600")
+    assert script[idx : idx + 4] == [
+        "G1 Z7.200 F600",
+        "G1 X20.000 Y70.000 F6000",
+        "G1 Z5.200 F600",
+        "G92 Y20.000 Z0.200",
+    ]
+    # The position a G92 right after homing applies to is not known
+    path.write_text("G28\nG92 Z0\nG1 Z0.2\n;LAYER_CHANGE\n")
+    state = gcode_analysis.scan_state(str(path), path.read_bytes().index(b";"))
+    assert state["coord_shift"] == [0.0, 0.0, None]
+
+
+def test_virtual_segment_planner(tmp_path):
+    path = tmp_path / "circle.gcode"
+    lines = ["G90", "M83", "G1 X25 Y20 F12000"]
+    for i in range(1, 3 * 360 + 1):
+        a = math.radians(i)
+        x, y = 20.0 + 5.0 * math.cos(a), 20.0 + 5.0 * math.sin(a)
+        lines.append("G1 X%.4f Y%.4f E0.01" % (x, y))
+    # Sharp corners are still limited by square_corner_velocity
+    lines += ["G1 X40 Y20", "G1 X40 Y40", "G1 X20 Y40", "G1 X20 Y20"]
+    path.write_text("\n".join(lines) + "\n")
+    default = gcode_analysis.analyze_file(str(path), LIMITS)
+    limits = dict(LIMITS, virtual_segments=True)
+    index = gcode_analysis.analyze_file(str(path), limits)
+    # Centripetal limit of the run matches the per junction limits
+    assert index["layer_times"][0] == pytest.approx(
+        default["layer_times"][0], rel=0.01
+    )
+
+
+def test_volumetric_flow_limit(tmp_path):
+    path = tmp_path / "flow.gcode"
+    path.write_text("G90\nM83\nG1 X10 Y10 F6000\nG1 X110 Y10 E10 F6000\n")
+    default = gcode_analysis.analyze_file(str(path), LIMITS)
+    # 10mm of filament per 100mm of move limits the move to 20mm/s
+    limits = dict(LIMITS, max_volumetric_flow=2.0, filament_area=1.0)
+    index = gcode_analysis.analyze_file(str(path), limits)
+    assert default["layer_times"][0] < 2.0
+    assert index["layer_times"][0] > 5.0
+
+
+def test_scurve_peak_accel(tmp_path):
+    path = tmp_path / "scurve.gcode"
+    path.write_text("G90\nM83\nG1 X0 Y0 F18000\nG1 X100\nG1 Z10\n")
+    default = gcode_analysis.analyze_file(str(path), LIMITS)
+    # S-curve moves plan with 2/3 of max_accel and max_z_accel, which
+    # adds 0.05s to each of the two moves
+    limits = dict(LIMITS, accel_scale=1.0 / 1.5)
+    index = gcode_analysis.analyze_file(str(path), limits)
+    assert index["layer_times"][0] - default["layer_times"][0] == (
+        pytest.approx(0.1, abs=0.005)
+    )
+
+
+SECTION_GCODE = """G90
+M83
+EXCLUDE_OBJECT_START NAME=part_a
+G1 X20 Y10 E1.0 F1200
+M204 S2000
+M106 S100
+G1 E-0.8 F1800
+G92 E0
+M106 S200
+G1 X30 Y10 Z0.6 F6000
+EXCLUDE_OBJECT_END NAME=part_a
+EXCLUDE_OBJECT_START NAME=part_b
+G1 X40 Y10 E1.0
+T1
+EXCLUDE_OBJECT_END NAME=part_b
+"""
+
+
+def test_object_sections(tmp_path):
+    path = tmp_path / "sections.gcode"
+    path.write_text(SECTION_GCODE)
+    data = path.read_bytes()
+    index = gcode_analysis.analyze_file(str(path), LIMITS)
+    # The section holding a T1 can't be seeked past
+    assert len(index["object_sections"]) == 1
+    section = index["object_sections"][0]
+    start = data.index(b"G1 X20")
+    assert section["name"] == "PART_A"
+    assert section["start"] == start
+    assert section["end"] == data.index(b"EXCLUDE_OBJECT_END")
+    assert section["position"] == [30.0, 10.0, 0.6]
+    assert section["extrude"] == pytest.approx(0.2)
+    assert section["extrude_peak"] == pytest.approx(1.0)
+    assert section["feedrate"] == 6000.0
+    assert section["commands"] == ["M204 S2000", "M106 S200"]
+    file_index = gcode_analysis.FileIndex(index)
+    assert file_index.get_object_section(start) == section
+    assert file_index.get_object_section(start + 1) is None
@@ -0,0 +1,81 @@
+from klippy import reactor
+from klippy.extras import gcode_profiler
+
+
+class DummyGCode:
+    def register_command(self, cmd, func, desc=None):
+        pass
+
+    def set_profiler(self, profiler):
+        pass
+
+
+class DummyWebhooks:
+    def register_endpoint(self, path, callback):
+        pass
+
+
+class DummyPrinter:
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.objects = {"gcode": DummyGCode(), "webhooks": DummyWebhooks()}
+
+    def get_reactor(self):
+        return self.reactor
+
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+
+    def register_event_handler(self, event, callback):
+        pass
+
+
+class DummyConfig:
+    def __init__(self, printer):
+        self.printer = printer
+
+    def get_printer(self):
+        return self.printer
+
+    def getint(self, option, default=None, **kw):
+        return default
+
+    getboolean = getint
+
+
+def test_reactor_waits_not_self_time():
+    r = reactor.Reactor()
+    profiler = gcode_profiler.GCodeProfiler(DummyConfig(DummyPrinter(r)))
+    done = []
+
+    def cmd_wait(gcmd):
+        # Blocked in the reactor like M109 or TEMPERATURE_WAIT
+        r.pause(r.monotonic() + 0.050)
+
+    def cmd_macro(gcmd):
+        profiler.run_command("WAIT", cmd_wait, gcmd)
+
+    def run_macro(eventtime):
+        profiler.run_command("MACRO", cmd_macro, None)
+        done.append("macro")
+        return r.NEVER
+
+    def other_task(eventtime):
+        # Pauses of other tasks are not charged to the command
+        r.pause(eventtime + 0.100)
+        done.append("other")
+        r.end()
+        return r.NEVER
+
+    r.register_timer(run_macro, r.NOW)
+    r.register_timer(other_task, r.NOW)
+    r.run()
+    assert done == ["macro", "other"]
+    stats = profiler.get_profile()["commands"]
+    assert 0.045 < stats["WAIT"]["wait_time"] < 0.500
+    # The macro's total includes the nested wait, its own times do not
+    assert stats["MACRO"]["total_time"] >= stats["WAIT"]["total_time"]
+    assert stats["MACRO"]["wait_time"] == 0.0
+    for cmd in ["WAIT", "MACRO"]:
+        assert stats[cmd]["self_time"] < 0.040
+        assert stats[cmd]["calls"] == 1
@@ -0,0 +1,101 @@
+import bisect
+import math
+
+from klippy import chelper
+
+MCU_FREQ = 72000000.0
+STEP_DIST = 0.01
+PRESSURE_ADVANCE = 0.02
+SMOOTH_TIME = 0.04
+
+
+# Short extrusion moves (print_time, move_t, start_pos, start_v, accel)
+def gen_moves(count=1200):
+    moves = []
+    print_time, pos, start_v = 2.0, 0.0, 0.0
+    for i in range(count):
+        move_t = 0.002 + 0.003 * (i % 3)
+        # Vary the speed, starting and ending at a stop
+        target_v = (8.0 + 3.0 * math.sin(i * 0.1)) * min(1.0, i / 20.0)
+        accel = max(-1000.0, min(1000.0, (target_v - start_v) / move_t))
+        if i >= count - 20:
+            accel = -start_v / (move_t + 0.005 * (count - 1 - i))
+        moves.append((print_time, move_t, pos, start_v, accel))
+        print_time += move_t
+        pos += (start_v + 0.5 * accel * move_t) * move_t
+        start_v += accel * move_t
+    return moves
+
+
+def pa_position(moves, t):
+    i = bisect.bisect(moves, (t,)) - 1
+    if i < 0:
+        return moves[0][2]
+    print_time, move_t, pos, start_v, accel = moves[i]
+    mt = t - print_time
+    if mt >= move_t:
+        # Stopped after the last move
+        return pos + (start_v + 0.5 * accel * move_t) * move_t
+    v = start_v + accel * mt
+    return pos + (start_v + 0.5 * accel * mt) * mt + PRESSURE_ADVANCE * v
+
+
+# Smoothed position using numeric integration of the weighted average
+def smooth_position(moves, t, count=400):
+    hst = 0.5 * SMOOTH_TIME
+    total = 0.0
+    for i in range(count):
+        x = t - hst + (i + 0.5) * (2.0 * hst / count)
+        total += pa_position(moves, x) * (hst - abs(t - x))
+    return total * (2.0 * hst / count) / (hst * hst)
+
+
+def test_pressure_advance_smoothing():
+    ffi_main, ffi_lib = chelper.get_ffi()
+    moves = gen_moves()
+    tq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    for print_time, move_t, pos, start_v, accel in moves:
+        end_v = start_v + accel * move_t
+        if accel >= 0.0:
+            ffi_lib.trapq_append(
+                tq, print_time, move_t, 0.0, 0.0, pos, 1.0, 0.0,
+                1.0, 1.0, 0.0, start_v, end_v, accel
+            )  # fmt: skip
+        else:
+            ffi_lib.trapq_append(
+                tq, print_time, 0.0, 0.0, move_t, pos, 1.0, 0.0,
+                1.0, 1.0, 0.0, end_v, start_v, -accel
+            )  # fmt: skip
+    sk = ffi_main.gc(ffi_lib.extruder_stepper_alloc(), ffi_lib.free)
+    ffi_lib.extruder_set_pressure_advance(sk, PRESSURE_ADVANCE, SMOOTH_TIME)
+    sc = ffi_main.gc(ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free)
+    ffi_lib.stepcompress_fill(sc, 0, 0, 0)
+    ss = ffi_lib.steppersync_alloc(ffi_main.NULL, [sc], 1, 0)
+    ss = ffi_main.gc(ss, ffi_lib.steppersync_free)
+    ffi_lib.steppersync_set_time(ss, 0.0, MCU_FREQ)
+    ffi_lib.itersolve_set_stepcompress(sk, sc, STEP_DIST)
+    ffi_lib.itersolve_set_trapq(sk, tq)
+    end_time = moves[-1][0] + moves[-1][1]
+    assert ffi_lib.itersolve_generate_steps(sk, end_time + 1.0) == 0
+    ffi_lib.stepcompress_set_last_position(sc, 1 << 63, 0)
+    data = ffi_main.new("struct pull_history_steps[4096]")
+    count = ffi_lib.stepcompress_extract_old(
+        sc, data, len(data), 0, (1 << 64) - 1
+    )
+    # Each step is taken as the position crosses a half step
+    steps = []
+    for hs in sorted(
+        (data[i] for i in range(count)), key=lambda hs: hs.first_clock
+    ):
+        sdir = 1 if hs.step_count > 0 else -1
+        clock, interval = hs.first_clock, hs.interval
+        for i in range(abs(hs.step_count)):
+            pos = hs.start_position + sdir * i
+            steps.append((clock, (pos + 0.5 * sdir) * STEP_DIST))
+            interval += hs.add
+            clock += interval
+    assert len(steps) > 1000
+    # Check step times spanning several seconds of short moves
+    for clock, step_pos in steps[::7]:
+        pos = smooth_position(moves, clock / MCU_FREQ)
+        assert abs(pos - step_pos) < 0.001 * STEP_DIST
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from klippy.extras import mpc_fit
+
+HEATER_POWER = 40.0
+AMBIENT_TEMP = 25.0
+REPORT_TIME = 0.3
+TRUE_PARAMS = {
+    "block_heat_capacity": 18.0,
+    "sensor_responsiveness": 0.12,
+    "fan_ambient_transfer": [0.14, 0.22, 0.30],
+}
+
+
+def excitation_samples(params, target=200.0, relay_time=40.0):
+    # Full power heatup followed by relay control at each fan speed
+    rnd = random.Random(0)
+    transfers = params["fan_ambient_transfer"]
+    fan_breakpoints = len(transfers)
+    block = sensor = AMBIENT_TEMP
+    duty = 1.0
+    power = 0.0
+    pending = []
+    samples = []
+    read_time = 0.0
+    heating = True
+    fan_speed = 0.0
+    relay_start = None
+    while True:
+        temp = sensor + rnd.gauss(0.0, 0.02)
+        if heating and temp >= target:
+            heating = False
+            relay_start = read_time
+        if not heating:
+            segment = int((read_time - relay_start) // relay_time)
+            if segment >= fan_breakpoints:
+                break
+            fan_speed = segment / (fan_breakpoints - 1)
+            duty = 1.0 if temp < target else 0.0
+        samples.append((read_time, temp, duty, fan_speed))
+        pending.append((read_time + REPORT_TIME, duty))
+        weights = mpc_fit.fan_weights([fan_speed], fan_breakpoints)[0]
+        transfer = sum(w * t for w, t in zip(weights, transfers))
+        for _ in range(30):
+            step_t = REPORT_TIME / 30.0
+            while pending and pending[0][0] <= read_time + 1e-9:
+                power = pending.pop(0)[1] * HEATER_POWER
+            block += (
+                (power - transfer * (block - AMBIENT_TEMP))
+                * step_t
+                / params["block_heat_capacity"]
+            )
+            sensor += (
+                (block - sensor) * params["sensor_responsiveness"] * step_t
+            )
+            read_time += step_t
+        read_time = round(read_time, 9)
+    return samples
+
+
+def test_fit_recovers_model():
+    samples = excitation_samples(TRUE_PARAMS)
+    initial = {
+        "block_heat_capacity": 30.0,
+        "sensor_responsiveness": 0.05,
+        "fan_ambient_transfer": [0.1, 0.1, 0.1],
+    }
+    res = mpc_fit.fit_mpc_model(
+        samples, HEATER_POWER, AMBIENT_TEMP, REPORT_TIME, 3, initial
+    )
+    assert res["block_heat_capacity"] == pytest.approx(18.0, rel=0.02)
+    assert res["sensor_responsiveness"] == pytest.approx(0.12, rel=0.02)
+    assert res["fan_ambient_transfer"] == pytest.approx(
+        TRUE_PARAMS["fan_ambient_transfer"], rel=0.03
+    )
+    assert res["ambient_transfer"] == res["fan_ambient_transfer"][0]
+    assert 0.0 < res["block_heat_capacity_ci"] < 1.0
+    assert res["rms_error"] < 0.05
+
+
+def test_fit_needs_samples():
+    initial = {
+        "block_heat_capacity": 20.0,
+        "sensor_responsiveness": 0.1,
+        "fan_ambient_transfer": [0.1],
+    }
+    samples = [(0.3 * i, 25.0, 0.0, 0.0) for i in range(4)]
+    with pytest.raises(mpc_fit.FitError):
+        mpc_fit.fit_mpc_model(
+            samples, HEATER_POWER, AMBIENT_TEMP, 0.3, 1, initial
+        )
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from klippy.extras import fopdt_fit, heaters, pid_calibrate
+
+GAIN = 240.0
+TIME_CONSTANT = 150.0
+DEAD_TIME = 6.0
+AMBIENT_TEMP = 22.0
+REPORT_TIME = 0.3
+
+
+class DummyGCode:
+    def respond_info(self, msg):
+        pass
+
+
+class DummyPrinter:
+    def lookup_object(self, name):
+        return DummyGCode()
+
+
+class DummyHeater:
+    printer = DummyPrinter()
+
+    def __init__(self):
+        self.pwm = []
+
+    def get_max_power(self):
+        return 1.0
+
+    def set_pwm(self, read_time, value):
+        self.pwm.append((read_time, value))
+
+    def alter_target(self, target):
+        pass
+
+
+def run_step_tune(target=60.0):
+    # Simulate a first order plus dead time heater driven by the tuner
+    rnd = random.Random(0)
+    heater = DummyHeater()
+    tune = pid_calibrate.ControlStepTune(heater, target)
+    temp = AMBIENT_TEMP
+    read_time = 0.0
+    while not tune.done:
+        tune.temperature_update(read_time, temp + rnd.gauss(0.0, 0.02), target)
+        for _ in range(10):
+            read_time += REPORT_TIME / 10.0
+            duty = 0.0
+            for pwm_time, value in heater.pwm:
+                if pwm_time > read_time - DEAD_TIME:
+                    break
+                duty = value
+            temp += (
+                (GAIN * duty - (temp - AMBIENT_TEMP))
+                * (REPORT_TIME / 10.0)
+                / TIME_CONSTANT
+            )
+        assert read_time < 3600.0
+    return tune
+
+
+def test_step_tune_fit():
+    tune = run_step_tune()
+    assert not tune.errored
+    assert tune.step_end is not None
+    model = tune.fit_model()
+    assert model["gain"] == pytest.approx(GAIN, rel=0.03)
+    assert model["time_constant"] == pytest.approx(TIME_CONSTANT, rel=0.03)
+    assert model["dead_time"] == pytest.approx(DEAD_TIME, abs=REPORT_TIME)
+    assert model["ambient_temp"] == pytest.approx(AMBIENT_TEMP, abs=0.5)
+    tune.model = model
+    kp, ki, kd = tune.calc_pid()
+    expected = fopdt_fit.amigo_pid(
+        {"gain": GAIN, "time_constant": TIME_CONSTANT, "dead_time": DEAD_TIME}
+    )
+    base = heaters.PID_PARAM_BASE
+    assert kp == pytest.approx(expected[0] * base, rel=0.05)
+    assert ki == pytest.approx(expected[1] * base, rel=0.05)
+    assert kd == pytest.approx(expected[2] * base, rel=0.05)
+
+
+def test_step_tune_too_hot():
+    heater = DummyHeater()
+    tune = pid_calibrate.ControlStepTune(heater, 60.0)
+    tune.temperature_update(0.0, 59.0, 60.0)
+    assert tune.done and tune.errored
+    assert tune.check_busy(0.0, 0.0, 0.0)
+    assert heater.pwm == [(0.0, 0.0)]
@@ -0,0 +1,95 @@
+import pytest
+
+from klippy.extras import probe_eddy_current
+
+Z_OFFSET = 1.0
+SPEED = 100.0
+SCAN_Z = 2.0
+
+
+def bed_height(x, y):
+    return 0.001 * x - 0.002 * y
+
+
+class DummyTrapQ:
+    # Toolhead moving along x at constant speed and height
+    def get_trapq_position(self, print_time):
+        return (print_time * SPEED, 10.0, SCAN_Z), SPEED
+
+
+class DummyMotionReport:
+    trapqs = {"toolhead": DummyTrapQ()}
+
+
+class DummyToolhead:
+    def __init__(self):
+        self.move_time = 0.0
+
+    def register_lookahead_callback(self, callback):
+        callback(self.move_time)
+
+    def get_last_move_time(self):
+        return self.move_time
+
+
+@pytest.fixture
+def scan_printer(printer):
+    printer.add_object("toolhead", DummyToolhead())
+    printer.add_object("motion_report", DummyMotionReport())
+    return printer
+
+
+class DummySensor:
+    def __init__(self):
+        self.clients = []
+
+    def get_mcu(self):
+        return None
+
+    def add_client(self, cb):
+        self.clients.append(cb)
+
+    def send_samples(self, start_time, end_time):
+        data = []
+        t = start_time
+        while t < end_time:
+            x, y, z = DummyTrapQ().get_trapq_position(t)[0]
+            data.append((t, 0.0, z - bed_height(x, y)))
+            t += 0.004
+        return [cb({"data": data}) for cb in self.clients]
+
+
+def test_rapid_scan_results(scan_printer, make_gcmd):
+    sensor = DummySensor()
+    scan = probe_eddy_current.EddyScanningProbe(
+        scan_printer, sensor, Z_OFFSET, make_gcmd()
+    )
+    toolhead = scan_printer.lookup_object("toolhead")
+    for i in range(1, 5):
+        toolhead.move_time = 0.5 * i
+        scan.run_probe()
+    assert sensor.send_samples(0.0, 3.0) == [True]
+    results = scan.pull_probed_results()
+    assert len(results) == 4
+    for i, pos in enumerate(results):
+        x = 0.5 * (i + 1) * SPEED
+        assert pos[:2] == [x, 10.0]
+        assert pos[2] == pytest.approx(Z_OFFSET + bed_height(x, 10.0))
+    # Samples outside the scan windows are discarded
+    assert len(scan._samples) < 30
+    scan.end_probe_session()
+    assert sensor.send_samples(3.0, 3.1) == [False]
+
+
+def test_rapid_scan_out_of_range(scan_printer, make_gcmd):
+    sensor = DummySensor()
+    scan = probe_eddy_current.EddyScanningProbe(
+        scan_printer, sensor, Z_OFFSET, make_gcmd()
+    )
+    scan_printer.lookup_object("toolhead").move_time = 0.5
+    scan.run_probe()
+    sensor.clients[0](
+        {"data": [(0.45, 0.0, 2.0), (0.5, 0.0, 99.9), (0.6, 0.0, 2.0)]}
+    )
+    with pytest.raises(Exception, match="not in valid range"):
+        scan.pull_probed_results()
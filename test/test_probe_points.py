@@ -0,0 +1,135 @@
+import pytest
+
+from klippy.extras import probe
+
+POINTS = [(10.0, 10.0), (50.0, 10.0), (50.0, 50.0)]
+
+
+class DummyMacro:
+    def load_template(self, config, option, default):
+        return None
+
+
+class DummyToolhead:
+    def __init__(self):
+        self.events = []
+        self.pos = [0.0, 0.0, 10.0, 0.0]
+
+    def get_position(self):
+        return list(self.pos)
+
+    def manual_move(self, coord, speed):
+        for i, c in enumerate(coord):
+            if c is not None:
+                self.pos[i] = c
+        self.events.append(("move", tuple(coord)))
+
+    def get_last_move_time(self):
+        self.events.append(("flush",))
+        return 0.0
+
+
+class DummyProbe:
+    def __init__(self, toolhead):
+        self.toolhead = toolhead
+
+    def get_lift_speed(self, gcmd=None):
+        return 5.0
+
+    def get_offsets(self):
+        return 0.0, 0.0, 1.0
+
+    def multi_probe_begin(self):
+        pass
+
+    def multi_probe_end(self):
+        pass
+
+    def run_probe(self, gcmd, retry_session, after_trigger=None):
+        self.toolhead.pos[2] = 0.5
+        self.toolhead.events.append(("probe",))
+        if after_trigger is not None:
+            after_trigger()
+        self.toolhead.events.append(("result",))
+        return self.toolhead.get_position()[:3]
+
+
+@pytest.fixture
+def toolhead(printer):
+    toolhead = DummyToolhead()
+    printer.add_object("gcode_macro", DummyMacro())
+    printer.add_object("toolhead", toolhead)
+    printer.add_object("probe", DummyProbe(toolhead))
+    return toolhead
+
+
+def run_helper(make_config, make_gcmd, finalize):
+    helper = probe.ProbePointsHelper(
+        make_config(name="test_helper"), finalize, default_points=POINTS
+    )
+    helper.start_probe(make_gcmd())
+
+
+def test_lift_before_finalize(toolhead, make_config, make_gcmd):
+    calls = []
+
+    def finalize(offsets, results):
+        calls.append(list(toolhead.events))
+
+    run_helper(make_config, make_gcmd, finalize)
+    # The final lift is queued and flushed before the results are
+    # processed
+    assert calls[0][-4:] == [
+        ("probe",),
+        ("move", (None, None, 5.0)),
+        ("result",),
+        ("flush",),
+    ]
+
+
+def test_moves_queued_at_trigger(toolhead, make_config, make_gcmd):
+    run_helper(make_config, make_gcmd, lambda offsets, results: None)
+    # The lift and travel to the next point are queued before the
+    # result is processed, and not queued again afterwards
+    lift = ("move", (None, None, 5.0))
+    assert toolhead.events[:10] == [
+        lift,
+        ("move", (10.0, 10.0, None)),
+        ("probe",),
+        lift,
+        ("move", (50.0, 10.0, None)),
+        ("result",),
+        ("probe",),
+        lift,
+        ("move", (50.0, 50.0, None)),
+        ("result",),
+    ]
+
+
+def test_lift_depends_on_results(toolhead, make_config, make_gcmd):
+    config = make_config(name="test_helper", adaptive_horizontal_move_z=True)
+    helper = probe.ProbePointsHelper(
+        config, lambda offsets, results: 0.0, default_points=POINTS
+    )
+    helper.start_probe(make_gcmd())
+    # Nothing is queued until the results are known
+    assert toolhead.events[2:5] == [
+        ("probe",),
+        ("result",),
+        ("move", (None, None, 5.0)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "strategy, accepted",
+    [("fail", False), ("ignore", True), ("retry", False), ("circle", False)],
+)
+def test_accepts_probe(toolhead, make_config, make_gcmd, strategy, accepted):
+    session = probe.RetrySession(make_config(bad_probe_strategy=strategy))
+    session.start(make_gcmd())
+    session.set_position([10.0, 10.0])
+    assert session.accepts_probe(True)
+    assert session.accepts_probe(False) == accepted
+    # Looking up another point leaves the session position alone
+    assert session.get_probe_position_at([50.0, 10.0]) == (50.0, 10.0, None)
+    assert session.get_position() == (10.0, 10.0)
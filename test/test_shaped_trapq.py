@@ -0,0 +1,136 @@
+import pytest
+
+from klippy import chelper
+from klippy.extras import shaper_defs
+
+MCU_FREQ = 72000000.0
+STEP_DIST = 0.0125
+NEVER = 9999999999999999.9
+
+
+class ShapedAxis:
+    def __init__(self):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.tq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+        self.sq = ffi_main.gc(
+            ffi_lib.shaped_trapq_alloc(self.tq), ffi_lib.shaped_trapq_free
+        )
+        A, T = shaper_defs.get_zv_shaper(40.0, 0.1)
+        ffi_lib.shaped_trapq_set_shaper_params(self.sq, b"x", len(A), A, T)
+        # Pulses as applied by kin_shaper.c (reversed and centered)
+        total = sum(A)
+        self.pulses = [(a / total, -t) for a, t in zip(A, T)]
+        ts = sum(a * t for a, t in self.pulses)
+        self.pulses = [(a, t - ts) for a, t in self.pulses]
+        # An input shaped cartesian stepper reading from the shaped trapq
+        self.orig_sk = ffi_main.gc(
+            ffi_lib.cartesian_stepper_alloc(b"x"), ffi_lib.free
+        )
+        self.sk = ffi_main.gc(ffi_lib.input_shaper_alloc(), ffi_lib.free)
+        assert ffi_lib.input_shaper_set_sk(self.sk, self.orig_sk) == 0
+        ffi_lib.input_shaper_set_shaper_params(self.sk, b"x", len(A), A, T)
+        ffi_lib.input_shaper_set_shaped_trapq(self.sk, self.sq)
+        self.sc = ffi_main.gc(
+            ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free
+        )
+        ffi_lib.stepcompress_fill(self.sc, int(0.000025 * MCU_FREQ), 0, 0)
+        ss = ffi_lib.steppersync_alloc(ffi_main.NULL, [self.sc], 1, 0)
+        self.ss = ffi_main.gc(ss, ffi_lib.steppersync_free)
+        ffi_lib.steppersync_set_time(self.ss, 0.0, MCU_FREQ)
+        ffi_lib.itersolve_set_stepcompress(self.sk, self.sc, STEP_DIST)
+        ffi_lib.itersolve_set_trapq(self.sk, self.tq)
+        self.moves = []
+        self.speed = 0.0
+
+    def append_move(self, print_time, start_x, end_x, speed, accel):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        dist = abs(end_x - start_x)
+        accel_t = speed / accel
+        cruise_t = (dist - speed * accel_t) / speed
+        axis_r = 1.0 if end_x > start_x else -1.0
+        ffi_lib.trapq_append(
+            self.tq, print_time, accel_t, cruise_t, accel_t,
+            start_x, 0.0, 0.0, axis_r, 0.0, 0.0, 0.0, speed, accel
+        )  # fmt: skip
+        self.moves.append((print_time, start_x, axis_r, accel_t, cruise_t))
+        self.speed = speed
+        return print_time + 2.0 * accel_t + cruise_t
+
+    def set_position(self, print_time, x):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        # Like toolhead.set_position() after an aborted drip move
+        ffi_lib.trapq_finalize_moves(self.tq, NEVER, 0.0)
+        ffi_lib.trapq_set_position(self.tq, print_time, x, 0.0, 0.0)
+        ffi_lib.shaped_trapq_reset(self.sq)
+        self.moves = [(print_time, x, 0.0, 0.0, 0.0)]
+
+    def generate_steps(self, flush_time):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        assert ffi_lib.itersolve_generate_steps(self.sk, flush_time) == 0
+
+    def shaped_position(self, print_time):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        res = ffi_main.new("double[6]")
+        if ffi_lib.shaped_trapq_get_position(self.sq, print_time, res):
+            return None
+        return res[0]
+
+    def trapq_position(self, t):
+        pos = 0.0
+        for print_time, start_x, axis_r, accel_t, cruise_t in self.moves:
+            if t < print_time:
+                break
+            if not axis_r:
+                # Position set marker
+                pos = start_x
+                continue
+            # Symmetric trapezoid: accelerate, cruise, decelerate
+            v = self.speed
+            mt = min(t - print_time, 2.0 * accel_t + cruise_t)
+            d = 0.5 * v / accel_t * min(mt, accel_t) ** 2
+            if mt > accel_t:
+                d += v * min(mt - accel_t, cruise_t)
+            if mt > accel_t + cruise_t:
+                dt = mt - accel_t - cruise_t
+                d += v * dt - 0.5 * v / accel_t * dt**2
+            pos = start_x + axis_r * d
+        return pos
+
+    def expected_position(self, print_time):
+        return sum(
+            a * self.trapq_position(print_time + t) for a, t in self.pulses
+        )
+
+
+def test_shaped_position():
+    axis = ShapedAxis()
+    axis.append_move(10.0, 0.0, 100.0, 50.0, 3000.0)
+    # Shaped motion is only available once steps were generated
+    assert axis.shaped_position(10.5) is None
+    axis.generate_steps(11.0)
+    for t in [10.01, 10.02, 10.5, 10.99]:
+        assert axis.shaped_position(t) == pytest.approx(
+            axis.expected_position(t)
+        )
+    assert axis.shaped_position(11.5) is None
+
+
+def test_homing_abort():
+    axis = ShapedAxis()
+    # Homing move from 0 to 100, interrupted while cruising at t=11
+    axis.append_move(10.0, 0.0, 100.0, 50.0, 3000.0)
+    axis.generate_steps(11.0)
+    assert axis.shaped_position(10.95) == pytest.approx(
+        axis.expected_position(10.95)
+    )
+    axis.set_position(11.0, 5.0)
+    # Pieces using the interrupted homing move are discarded
+    assert axis.shaped_position(10.95) is None
+    # Retract from 5 to 0
+    end_time = axis.append_move(11.5, 5.0, 0.0, 5.0, 3000.0)
+    axis.generate_steps(end_time + 0.1)
+    for t in [11.51, 11.6, 11.9, 12.4]:
+        assert axis.shaped_position(t) == pytest.approx(
+            axis.expected_position(t)
+        )
+    assert axis.shaped_position(11.9) == pytest.approx(3.0, abs=0.01)
@@ -0,0 +1,65 @@
+import math
+
+from klippy import chelper
+
+MCU_FREQ = 72000000
+MAX_ERROR = 1800
+
+
+# Step clocks of a stepper accelerating, cruising and decelerating
+def gen_step_clocks(step_dist=0.0125, accel=10000.0, cruise_v=300.0):
+    clocks = []
+    accel_d = cruise_v**2 / (2.0 * accel)
+    accel_t = cruise_v / accel
+    for i in range(1, int(3.0 * accel_d / step_dist)):
+        d = i * step_dist
+        if d <= accel_d:
+            t = math.sqrt(2.0 * d / accel)
+        elif d <= 2.0 * accel_d:
+            t = accel_t + (d - accel_d) / cruise_v
+        else:
+            rem = 3.0 * accel_d - d
+            t = 2.0 * accel_t + accel_t - math.sqrt(2.0 * rem / accel)
+        clocks.append(int(MCU_FREQ * (0.1 + t)))
+    return clocks
+
+
+def compress(clocks):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    sc = ffi_main.gc(ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free)
+    ffi_lib.stepcompress_fill(sc, MAX_ERROR, 0, 0)
+    ret = ffi_lib.stepcompress_queue_steps(
+        sc, 1, ffi_main.new("uint64_t[]", clocks), len(clocks)
+    )
+    assert ret == 0
+    ret = ffi_lib.stepcompress_set_last_position(sc, 1 << 63, 0)
+    assert ret == 0
+    data = ffi_main.new("struct pull_history_steps[4096]")
+    count = ffi_lib.stepcompress_extract_old(
+        sc, data, len(data), 0, (1 << 64) - 1
+    )
+    moves = [data[i] for i in range(count) if data[i].step_count]
+    moves.reverse()
+    steps = []
+    for hs in moves:
+        clock, interval = hs.first_clock, hs.interval
+        for i in range(hs.step_count):
+            steps.append(clock)
+            interval += hs.add
+            clock += interval
+    return moves, steps
+
+
+def test_compress_within_max_error():
+    clocks = gen_step_clocks()
+    moves, steps = compress(clocks)
+    assert len(steps) == len(clocks)
+    prev = None
+    for req, actual in zip(clocks, steps):
+        max_error = MAX_ERROR
+        if prev is not None:
+            max_error = min(max_error, (req - prev) // 2)
+        assert req - max_error <= actual <= req
+        prev = req
+    # The accel, cruise and decel phases compress to few commands
+    assert len(moves) < len(clocks) / 50
@@ -0,0 +1,107 @@
+import math
+
+import pytest
+
+from klippy import chelper
+
+
+@pytest.fixture
+def trapq():
+    ffi_main, ffi_lib = chelper.get_ffi()
+    tq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    # 1000 moves along X, each accelerating, cruising and decelerating
+    print_time = 1.0
+    for i in range(1000):
+        ffi_lib.trapq_append(
+            tq, print_time, 0.01, 0.02, 0.01,
+            float(i), 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 50.0, 5000.0
+        )  # fmt: skip
+        print_time += 0.05
+    ffi_lib.trapq_finalize_moves(tq, print_time, 0.0)
+    return tq
+
+
+def extract_all(tq, start_time, end_time):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    data = ffi_main.new("struct pull_move[4096]")
+    count = ffi_lib.trapq_extract_old(tq, data, len(data), start_time, end_time)
+    return [(data[i].print_time, data[i].start_x) for i in range(count)]
+
+
+def test_extract_old(trapq):
+    moves = extract_all(trapq, 0.0, 100.0)
+    assert len(moves) == 3000
+    assert moves[0][0] > moves[-1][0]
+    moves = extract_all(trapq, 10.005, 10.055)
+    assert [pt for pt, x in moves] == pytest.approx([10.05, 10.03, 10.01, 10.0])
+
+
+def test_get_positions(trapq):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    times = [0.5, 1.0, 1.005, 1.025, 25.04, 100.0]
+    out = ffi_main.new("double[]", len(times) * 4)
+    count = ffi_lib.trapq_get_positions(
+        trapq, ffi_main.new("double[]", times), len(times), out
+    )
+    assert count == 4
+    assert math.isnan(out[0]) and math.isnan(out[4])
+    # Halfway through the first acceleration
+    assert out[8] == pytest.approx(0.5 * 5000.0 * 0.005**2)
+    assert out[11] == pytest.approx(25.0)
+    # During a cruise
+    assert out[12] == pytest.approx(0.25 + 50.0 * 0.015)
+    assert out[15] == pytest.approx(50.0)
+    # Final move is held at its end position
+    assert out[20] == pytest.approx(999.0 + 1.5)
+    assert out[23] == pytest.approx(0.0)
+
+
+def test_set_position(trapq):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    ffi_lib.trapq_set_position(trapq, 20.0, 5.0, 6.0, 7.0)
+    moves = extract_all(trapq, 0.0, 100.0)
+    assert moves[0] == (20.0, 5.0)
+    assert moves[1][0] < 20.0
+    out = ffi_main.new("double[4]")
+    times = ffi_main.new("double[]", [30.0])
+    ffi_lib.trapq_get_positions(trapq, times, 1, out)
+    assert list(out) == [5.0, 6.0, 7.0, 0.0]
+    # Expire old history
+    ffi_lib.trapq_finalize_moves(trapq, 30.0, 19.0)
+    moves = extract_all(trapq, 0.0, 100.0)
+    assert moves[0] == (20.0, 5.0)
+    assert min(pt for pt, x in moves) > 18.9
+
+
+def test_scurve_positions():
+    ffi_main, ffi_lib = chelper.get_ffi()
+    tq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    ffi_lib.trapq_append_scurve(
+        tq, 1.0, 0.01, 0.02, 0.01,
+        0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 50.0, 5000.0
+    )  # fmt: skip
+    ffi_lib.trapq_finalize_moves(tq, 2.0, 0.0)
+    times = [1.005, 1.01, 1.035, 1.04]
+    out = ffi_main.new("double[]", len(times) * 4)
+    ffi_lib.trapq_get_positions(
+        tq, ffi_main.new("double[]", times), len(times), out
+    )
+    # Halfway through the acceleration (smoothstep velocity profile)
+    half_d = 5000.0 * 0.01**2 * (0.5**3 - 0.5**4 / 2)
+    assert out[0] == pytest.approx(half_d)
+    assert out[3] == pytest.approx(25.0)
+    # Phase ends match the trapezoid profile
+    assert out[4] == pytest.approx(0.25)
+    assert out[7] == pytest.approx(50.0)
+    assert out[8] == pytest.approx(1.25 + 50.0 * 0.005 - half_d)
+    assert out[12] == pytest.approx(1.5)
+    assert out[15] == pytest.approx(0.0)
+    # History reports the polynomial terms of each phase
+    data = ffi_main.new("struct pull_move[4]")
+    count = ffi_lib.trapq_extract_old(tq, data, len(data), 0.0, 2.0)
+    assert count == 3
+    for m, t, pos in zip(data, [1.035, 1.01, 1.005], [out[8], 0.25, out[0]]):
+        mt = t - m.print_time
+        dist = (m.start_v + (0.5 * m.accel + (m.c3 + m.c4 * mt) * mt) * mt) * mt
+        assert m.start_x + m.x_r * dist == pytest.approx(pos)
+    assert data[1].c3 == data[1].c4 == 0.0